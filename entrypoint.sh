@@ -26,6 +26,9 @@ else:
     print("ℹ️  Ya existe un superusuario.")
 EOF
 
-# Inicia el servidor de desarrollo
-echo "Iniciando servidor de desarrollo..."
-exec python investment_portfolio/manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+# Métricas de una ejecución anterior (ver PROMETHEUS_MULTIPROC_DIR)
+rm -rf "${PROMETHEUS_MULTIPROC_DIR:-/tmp/investment_portfolio_metrics}"
+
+# Inicia el servidor ASGI (gunicorn con workers uvicorn, ver gunicorn_config.py)
+echo "Iniciando servidor ASGI..."
+exec gunicorn --config gunicorn_config.py
\ No newline at end of file
@@ -1,2 +1,9 @@
+from pathlib import Path
+
+# Perfil ASGI: las vistas async (valorización y trades) corren en workers
+# uvicorn; cada worker atiende muchas solicitudes a la vez en su event loop
 bind = "0.0.0.0:8000"
-workers = 3
\ No newline at end of file
+workers = 3
+worker_class = "uvicorn_worker.UvicornWorker"
+chdir = str(Path(__file__).resolve().parent / "investment_portfolio")
+wsgi_app = "config.asgi:application"
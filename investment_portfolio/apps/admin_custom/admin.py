@@ -2,11 +2,16 @@ from django.contrib import admin
 from django.contrib.admin import AdminSite
 from django.urls import path
 
-from ..portfolios.models import (Amount, Asset, HoldingSnapshot, Portfolio,
-                                 PortfolioEvent, PortfolioValue, Price,
-                                 Quantity, Weight)
-from .views import (pre_weights_chart_view, trade_simulation_view,
-                    upload_excel_view, weights_chart_view)
+from ..portfolios.models import (Amount, Asset, HoldingSnapshot,
+                                 MaterializedWeight, Portfolio, PortfolioEvent,
+                                 PortfolioValuationState, PortfolioValue,
+                                 Price, Quantity, Weight)
+from .models import IngestionJob
+from .views import (ingestion_job_status_view, ingestion_job_view,
+                    pre_weights_chart_view, profile_capture_view,
+                    profile_captures_view, trade_simulation_view,
+                    upload_excel_view, weights_chart_data_view,
+                    weights_chart_view)
 
 
 class PortfolioAdminSite(AdminSite):
@@ -21,8 +26,18 @@ class PortfolioAdminSite(AdminSite):
                  self.admin_view(pre_weights_chart_view), name="pre_weights_chart"),
             path("graficos-evolucion/<int:pk>/",
                  self.admin_view(weights_chart_view), name="weights_chart"),
+            path("graficos-evolucion/<int:pk>/datos/",
+                 self.admin_view(weights_chart_data_view), name="weights_chart_data"),
             path("graficos-trade/", self.admin_view(trade_simulation_view),
                  name="admin_trade_simulation"),
+            path("cargas/<int:pk>/", self.admin_view(ingestion_job_view),
+                 name="ingestion_job"),
+            path("cargas/<int:pk>/estado/", self.admin_view(ingestion_job_status_view),
+                 name="ingestion_job_status"),
+            path("diagnosticos/", self.admin_view(profile_captures_view),
+                 name="profile_captures"),
+            path("diagnosticos/<str:capture_id>/", self.admin_view(profile_capture_view),
+                 name="profile_capture"),
         ]
         return custom_urls + urls
 
@@ -94,6 +109,29 @@ class PortfolioValueAdmin(admin.ModelAdmin):
     ordering = ("-date",)
 
 
+@admin.register(MaterializedWeight)
+class MaterializedWeightAdmin(admin.ModelAdmin):
+    list_display = ("portfolio", "asset", "date", "amount", "weight")
+    list_filter = ("portfolio", "asset")
+    date_hierarchy = "date"
+    ordering = ("-date",)
+
+
+@admin.register(PortfolioValuationState)
+class PortfolioValuationStateAdmin(admin.ModelAdmin):
+    list_display = ("portfolio", "materialized_through", "dirty_since", "updated_at")
+    readonly_fields = ("updated_at",)
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "file_name", "user", "status", "stage", "attempts", "created_at", "started_at",
+                    "finished_at")
+    list_filter = ("status", "incremental")
+    readonly_fields = ("report", "error", "created_at", "started_at", "heartbeat_at", "finished_at", "attempts")
+    ordering = ("-created_at",)
+
+
 # ✅ Instancia del Admin personalizado
 admin_site = PortfolioAdminSite(name="PortfolioAdmin")
 
@@ -107,3 +145,6 @@ admin_site.register(Amount, AmountAdmin)
 admin_site.register(PortfolioEvent, PortfolioEventAdmin)
 admin_site.register(HoldingSnapshot, HoldingSnapshotAdmin)
 admin_site.register(PortfolioValue, PortfolioValueAdmin)
+admin_site.register(MaterializedWeight, MaterializedWeightAdmin)
+admin_site.register(PortfolioValuationState, PortfolioValuationStateAdmin)
+admin_site.register(IngestionJob, IngestionJobAdmin)
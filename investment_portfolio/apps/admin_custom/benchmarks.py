@@ -0,0 +1,252 @@
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import django
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory
+
+from ..portfolios.materialization import ensure_materialized
+from ..portfolios.models import Portfolio
+from ..portfolios.price_cache import private_panel, shared_panel
+from ..portfolios.segment_cache import segment_cache
+from .synthetic import SYNTHETIC_START, load_synthetic, synthetic_symbols, write_synthetic_excel
+from .utils import process_excel_file
+
+# activos x portafolios x días de precios x eventos por portafolio
+SIZES = {
+    "small": (10, 2, 365, 10),
+    "medium": (50, 10, 1000, 50),
+    "large": (200, 50, 2500, 200),
+}
+REPORT_VERSION = 1
+EMPTY_BODIES = (b"", b"[]", b"{}")
+
+
+class BenchmarkError(Exception):
+    """Un caso no devolvió una respuesta válida: su medición no sirve."""
+
+
+def parse_size(value):
+    """``small``/``medium``/``large`` o ``activosxportafoliosxdíasxeventos``."""
+    if value in SIZES:
+        return value, SIZES[value]
+    parts = value.lower().split("x")
+    if len(parts) != 4 or not all(part.isdigit() for part in parts):
+        raise ValueError(f"Tamaño inválido: {value}. Use {', '.join(SIZES)} o AxPxDxE (p. ej. 20x5x730x40)")
+    assets, portfolios, days, events = map(int, parts)
+    if assets < 2 or portfolios < 1 or days < 2:
+        raise ValueError(f"Tamaño inválido: {value}. Se necesitan al menos 2 activos, 1 portafolio y 2 días")
+    return value, (assets, portfolios, days, events)
+
+
+def measure(fn, repeat=3, prices_changed=False):
+    """Mide ``fn`` dentro de un savepoint que se revierte en cada corrida.
+
+    Así todas las corridas parten del mismo estado (una valorización en frío
+    sigue en frío). El tiempo es la mediana de ``repeat`` corridas; consultas
+    y memoria pico (tracemalloc) salen de una corrida extra, para que el
+    costo de tracemalloc no afecte los tiempos. ``prices_changed`` indica que
+    ``fn`` escribe precios: el panel compartido se rearma tras cada corrida.
+    """
+    times = []
+    for _ in range(repeat):
+        _, elapsed = _isolated(fn, prices_changed)
+        times.append(elapsed)
+
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            outcome, _ = _isolated(fn, prices_changed)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "wall_time_s": round(statistics.median(times), 6),
+        "wall_time_min_s": round(min(times), 6),
+        "queries": len(queries),
+        "peak_memory_mb": round(peak / 2**20, 3),
+        **(outcome or {}),
+    }
+
+
+def _isolated(fn, prices_changed=False):
+    try:
+        with transaction.atomic():
+            started = time.perf_counter()
+            outcome = fn()
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+    finally:
+        # Lo revertido no debe quedar en las cachés en memoria ni en el panel compartido
+        _reset_caches(prices_changed)
+    return outcome, elapsed
+
+
+def _reset_caches(prices_changed):
+    """Descarta los tramos en caché y, si cambiaron los precios, publica y
+    arma otra versión del panel compartido.
+
+    El panel se versiona directamente: ``invalidate_price_panel`` espera a
+    que se confirme la transacción, y las de los benchmarks se revierten.
+    """
+    segment_cache().clear()
+    if prices_changed and settings.PRICE_PANEL_CACHE_ENABLED:
+        panel = shared_panel()
+        panel.bump_version()
+        panel.refresh()
+
+
+def _call(method, name, data=None, **kwargs):
+    """Llama a un endpoint sin pasar por HTTP y devuelve estado y tamaño.
+
+    Una respuesta con error o vacía lanza :class:`BenchmarkError`: medirla
+    no dice nada del caso.
+    """
+    path = reverse(name, kwargs=kwargs)
+    factory = APIRequestFactory()
+    if method == "get":
+        request = factory.get(path, data)
+    else:
+        request = factory.post(path, data, format="json")
+    match = resolve(path)
+    view = async_to_sync(match.func) if iscoroutinefunction(match.func) else match.func
+    response = view(request, *match.args, **match.kwargs)
+    if hasattr(response, "render"):
+        response.render()
+    if not response.streaming:
+        body = response.content
+    elif response.is_async:
+        body = async_to_sync(_aread)(response.streaming_content)
+    else:
+        body = b"".join(response.streaming_content)
+    if not 200 <= response.status_code < 300:
+        raise BenchmarkError(f"{method.upper()} {path}: HTTP {response.status_code} {body[:200]!r}")
+    if body.strip() in EMPTY_BODIES:
+        raise BenchmarkError(f"{method.upper()} {path}: respuesta vacía")
+    return {"status": response.status_code, "response_bytes": len(body)}
+
+
+async def _aread(chunks):
+    return b"".join([chunk async for chunk in chunks])
+
+
+def benchmark_size(label, assets, portfolios, days, events, repeat=3, seed=0, on_case=None):
+    """Corre todos los casos para un tamaño de datos y devuelve sus filas.
+
+    Los datos sintéticos se cargan en una transacción que se revierte al
+    final: la base queda como estaba. El panel de precios compartido es uno
+    propio de la corrida, así los precios sin confirmar no llegan a otros
+    procesos.
+    """
+    report = on_case or (lambda row: None)
+    size = {"size": label, "assets": assets, "portfolios": portfolios, "days": days, "events": events}
+    rows = []
+
+    def record(case, fn, prices_changed=False):
+        row = {**size, "case": case, **measure(fn, repeat, prices_changed)}
+        rows.append(row)
+        report(row)
+
+    start = SYNTHETIC_START
+    end = start + timedelta(days=days - 1)
+    trade_date = start + timedelta(days=days // 2)
+    sell, buy = synthetic_symbols(assets, seed)[:2]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Excel aparte, con otra semilla para que sus activos no choquen con los cargados
+        excel_path = os.path.join(tmp, "synthetic.xlsx")
+        write_synthetic_excel(excel_path, assets, portfolios, days, seed + 1)
+
+        try:
+            with private_panel(), transaction.atomic():
+                user = get_user_model().objects.create(username=f"benchmark-{uuid.uuid4().hex[:12]}")
+                portfolio_ids = load_synthetic(user.id, assets, portfolios, days, events, seed)
+                _reset_caches(prices_changed=True)
+                pk = portfolio_ids[0]
+                value_params = {"dateStart": start.isoformat(), "dateEnd": end.isoformat()}
+
+                def etl():
+                    process_excel_file(excel_path, user.id)
+
+                record("etl", etl, prices_changed=True)
+                record("value_cold", lambda: _call("get", "portfolio-value", value_params, pk=pk))
+
+                for portfolio in Portfolio.objects.filter(id__in=portfolio_ids):
+                    ensure_materialized(portfolio)
+
+                record("value", lambda: _call("get", "portfolio-value", value_params, pk=pk))
+                record("batch_value", lambda: _call(
+                    "post", "portfolio-value-batch", {"portfolio_ids": portfolio_ids, **value_params}))
+                trade = {"date": trade_date.isoformat(), "sell_asset_symbol": sell, "buy_asset_symbol": buy,
+                         "amount": 1_000_000_000 / assets * 0.01}
+                record("trade_dry_run", lambda: _call(
+                    "post", "portfolio-trade", {**trade, "dry_run": True, "date_end": end.isoformat()}, pk=pk))
+                record("trade", lambda: _call("post", "portfolio-trade", trade, pk=pk))
+
+                transaction.set_rollback(True)
+        finally:
+            segment_cache().clear()
+    return rows
+
+
+def run_benchmarks(sizes, repeat=3, seed=0, on_case=None):
+    """Reporte JSON-serializable con los casos de todos los ``sizes``
+    (pares ``(etiqueta, (activos, portafolios, días, eventos))``)."""
+    results = []
+    for label, (assets, portfolios, days, events) in sizes:
+        results.extend(benchmark_size(label, assets, portfolios, days, events, repeat, seed, on_case))
+    return {
+        "version": REPORT_VERSION,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "repeat": repeat,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare_reports(current, baseline, tolerance=0.2):
+    """Casos que empeoraron respecto de ``baseline``.
+
+    Un caso empeora si su tiempo supera al de la línea base en más de
+    ``tolerance`` (fracción), si hace más consultas o si cambia su estado
+    HTTP. Devuelve filas ``(tamaño, caso, métrica, antes, después)``.
+    """
+    before = {(row["size"], row["case"]): row for row in baseline.get("results", [])}
+    regressions = []
+    for row in current["results"]:
+        old = before.get((row["size"], row["case"]))
+        if old is None:
+            continue
+        key = (row["size"], row["case"])
+        if row["wall_time_s"] > old["wall_time_s"] * (1 + tolerance):
+            regressions.append((*key, "wall_time_s", old["wall_time_s"], row["wall_time_s"]))
+        if row["queries"] > old["queries"]:
+            regressions.append((*key, "queries", old["queries"], row["queries"]))
+        if row.get("status") != old.get("status"):
+            regressions.append((*key, "status", old.get("status"), row.get("status")))
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,102 @@
+import os
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import IngestionJob
+from .utils import process_excel_file
+
+
+def enqueue_excel(file_path, file_name, user_id, initial_amount, incremental=False):
+    """Registra una carga de Excel pendiente para el worker."""
+    return IngestionJob.objects.create(
+        user_id=user_id,
+        file_path=file_path,
+        file_name=file_name,
+        initial_amount=initial_amount,
+        incremental=incremental,
+    )
+
+
+def claim_jobs(limit):
+    """Toma hasta ``limit`` trabajos pendientes y los marca en ejecución.
+
+    También retoma los trabajos en ejecución cuyo worker dejó de dar señales
+    de vida por más de ``INGESTION_JOB_LEASE_SECONDS`` (p. ej. murió el
+    proceso); los que ya agotaron ``INGESTION_JOB_MAX_ATTEMPTS`` intentos se
+    marcan como fallidos. ``skip_locked`` permite correr varios workers sin
+    tomar el mismo trabajo.
+    """
+    now = timezone.now()
+    stale = Q(status=IngestionJob.Status.RUNNING,
+              heartbeat_at__lt=now - timedelta(seconds=settings.INGESTION_JOB_LEASE_SECONDS))
+    exhausted = Q(attempts__gte=settings.INGESTION_JOB_MAX_ATTEMPTS)
+    with transaction.atomic():
+        jobs = IngestionJob.objects.select_for_update(skip_locked=True)
+        abandoned = list(jobs.filter(stale & exhausted).values_list("id", flat=True))
+        IngestionJob.objects.filter(id__in=abandoned).update(
+            status=IngestionJob.Status.FAILED, finished_at=now,
+            error="El worker dejó de responder y se agotaron los intentos")
+
+        ids = list(
+            jobs.filter(Q(status=IngestionJob.Status.PENDING) | (stale & ~exhausted))
+            .order_by("created_at")
+            .values_list("id", flat=True)[:limit]
+        )
+        IngestionJob.objects.filter(id__in=ids).update(
+            status=IngestionJob.Status.RUNNING, started_at=now, heartbeat_at=now,
+            attempts=F("attempts") + 1)
+    return ids
+
+
+def run_job(job_id):
+    """Ejecuta el ETL de un trabajo y guarda su resultado."""
+    close_old_connections()
+    job = IngestionJob.objects.get(pk=job_id)
+
+    def on_progress(stage):
+        IngestionJob.objects.filter(pk=job_id).update(stage=stage, heartbeat_at=timezone.now())
+
+    try:
+        with _heartbeat(job_id):
+            job.report = process_excel_file(
+                job.file_path, job.user_id, job.initial_amount,
+                incremental=job.incremental, on_progress=on_progress,
+            )
+        job.status = IngestionJob.Status.SUCCEEDED
+    except Exception as e:
+        job.status = IngestionJob.Status.FAILED
+        job.error = str(e)
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=["report", "status", "error", "finished_at"])
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+    return job.status
+
+
+@contextmanager
+def _heartbeat(job_id):
+    """Renueva el latido del trabajo mientras corre el bloque, para que
+    :func:`claim_jobs` no lo retome aunque una etapa sea larga."""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.INGESTION_JOB_LEASE_SECONDS / 3):
+                IngestionJob.objects.filter(pk=job_id).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"ingestion-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,330 @@
+import os
+import random
+import runpy
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+import numpy as np
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Max, Min
+from django.urls import reverse
+from prometheus_client.parser import text_string_to_metric_families
+
+from ..portfolios.models import Portfolio, Price, Weight
+from .synthetic import load_synthetic
+
+PROJECT_DIR = settings.BASE_DIR / "investment_portfolio"
+GUNICORN_CONFIG = settings.BASE_DIR / "gunicorn_config.py"
+SERVERS = ("gunicorn", "runserver")
+ROUTES = ("value", "trade", "chart")
+DEFAULT_MIX = "value=6,trade=1,chart=2"
+READY_TIMEOUT = 60  # Segundos de espera a que el servidor responda
+LATENCY_METRIC = "http_request_duration_seconds"  # Ver apps.common.metrics
+
+
+class LoadTestError(Exception):
+    pass
+
+
+def parse_mix(value):
+    """``ruta=peso,...`` con rutas de ``ROUTES``; las de peso 0 se descartan."""
+    mix = {}
+    for part in value.split(","):
+        route, _, weight = part.partition("=")
+        route = route.strip()
+        if route not in ROUTES or not weight.strip().isdigit():
+            raise ValueError(f"Mezcla inválida: {part}. Use ruta=peso con rutas {', '.join(ROUTES)}")
+        if int(weight):
+            mix[route] = int(weight)
+    if not mix:
+        raise ValueError("La mezcla no tiene ninguna ruta con peso")
+    return mix
+
+
+def gunicorn_workers():
+    """Workers definidos en gunicorn_config.py (1 si no existe)."""
+    if not GUNICORN_CONFIG.exists():
+        return 1
+    return int(runpy.run_path(str(GUNICORN_CONFIG)).get("workers", 1))
+
+
+@contextmanager
+def test_database():
+    """Crea una base de prueba vacía y migrada (como ``manage.py test``), la
+    deja como base por defecto y la elimina al salir. Devuelve su nombre."""
+    creation = connection.creation
+    old_name = connection.settings_dict["NAME"]
+    tmp = None
+    if connection.vendor == "sqlite":
+        # La base en memoria de las pruebas no la vería el servidor
+        tmp = tempfile.mkdtemp()
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(tmp, "loadtest.sqlite3")
+    name = creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield name
+    finally:
+        creation.destroy_test_db(old_name, verbosity=0)
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def seed_database(assets, portfolios, days, events, seed=0):
+    """Carga datos sintéticos y un superusuario para el admin.
+
+    Devuelve ``(usuario, contraseña, IDs de portafolios)``.
+    """
+    password = uuid.uuid4().hex
+    user = get_user_model().objects.create_superuser(f"loadtest-{uuid.uuid4().hex[:8]}", "", password)
+    portfolio_ids = load_synthetic(user.id, assets, portfolios, days, events, seed)
+    return user.username, password, portfolio_ids
+
+
+@contextmanager
+def serve(server="gunicorn", workers=1, env=None):
+    """Levanta el servidor en un puerto libre de 127.0.0.1 y devuelve su URL.
+
+    gunicorn usa gunicorn_config.py (la aplicación ASGI con ``workers``
+    procesos uvicorn); runserver es un solo proceso WSGI con un hilo por
+    solicitud. Las métricas de /metrics van a un
+    directorio nuevo, así solo reflejan esta corrida.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    if server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "--config", str(GUNICORN_CONFIG),
+                   "--bind", f"127.0.0.1:{port}", "--workers", str(workers)]
+    else:
+        command = [sys.executable, str(PROJECT_DIR / "manage.py"), "runserver", "--noreload", f"127.0.0.1:{port}"]
+
+    url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as metrics_dir, tempfile.TemporaryFile("w+") as log:
+        process = subprocess.Popen(
+            command, cwd=PROJECT_DIR, stdout=log, stderr=subprocess.STDOUT,
+            env={**os.environ, "PROMETHEUS_MULTIPROC_DIR": metrics_dir, **(env or {})})
+        try:
+            _wait_ready(url, process, log)
+            yield url
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def _wait_ready(url, process, log):
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise LoadTestError(f"El servidor terminó al arrancar:\n{log.read()[-2000:]}")
+        try:
+            if requests.get(url + reverse("metrics"), timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise LoadTestError(f"El servidor no respondió en {READY_TIMEOUT} s")
+
+
+class Traffic:
+    """Arma solicitudes al azar sobre los portafolios y precios de la base.
+
+    Los trades se registran solo si ``persist_trades``; si no, se simulan con
+    ``dry_run`` para no modificar la base.
+    """
+
+    def __init__(self, portfolio_ids, trade_amount=100_000, persist_trades=False):
+        if not portfolio_ids:
+            raise LoadTestError("No hay portafolios para generar tráfico")
+        bounds = Price.objects.aggregate(first=Min("date"), last=Max("date"))
+        if bounds["first"] is None or bounds["first"] == bounds["last"]:
+            raise LoadTestError("Se necesitan precios de al menos dos fechas")
+        self.first, self.last = bounds["first"], bounds["last"]
+        self.portfolio_ids = list(portfolio_ids)
+        self.holdings = {}
+        for portfolio_id, symbol in (Weight.objects.filter(portfolio_id__in=self.portfolio_ids)
+                                     .values_list("portfolio_id", "asset__symbol").distinct()):
+            self.holdings.setdefault(portfolio_id, []).append(symbol)
+        self.symbols = sorted({symbol for symbols in self.holdings.values() for symbol in symbols})
+        self.trade_amount = trade_amount
+        self.persist_trades = persist_trades
+
+    def _range(self, rng):
+        span = (self.last - self.first).days
+        start = self.first + timedelta(days=rng.randrange(span))
+        end = start + timedelta(days=rng.randint(1, (self.last - start).days))
+        return {"dateStart": start.isoformat(), "dateEnd": end.isoformat()}
+
+    def value(self, rng):
+        pk = rng.choice(self.portfolio_ids)
+        return "get", reverse("portfolio-value", kwargs={"pk": pk}), {"params": self._range(rng)}
+
+    def chart(self, rng):
+        pk = rng.choice(self.portfolio_ids)
+        return "get", reverse("admin:weights_chart", args=[pk]), {"params": self._range(rng)}
+
+    def trade(self, rng):
+        pk = rng.choice([pk for pk in self.portfolio_ids if pk in self.holdings] or self.portfolio_ids)
+        sell = rng.choice(self.holdings.get(pk) or self.symbols)
+        buy = rng.choice([symbol for symbol in self.symbols if symbol != sell] or self.symbols)
+        day = self.first + timedelta(days=rng.randint(1, (self.last - self.first).days))
+        body = {"date": day.isoformat(), "sell_asset_symbol": sell, "buy_asset_symbol": buy,
+                "amount": self.trade_amount}
+        if not self.persist_trades:
+            body.update(dry_run=True, date_end=self.last.isoformat())
+        return "post", reverse("portfolio-trade", kwargs={"pk": pk}), {"json": body}
+
+
+def admin_session(url, username, password):
+    """Sesión de requests con login en el admin."""
+    session = requests.Session()
+    login = url + reverse("admin:login")
+    session.get(login, timeout=30)
+    session.post(login, data={
+        "username": username, "password": password, "next": reverse("admin:index"),
+        "csrfmiddlewaretoken": session.cookies.get("csrftoken", ""),
+    }, headers={"Referer": login}, timeout=30)
+    if "sessionid" not in session.cookies:
+        raise LoadTestError(f"No se pudo iniciar sesión en el admin como {username}")
+    return session
+
+
+def run_load(url, traffic, mix, concurrency=8, duration=30, warmup=5, seed=0, admin=None, workers=1,
+             timeout=120):
+    """Tráfico mixto en lazo cerrado: ``concurrency`` clientes que, hasta
+    cumplir ``warmup + duration`` segundos, eligen una ruta según ``mix`` y
+    esperan su respuesta antes de mandar la siguiente.
+
+    Las solicitudes que empiezan durante el calentamiento no se miden.
+    ``admin`` es ``(usuario, contraseña)`` para los gráficos del admin y
+    ``workers``, los procesos del servidor (para calcular su ocupación).
+    Devuelve el reporte (ver :func:`summarize`).
+    """
+    routes, weights = list(mix), list(mix.values())
+    sessions = []
+    for _ in range(concurrency):
+        api = requests.Session()
+        panel = admin_session(url, *admin) if "chart" in mix else None
+        sessions.append((api, panel))
+
+    samples = [[] for _ in range(concurrency)]
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def client(index):
+        rng = random.Random(seed * 1_000_003 + index)
+        api, panel = sessions[index]
+        while (sent := time.perf_counter()) < stop_at:
+            route = rng.choices(routes, weights)[0]
+            method, path, kwargs = getattr(traffic, route)(rng)
+            session = panel if route == "chart" else api
+            try:
+                status = session.request(method, url + path, timeout=timeout, **kwargs).status_code
+            except requests.RequestException:
+                status = None
+            if sent >= measure_from:
+                samples[index].append((route, time.perf_counter() - sent, status))
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(max(0.0, measure_from - time.perf_counter()))
+    busy_before = server_busy(url)
+    for thread in threads:
+        thread.join()
+    window = time.perf_counter() - measure_from
+    busy_after = server_busy(url)
+
+    return summarize([sample for client_samples in samples for sample in client_samples], window,
+                     busy_before, busy_after, workers)
+
+
+def server_busy(url):
+    """Segundos atendiendo solicitudes y cantidad atendida según /metrics
+    (sumados entre todos los workers)."""
+    seconds = count = 0.0
+    text = requests.get(url + reverse("metrics"), timeout=30).text
+    for family in text_string_to_metric_families(text):
+        if family.name != LATENCY_METRIC:
+            continue
+        for sample in family.samples:
+            if sample.name == f"{LATENCY_METRIC}_sum":
+                seconds += sample.value
+            elif sample.name == f"{LATENCY_METRIC}_count":
+                count += sample.value
+    return seconds, count
+
+
+def _route_stats(samples, window):
+    latencies = np.array([latency for _, latency, status in samples if status is not None]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / window, 2),
+        "client_errors": sum(1 for *_, status in samples if status is not None and 400 <= status < 500),
+        "server_errors": sum(1 for *_, status in samples if status is None or status >= 500),
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+        "max_ms": round(float(latencies.max()), 1) if len(latencies) else 0,
+    }
+
+
+def summarize(samples, window, busy_before, busy_after, workers=1):
+    """Throughput y percentiles por ruta y saturación observada.
+
+    La saturación compara lo que vio el cliente con lo que midieron los
+    workers: ``in_flight`` es la concurrencia media del cliente (Ley de
+    Little), ``utilization`` la fracción del tiempo en que los ``workers``
+    estuvieron atendiendo solicitudes (cerca de 1: saturados) y ``queue_ms``
+    la latencia media que no se explica por el trabajo del servidor (espera
+    por un worker libre y red). Con runserver (un hilo por solicitud) y con
+    los workers uvicorn (varias solicitudes a la vez en su event loop) la
+    ocupación puede superar 1.
+    """
+    by_route = {}
+    for sample in samples:
+        by_route.setdefault(sample[0], []).append(sample)
+
+    busy = busy_after[0] - busy_before[0]
+    served = busy_after[1] - busy_before[1]
+    client_latency = sum(latency for _, latency, _ in samples)
+    client_mean = client_latency / len(samples) if samples else 0
+    server_mean = busy / served if served else 0
+    return {
+        "window_s": round(window, 2),
+        "routes": {route: _route_stats(by_route[route], window) for route in sorted(by_route)},
+        "total": _route_stats(samples, window),
+        "saturation": {
+            "workers": workers,
+            "in_flight": round(client_latency / window, 2) if window else 0,
+            "utilization": round(busy / (window * workers), 3) if window else 0,
+            "server_busy_s": round(busy, 2),
+            "server_requests": int(served),
+            "client_mean_ms": round(client_mean * 1000, 1),
+            "server_mean_ms": round(server_mean * 1000, 1),
+            "queue_ms": round(max(client_mean - server_mean, 0) * 1000, 1),
+        },
+    }
+
+
+def portfolio_ids_for(user_id=None):
+    portfolios = Portfolio.objects.all()
+    if user_id is not None:
+        portfolios = portfolios.filter(user_id=user_id)
+    return list(portfolios.order_by("id").values_list("id", flat=True))
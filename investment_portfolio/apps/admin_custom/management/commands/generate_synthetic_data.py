@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.admin_custom.synthetic import load_synthetic, synthetic_symbols, write_synthetic_excel
+from apps.portfolios.models import Asset
+
+
+class Command(BaseCommand):
+    help = "Genera datos sintéticos (activos, portafolios, precios y eventos) en la base o en un Excel de carga."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--assets", type=int, default=20, help="Cantidad de activos (predeterminado: 20)")
+        parser.add_argument("--portfolios", type=int, default=5, help="Cantidad de portafolios (predeterminado: 5)")
+        parser.add_argument("--days", type=int, default=365, help="Días de precios (predeterminado: 365)")
+        parser.add_argument("--events", type=int, default=0,
+                            help="Trades por portafolio; solo al cargar en la base (predeterminado: 0)")
+        parser.add_argument("--seed", type=int, default=0, help="Semilla: la misma genera los mismos datos")
+        parser.add_argument("--user-id", type=int, help="Usuario dueño de los portafolios (requerido sin --output)")
+        parser.add_argument("--initial-amount", type=float, default=1000000000, help="Monto inicial de cada portafolio")
+        parser.add_argument("--output", help="Escribe un Excel con el formato de process_excel en vez de cargar la base")
+
+    def handle(self, *args, **kwargs):
+        assets, portfolios, days = kwargs["assets"], kwargs["portfolios"], kwargs["days"]
+        if assets < 2 or portfolios < 1 or days < 2:
+            raise CommandError("Se necesitan al menos 2 activos, 1 portafolio y 2 días")
+
+        if kwargs["output"]:
+            if kwargs["events"]:
+                self.stdout.write(self.style.WARNING("El Excel de carga no tiene eventos: se omite --events"))
+            write_synthetic_excel(kwargs["output"], assets, portfolios, days, kwargs["seed"])
+            self.stdout.write(self.style.SUCCESS(f"✅ Excel sintético escrito en {kwargs['output']}"))
+            return
+
+        if kwargs["user_id"] is None:
+            raise CommandError("Indique --user-id o --output")
+        if not get_user_model().objects.filter(pk=kwargs["user_id"]).exists():
+            raise CommandError("Usuario no encontrado")
+        if Asset.objects.filter(symbol__in=synthetic_symbols(assets, kwargs["seed"])).exists():
+            raise CommandError("Ya hay activos sintéticos con esta semilla; use otra --seed")
+
+        portfolio_ids = load_synthetic(kwargs["user_id"], assets, portfolios, days, kwargs["events"],
+                                       kwargs["seed"], kwargs["initial_amount"])
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {assets} activos, {len(portfolio_ids)} portafolios (IDs {portfolio_ids[0]}–{portfolio_ids[-1]}), "
+            f"{days} días de precios y {kwargs['events']} eventos por portafolio"))
@@ -0,0 +1,107 @@
+import json
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.admin_custom.benchmarks import parse_size
+from apps.admin_custom.loadtest import (DEFAULT_MIX, SERVERS, LoadTestError, Traffic, gunicorn_workers,
+                                        parse_mix, portfolio_ids_for, run_load, seed_database, serve,
+                                        test_database)
+
+
+class Command(BaseCommand):
+    help = ("Levanta el servidor y lo somete a tráfico mixto concurrente (valorización, trades y gráficos "
+            "del admin); reporta throughput, latencias p50/p95/p99 por ruta y la saturación de los workers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--server", choices=SERVERS, default="gunicorn",
+                            help="Servidor a levantar (predeterminado: gunicorn con gunicorn_config.py)")
+        parser.add_argument("--workers", type=int,
+                            help="Workers de gunicorn (predeterminado: los de gunicorn_config.py)")
+        parser.add_argument("--url", help="Usa un servidor ya levantado en esta URL en vez de levantar uno")
+        parser.add_argument("--concurrency", type=int, default=8, help="Clientes simultáneos (predeterminado: 8)")
+        parser.add_argument("--duration", type=float, default=30, help="Segundos medidos (predeterminado: 30)")
+        parser.add_argument("--warmup", type=float, default=5,
+                            help="Segundos de calentamiento sin medir (predeterminado: 5)")
+        parser.add_argument("--mix", default=DEFAULT_MIX,
+                            help=f"Pesos de cada ruta: value, trade, chart (predeterminado: {DEFAULT_MIX})")
+        parser.add_argument("--test-db", action="store_true",
+                            help="Usa una base de prueba con datos sintéticos que se elimina al terminar "
+                                 "(los trades se registran); sin ella se usa la base configurada y los "
+                                 "trades se simulan con dry_run")
+        parser.add_argument("--size", default="small",
+                            help="Datos sintéticos de --test-db: small, medium, large o AxPxDxE")
+        parser.add_argument("--user-id", type=int, help="Sin --test-db: solo los portafolios de este usuario")
+        parser.add_argument("--admin-user", help="Sin --test-db: usuario staff para los gráficos del admin")
+        parser.add_argument("--admin-password", help="Contraseña de --admin-user")
+        parser.add_argument("--trade-amount", type=float, default=100_000,
+                            help="Monto en USD de cada trade (predeterminado: 100000)")
+        parser.add_argument("--seed", type=int, default=0, help="Semilla de datos y tráfico")
+        parser.add_argument("--output", help="Archivo JSON donde guardar el reporte")
+
+    def handle(self, *args, **kwargs):
+        try:
+            mix = parse_mix(kwargs["mix"])
+            _, (assets, portfolios, days, events) = parse_size(kwargs["size"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if kwargs["concurrency"] < 1 or kwargs["duration"] <= 0:
+            raise CommandError("--concurrency y --duration deben ser positivos")
+        if kwargs["url"] and kwargs["test_db"]:
+            raise CommandError("--test-db levanta su propio servidor: no se puede combinar con --url")
+
+        workers = 1 if kwargs["server"] == "runserver" else kwargs["workers"] or gunicorn_workers()
+        try:
+            with ExitStack() as stack:
+                env = {}
+                if kwargs["test_db"]:
+                    env["DJANGO_DB_NAME"] = stack.enter_context(test_database())
+                    self.stdout.write(f"Cargando datos sintéticos ({assets}x{portfolios}x{days}x{events})…")
+                    username, password, portfolio_ids = seed_database(assets, portfolios, days, events, kwargs["seed"])
+                    admin = (username, password)
+                else:
+                    portfolio_ids = portfolio_ids_for(kwargs["user_id"])
+                    admin = (kwargs["admin_user"], kwargs["admin_password"])
+                    if "chart" in mix and not all(admin):
+                        self.stdout.write(self.style.WARNING(
+                            "Sin --admin-user/--admin-password no se piden gráficos del admin"))
+                        mix.pop("chart")
+                        if not mix:
+                            raise CommandError("La mezcla quedó vacía")
+
+                traffic = Traffic(portfolio_ids, kwargs["trade_amount"], persist_trades=kwargs["test_db"])
+                url = kwargs["url"].rstrip("/") if kwargs["url"] else None
+                if url is None:
+                    self.stdout.write(f"Levantando {kwargs['server']} ({workers} workers)…")
+                    url = stack.enter_context(serve(kwargs["server"], workers, env))
+
+                self.stdout.write(f"{kwargs['concurrency']} clientes durante {kwargs['duration']:g} s "
+                                  f"(+{kwargs['warmup']:g} s de calentamiento) contra {url}…")
+                report = run_load(url, traffic, mix, kwargs["concurrency"], kwargs["duration"], kwargs["warmup"],
+                                  kwargs["seed"], admin, workers)
+        except LoadTestError as e:
+            raise CommandError(str(e))
+
+        report.update(server=kwargs["server"] if not kwargs["url"] else kwargs["url"],
+                      concurrency=kwargs["concurrency"], mix=mix)
+        self._show(report)
+        if kwargs["output"]:
+            with open(kwargs["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"✅ Reporte guardado en {kwargs['output']}"))
+
+    def _show(self, report):
+        self.stdout.write(f"{'ruta':<8} {'solicitudes':>11} {'req/s':>8} {'4xx':>5} {'fallas':>6} "
+                          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'máx ms':>9}")
+        for route, stats in [*report["routes"].items(), ("total", report["total"])]:
+            self.stdout.write(
+                f"{route:<8} {stats['requests']:>11} {stats['throughput_rps']:>8.2f} {stats['client_errors']:>5} "
+                f"{stats['server_errors']:>6} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+                f"{stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+
+        saturation = report["saturation"]
+        self.stdout.write(
+            f"Saturación: {saturation['utilization']:.0%} de ocupación de {saturation['workers']} workers, "
+            f"{saturation['in_flight']:.1f} solicitudes en curso en promedio, "
+            f"{saturation['server_mean_ms']:.1f} ms en el servidor vs {saturation['client_mean_ms']:.1f} ms "
+            f"en el cliente ({saturation['queue_ms']:.1f} ms de espera)")
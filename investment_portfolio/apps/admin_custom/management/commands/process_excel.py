@@ -10,18 +10,29 @@ class Command(BaseCommand):
         parser.add_argument("file_path", type=str, help="Ruta al archivo Excel")
         parser.add_argument("user_id", type=int, help="ID del usuario")
         parser.add_argument("--initial-amount", type=float, default=1000000000, help="Monto inicial del portafolio")
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Carga idempotente: inserta solo filas nuevas y actualiza las modificadas",
+        )
 
     def handle(self, *args, **kwargs):
         file_path = kwargs["file_path"]
         user_id = kwargs["user_id"]
         initial_amount = kwargs["initial_amount"]
+        incremental = kwargs["incremental"]
 
         self.stdout.write(f"Procesando archivo: {file_path}")
         self.stdout.write(f"Usuario ID: {user_id}")
         self.stdout.write(f"Monto inicial: {initial_amount}")
 
         try:
-            process_excel_file(file_path, user_id, initial_amount)
+            report = process_excel_file(file_path, user_id, initial_amount, incremental=incremental)
+            for table, counts in report.items():
+                self.stdout.write(
+                    f"{table}: {counts['inserted']} insertados, "
+                    f"{counts['updated']} actualizados, {counts['skipped']} omitidos"
+                )
             self.stdout.write(self.style.SUCCESS("✅ Archivo procesado correctamente."))
         except Exception as e:
             self.stderr.write(self.style.ERROR(f"❌ Error al procesar el archivo: {e}"))
\ No newline at end of file
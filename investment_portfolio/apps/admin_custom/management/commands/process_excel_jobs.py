@@ -0,0 +1,61 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.admin_custom.jobs import claim_jobs, run_job
+from apps.admin_custom.models import IngestionJob
+from apps.portfolios.materialization import materialize_pending
+
+
+class Command(BaseCommand):
+    help = ("Worker que procesa en segundo plano las cargas de Excel encoladas "
+            "y materializa las valorizaciones pendientes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=2, help="Cargas que se procesan en paralelo")
+        parser.add_argument("--poll", type=float, default=2.0, help="Segundos entre revisiones de la cola")
+        parser.add_argument("--once", action="store_true", help="Procesa la cola pendiente y termina")
+
+    def handle(self, *args, **kwargs):
+        processes = kwargs["processes"]
+        poll = kwargs["poll"]
+        once = kwargs["once"]
+
+        self.stdout.write(f"Worker de cargas iniciado con {processes} procesos")
+
+        # "spawn": cada proceso abre sus propias conexiones a la base de datos
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                 initializer=django.setup) as pool:
+            running = {}
+            while True:
+                for job_id in claim_jobs(processes - len(running)):
+                    self.stdout.write(f"Procesando carga #{job_id}")
+                    running[pool.submit(run_job, job_id)] = job_id
+
+                if not running:
+                    # Sin cargas en curso: pone al día las valorizaciones sucias
+                    materialized = materialize_pending()
+                    if materialized:
+                        self.stdout.write(f"Valorizaciones materializadas: {materialized}")
+                        if once:
+                            continue
+                    if once:
+                        break
+                    time.sleep(poll)
+                    continue
+
+                done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        self.stdout.write(f"Carga #{job_id}: {future.result()}")
+                    except Exception as e:
+                        # El proceso murió antes de registrar el resultado
+                        IngestionJob.objects.filter(pk=job_id).update(
+                            status=IngestionJob.Status.FAILED, error=str(e), finished_at=timezone.now())
+                        self.stderr.write(self.style.ERROR(f"❌ Carga #{job_id} falló: {e}"))
@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.admin_custom.benchmarks import (SIZES, BenchmarkError, compare_reports,
+                                         parse_size, run_benchmarks)
+
+
+def _size(value):
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise CommandError(str(e))
+
+
+class Command(BaseCommand):
+    help = ("Mide el ETL y los endpoints de valorización y trades sobre datos sintéticos "
+            "(tiempo, consultas y memoria pico) y guarda un reporte JSON comparable entre commits.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", default=["small"],
+                            help=f"Tamaños: {', '.join(SIZES)} o AxPxDxE (activos x portafolios x días x eventos)")
+        parser.add_argument("--repeat", type=int, default=3, help="Corridas por caso (predeterminado: 3)")
+        parser.add_argument("--seed", type=int, default=0, help="Semilla de los datos sintéticos")
+        parser.add_argument("--output", default="benchmark.json", help="Archivo del reporte (predeterminado: benchmark.json)")
+        parser.add_argument("--compare", help="Reporte anterior contra el que buscar regresiones")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="Aumento de tiempo tolerado antes de marcar una regresión (predeterminado: 0.2)")
+
+    def handle(self, *args, **kwargs):
+        sizes = [_size(value) for value in kwargs["sizes"]]
+        baseline = None
+        if kwargs["compare"]:
+            with open(kwargs["compare"]) as f:
+                baseline = json.load(f)
+
+        def show(row):
+            self.stdout.write(
+                f"{row['size']:>8} {row['case']:<14} {row['wall_time_s'] * 1000:>10.1f} ms "
+                f"{row['queries']:>6} consultas {row['peak_memory_mb']:>9.1f} MB  [{row.get('status', '-')}]")
+
+        try:
+            report = run_benchmarks(sizes, kwargs["repeat"], kwargs["seed"], on_case=show)
+        except BenchmarkError as e:
+            raise CommandError(f"Caso inválido: {e}")
+        with open(kwargs["output"], "w") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"✅ Reporte guardado en {kwargs['output']}"))
+
+        if baseline is None:
+            return
+        regressions = compare_reports(report, baseline, kwargs["tolerance"])
+        for size, case, metric, before, after in regressions:
+            self.stdout.write(self.style.WARNING(f"{size} {case}: {metric} {before} → {after}"))
+        if regressions:
+            raise CommandError(f"{len(regressions)} regresiones respecto de {kwargs['compare']}")
+        self.stdout.write(self.style.SUCCESS(f"✅ Sin regresiones respecto de {kwargs['compare']}"))
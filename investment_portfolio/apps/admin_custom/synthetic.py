@@ -0,0 +1,91 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from django.db.models import Max
+
+from ..portfolios.materialization import mark_dirty
+from ..portfolios.models import Asset, Portfolio, PortfolioEvent
+from .utils import BATCH_SIZE, load_frames, tidy_frames
+
+SYNTHETIC_START = datetime.date(2020, 1, 1)
+EVENT_FRACTION = 0.1  # Monto de cada trade sintético, como fracción de una posición equiponderada
+
+
+def synthetic_sheets(assets, portfolios, days, seed=0, start=SYNTHETIC_START):
+    """Hojas de pesos y precios con el formato del Excel de carga.
+
+    Los precios siguen un paseo aleatorio geométrico diario desde ``start``
+    y los pesos iniciales de cada portafolio, una Dirichlet sobre todos los
+    activos. El mismo ``seed`` genera siempre los mismos datos (y los mismos
+    símbolos de activos, ver :func:`synthetic_symbols`).
+    """
+    rng = np.random.default_rng(seed)
+    symbols = synthetic_symbols(assets, seed)
+    dates = pd.date_range(start, periods=days, freq="D")
+
+    returns = rng.normal(0.0002, 0.01, size=(days, assets))
+    returns[0] = 0
+    levels = rng.uniform(10, 1000, size=assets) * np.exp(np.cumsum(returns, axis=0))
+    prices_df = pd.DataFrame(levels.round(4), columns=symbols)
+    prices_df.insert(0, "Dates", dates)
+
+    weights = rng.dirichlet(np.ones(assets), size=portfolios).T
+    weights_df = pd.DataFrame(weights, columns=[f"portafolio {i}" for i in range(1, portfolios + 1)])
+    weights_df.insert(0, "activos", symbols)
+    weights_df.insert(0, "Fecha", dates[0])
+    return weights_df, prices_df
+
+
+def synthetic_symbols(assets, seed=0):
+    return [f"SYN{seed}-{i:04d}" for i in range(1, assets + 1)]
+
+
+def write_synthetic_excel(file_path, assets, portfolios, days, seed=0):
+    """Escribe un Excel de carga sintético (ver :func:`synthetic_sheets`)."""
+    weights_df, prices_df = synthetic_sheets(assets, portfolios, days, seed)
+    with pd.ExcelWriter(file_path) as writer:
+        weights_df.to_excel(writer, sheet_name="weights", index=False)
+        prices_df.to_excel(writer, sheet_name="Precios", index=False)
+
+
+def load_synthetic(user_id, assets, portfolios, days, events=0, seed=0, initial_amount=1000000000):
+    """Carga datos sintéticos con el ORM, por el mismo camino que el ETL.
+
+    Además de pesos y precios crea ``events`` trades por portafolio (pares
+    venta/compra entre activos al azar, a precio de mercado). Devuelve los
+    IDs de los portafolios creados.
+    """
+    weights_df, prices_df = synthetic_sheets(assets, portfolios, days, seed)
+    weights, prices, portfolio_names = tidy_frames(weights_df, prices_df)
+    last_id = Portfolio.objects.aggregate(last=Max("id"))["last"] or 0
+    load_frames(weights, prices, portfolio_names, user_id, initial_amount)
+    portfolio_ids = list(Portfolio.objects.filter(id__gt=last_id, user_id=user_id)
+                         .order_by("id").values_list("id", flat=True))
+
+    if events and days > 1 and assets > 1:
+        amount = initial_amount / assets * EVENT_FRACTION
+        _create_events(portfolio_ids, prices_df, events, amount, np.random.default_rng(seed + 1))
+    return portfolio_ids
+
+
+def _create_events(portfolio_ids, prices_df, events, amount, rng):
+    symbols = list(prices_df.columns[1:])
+    asset_ids = dict(Asset.objects.filter(symbol__in=symbols).values_list("symbol", "id"))
+    dates = prices_df["Dates"].dt.date.tolist()
+    prices = prices_df[symbols].to_numpy()
+
+    entries = []
+    for portfolio_id in portfolio_ids:
+        # Después de la fecha inicial: los datos de esa fecha son la base
+        rows = np.sort(rng.integers(1, len(dates), size=events))
+        for row in rows.tolist():
+            sell, buy = rng.choice(len(symbols), size=2, replace=False).tolist()
+            for col, event_type in ((sell, PortfolioEvent.EventType.SELL), (buy, PortfolioEvent.EventType.BUY)):
+                entries.append(PortfolioEvent(
+                    portfolio_id=portfolio_id, asset_id=asset_ids[symbols[col]], type=event_type,
+                    amount=amount, price=float(prices[row, col]), date=dates[row], currency="USD"))
+    PortfolioEvent.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+    # bulk_create no dispara señales
+    mark_dirty(portfolio_ids, dates[1])
@@ -0,0 +1,368 @@
+import os
+import random
+import tempfile
+import threading
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.admin_custom.benchmarks import (BenchmarkError, _call, benchmark_size,
+                                         compare_reports)
+from apps.admin_custom.jobs import claim_jobs, enqueue_excel, run_job
+from apps.admin_custom.loadtest import (Traffic, parse_mix, portfolio_ids_for,
+                                       summarize)
+from apps.admin_custom.models import IngestionJob
+from apps.admin_custom.synthetic import load_synthetic, synthetic_sheets
+from apps.admin_custom.utils import process_excel_file
+from apps.common.profiling import (SlowQueryRecorder, explain, list_captures,
+                                   load_capture, planner, profile_token,
+                                   wait_for_plans, write_capture)
+from apps.portfolios.materialization import ensure_materialized
+from apps.portfolios.models import (Amount, Asset, Portfolio, PortfolioEvent,
+                                    PortfolioValuationState, Price, Quantity,
+                                    Weight)
+from apps.portfolios.price_cache import shared_panel
+
+START = date(2024, 1, 1)
+
+
+def write_workbook(path, weights, prices):
+    """Escribe un Excel con el formato de carga: hoja de pesos y hoja de precios.
+
+    ``weights`` es ``{activo: [peso por portafolio]}`` a la fecha inicial y
+    ``prices`` ``{activo: [precio por día]}`` desde esa fecha.
+    """
+    portfolios = len(next(iter(weights.values())))
+    weights_df = pd.DataFrame(
+        [[START, asset, *values] for asset, values in weights.items()],
+        columns=["Fecha", "activos", *(f"portafolio {i + 1}" for i in range(portfolios))])
+    days = len(next(iter(prices.values())))
+    prices_df = pd.DataFrame({"Dates": [START + timedelta(days=n) for n in range(days)], **prices})
+    with pd.ExcelWriter(path) as writer:
+        weights_df.to_excel(writer, sheet_name="weights", index=False)
+        prices_df.to_excel(writer, sheet_name="Precios", index=False)
+    return path
+
+
+@override_settings(PRICE_PANEL_CACHE_ENABLED=False)
+class ExcelIngestionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="tester")
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "datos.xlsx"
+
+    def test_loads_every_portfolio_column(self):
+        write_workbook(self.path, {"A": [0.6, 0.5, 0.1], "B": [0.4, 0.5, 0.9]},
+                       {"A": [100.0, 101.0], "B": [50.0, 49.5]})
+        process_excel_file(self.path, self.user.pk, 1000)
+
+        self.assertEqual(sorted(Portfolio.objects.values_list("name", flat=True)),
+                         ["portfolio_1", "portfolio_2", "portfolio_3"])
+        self.assertEqual(Price.objects.count(), 4)
+        self.assertEqual(Weight.objects.count(), 6)
+        holding = {"portfolio__name": "portfolio_3", "asset__symbol": "B", "date": START}
+        self.assertAlmostEqual(Amount.objects.get(**holding).amount, 900)
+        self.assertAlmostEqual(Quantity.objects.get(**holding).quantity, 18)
+
+    def test_weight_without_price_is_rejected(self):
+        write_workbook(self.path, {"A": [0.6], "B": [0.4]}, {"A": [100.0], "B": [None]})
+        with self.assertRaisesMessage(ValueError, f"No hay precio para B en {START}"):
+            process_excel_file(self.path, self.user.pk, 1000)
+        self.assertFalse(Weight.objects.exists())
+
+    def test_incremental_load_is_idempotent(self):
+        weights = {"A": [0.6, 0.5], "B": [0.4, 0.5]}
+        write_workbook(self.path, weights, {"A": [100.0, 101.0], "B": [50.0, 49.5]})
+        first = process_excel_file(self.path, self.user.pk, 1000, incremental=True)
+        self.assertEqual(first["prices"], {"inserted": 4, "updated": 0, "skipped": 0})
+
+        again = process_excel_file(self.path, self.user.pk, 1000, incremental=True)
+        for table, counts in again.items():
+            self.assertEqual((counts["inserted"], counts["updated"]), (0, 0), table)
+        self.assertEqual(Portfolio.objects.count(), 2)
+        self.assertEqual(Weight.objects.count(), 4)
+
+    def test_incremental_load_updates_prices_and_marks_valuations_dirty(self):
+        weights = {"A": [0.6], "B": [0.4]}
+        write_workbook(self.path, weights, {"A": [100.0, 101.0], "B": [50.0, 49.5]})
+        process_excel_file(self.path, self.user.pk, 1000, incremental=True)
+        portfolio = Portfolio.objects.get()
+        ensure_materialized(portfolio)
+
+        write_workbook(self.path, weights, {"A": [100.0, 105.0, 106.0], "B": [50.0, 49.5, 49.0]})
+        report = process_excel_file(self.path, self.user.pk, 1000, incremental=True)
+
+        self.assertEqual(report["prices"], {"inserted": 2, "updated": 1, "skipped": 3})
+        self.assertEqual(Price.objects.get(asset__symbol="A", date=START + timedelta(days=1)).price, 105.0)
+        self.assertEqual(PortfolioValuationState.objects.get(portfolio=portfolio).dirty_since,
+                         START + timedelta(days=1))
+
+
+@override_settings(INGESTION_JOB_LEASE_SECONDS=60, INGESTION_JOB_MAX_ATTEMPTS=2)
+class IngestionJobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="tester")
+
+    def job(self, status=IngestionJob.Status.PENDING, heartbeat_ago=None, attempts=0):
+        heartbeat = timezone.now() - timedelta(seconds=heartbeat_ago) if heartbeat_ago is not None else None
+        return IngestionJob.objects.create(user=self.user, file_path="/tmp/x.xlsx", file_name="x.xlsx",
+                                           initial_amount=1000, status=status, heartbeat_at=heartbeat,
+                                           attempts=attempts)
+
+    def test_claims_pending_jobs_once(self):
+        job = self.job()
+        self.assertEqual(claim_jobs(5), [job.pk])
+        self.assertEqual(claim_jobs(5), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (IngestionJob.Status.RUNNING, 1))
+        self.assertIsNotNone(job.heartbeat_at)
+
+    def test_stale_running_jobs_are_reclaimed(self):
+        stale = self.job(IngestionJob.Status.RUNNING, heartbeat_ago=120, attempts=1)
+        alive = self.job(IngestionJob.Status.RUNNING, heartbeat_ago=10, attempts=1)
+
+        self.assertEqual(claim_jobs(5), [stale.pk])
+        stale.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual(stale.attempts, 2)
+        self.assertGreater(stale.heartbeat_at, alive.heartbeat_at)
+        self.assertEqual(alive.attempts, 1)
+
+    def test_stale_jobs_without_attempts_left_fail(self):
+        job = self.job(IngestionJob.Status.RUNNING, heartbeat_ago=120, attempts=2)
+
+        self.assertEqual(claim_jobs(5), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.Status.FAILED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertTrue(job.error)
+
+
+class IngestionJobRunTests(TransactionTestCase):
+    """``run_job`` corre en el worker, fuera de una transacción de prueba."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="tester")
+
+    def test_run_job_saves_the_report_and_removes_the_upload(self):
+        with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as upload:
+            pass
+        job = enqueue_excel(upload.name, "x.xlsx", self.user.pk, 1000)
+        claim_jobs(1)
+
+        report = {"prices": {"inserted": 3, "updated": 1}}
+        with mock.patch("apps.admin_custom.jobs.process_excel_file", return_value=report):
+            self.assertEqual(run_job(job.pk), IngestionJob.Status.SUCCEEDED)
+        job.refresh_from_db()
+        self.assertEqual((job.report, job.rows_written), (report, 4))
+        self.assertIsNotNone(job.duration)
+        self.assertFalse(os.path.exists(upload.name))
+
+    def test_run_job_records_the_error(self):
+        job = enqueue_excel("/tmp/no-existe.xlsx", "x.xlsx", self.user.pk, 1000)
+        claim_jobs(1)
+        with mock.patch("apps.admin_custom.jobs.process_excel_file", side_effect=ValueError("Falta la hoja")):
+            self.assertEqual(run_job(job.pk), IngestionJob.Status.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.error, "Falta la hoja")
+        self.assertIsNotNone(job.finished_at)
+
+
+@override_settings(PRICE_PANEL_CACHE_ENABLED=False, VALUATION_SEGMENT_CACHE_ROWS=0)
+class SyntheticDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="tester")
+
+    def test_same_seed_same_sheets(self):
+        first, second = synthetic_sheets(4, 2, 30, seed=7), synthetic_sheets(4, 2, 30, seed=7)
+        for a, b in zip(first, second):
+            pd.testing.assert_frame_equal(a, b)
+        weights, prices = first
+        self.assertEqual(prices.shape, (30, 5))
+        self.assertTrue((weights[["portafolio 1", "portafolio 2"]].sum().round(9) == 1).all())
+
+    def test_load_synthetic_creates_portfolios_and_trades(self):
+        portfolio_ids = load_synthetic(self.user.pk, 4, 3, 20, events=2)
+
+        self.assertEqual(len(portfolio_ids), 3)
+        self.assertEqual(Price.objects.count(), 4 * 20)
+        self.assertEqual(PortfolioEvent.objects.count(), 3 * 2 * 2)  # Venta y compra por trade
+
+
+@override_settings(PRICE_PANEL_CACHE_ENABLED=True, VALUATION_SEGMENT_CACHE_ROWS=0)
+class BenchmarkTests(TestCase):
+    def test_benchmark_cases_succeed_and_roll_back(self):
+        version = shared_panel().current_version()
+        rows = benchmark_size("tiny", 3, 1, 20, 2, repeat=1)
+
+        self.assertEqual([row["case"] for row in rows],
+                         ["etl", "value_cold", "value", "batch_value", "trade_dry_run", "trade"])
+        for row in rows[1:]:
+            self.assertTrue(200 <= row["status"] < 300, row)
+            self.assertGreater(row["response_bytes"], 2)
+        self.assertFalse(Portfolio.objects.exists())
+        self.assertFalse(Price.objects.exists())
+        # Los precios sintéticos no llegan al panel compartido real
+        self.assertEqual(shared_panel().current_version(), version)
+
+    def test_error_responses_fail_the_case(self):
+        with self.assertRaisesMessage(BenchmarkError, "HTTP 404"):
+            _call("get", "portfolio-value", {"dateStart": "2024-01-01", "dateEnd": "2024-01-31"}, pk=999)
+
+    def test_compare_reports_flags_regressions(self):
+        row = {"size": "tiny", "case": "value", "wall_time_s": 1.0, "queries": 5, "status": 200}
+        baseline = {"results": [row]}
+        self.assertEqual(compare_reports({"results": [{**row, "wall_time_s": 1.1}]}, baseline), [])
+        self.assertEqual(compare_reports({"results": [{**row, "wall_time_s": 2.0, "queries": 6}]}, baseline),
+                         [("tiny", "value", "wall_time_s", 1.0, 2.0), ("tiny", "value", "queries", 5, 6)])
+
+
+@override_settings(PRICE_PANEL_CACHE_ENABLED=False, VALUATION_SEGMENT_CACHE_ROWS=0, SLOW_REQUEST_BUDGET_MS=0)
+class ProfileCaptureTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser("admin", password="x")
+        cls.portfolio = Portfolio.objects.create(user=cls.user, name="portfolio_1", created_at=START)
+        for i, symbol in enumerate("AB"):
+            asset = Asset.objects.create(name=f"Asset {symbol}", symbol=symbol)
+            Weight.objects.create(portfolio=cls.portfolio, asset=asset, weight=0.5, date=START)
+            Price.objects.bulk_create([Price(asset=asset, date=START + timedelta(days=n), price=10 + i + n)
+                                       for n in range(5)])
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(PROFILE_CAPTURE_DIR=directory.name))
+
+    def post_batch(self, token):
+        return self.client.post(
+            reverse("portfolio-value-batch"),
+            {"portfolio_ids": [self.portfolio.pk], "dateStart": "2024-01-01", "dateEnd": "2024-01-05"},
+            content_type="application/json", headers={"X-Debug-Profile": token})
+
+    def test_header_token_profiles_the_request(self):
+        self.assertEqual(self.post_batch(profile_token()).status_code, 200)
+
+        [summary] = list_captures()
+        self.assertEqual((summary["trigger"], summary["view"]), ("header", "portfolio-value-batch"))
+        wait_for_plans()
+        capture = load_capture(summary["id"])
+        self.assertIn("execute_sql", capture["profile"])
+        self.assertTrue(capture["slow_sql"])
+        self.assertTrue(all(query["plan"] for query in capture["slow_sql"]))
+
+    def test_explain_skips_locking_and_side_effecting_statements(self):
+        table = Asset._meta.db_table
+        self.assertIsNotNone(explain(f'SELECT * FROM "{table}" WHERE id = %s', [1], False))
+        for sql in (f'SELECT * FROM "{table}" WHERE id = %s FOR UPDATE',
+                    f'SELECT * FROM "{table}" WHERE id = %s FOR NO KEY UPDATE',
+                    f'SELECT * INTO copy FROM "{table}" WHERE id = %s',
+                    f'UPDATE "{table}" SET name = name WHERE id = %s'):
+            self.assertIsNone(explain(sql, [1], False), sql)
+
+    def test_plans_are_added_after_the_capture_is_written(self):
+        recorder = SlowQueryRecorder(keep=2)
+        with connection.execute_wrapper(recorder):
+            list(Asset.objects.filter(name="x"))
+            list(Asset.objects.select_for_update().filter(name="x"))
+
+        # El hilo de planes queda ocupado hasta después de responder
+        released = threading.Event()
+        planner().submit(released.wait, 5)
+        capture_id = write_capture(RequestFactory().get("/x/"), HttpResponse(), 0.5, "budget", recorder, "")
+        self.assertTrue(load_capture(capture_id)["plans_pending"])
+
+        released.set()
+        wait_for_plans()
+        capture = load_capture(capture_id)
+        self.assertFalse(capture["plans_pending"])
+        plans = {"FOR UPDATE" in query["sql"]: query["plan"] for query in capture["slow_sql"]}
+        self.assertIsNone(plans.get(True))
+        self.assertTrue(plans[False])
+
+    async def test_async_header_profile_covers_the_request_thread(self):
+        response = await self.async_client.post(
+            reverse("portfolio-value-batch"),
+            {"portfolio_ids": [self.portfolio.pk], "dateStart": "2024-01-01", "dateEnd": "2024-01-05"},
+            content_type="application/json", headers={"X-Debug-Profile": profile_token()})
+
+        self.assertEqual(response.status_code, 200)
+        [summary] = list_captures()
+        self.assertEqual(summary["trigger"], "header")
+        # Las consultas corren en el hilo de la solicitud: el perfil no es solo el event loop
+        self.assertIn("execute_sql", load_capture(summary["id"])["profile"])
+
+    def test_invalid_token_and_no_budget_capture_nothing(self):
+        self.post_batch("profile:falso")
+        self.assertEqual(list_captures(), [])
+
+    @override_settings(PROFILE_CAPTURE_KEEP=2)
+    def test_keeps_only_recent_captures(self):
+        request, response = RequestFactory().get("/x/"), HttpResponse()
+        ids = [write_capture(request, response, 0.5, "budget", SlowQueryRecorder(keep=1), "") for _ in range(3)]
+        self.assertEqual([summary["id"] for summary in list_captures()], ids[:0:-1])
+
+    def test_admin_lists_captures(self):
+        self.post_batch(profile_token())
+        [summary] = list_captures()
+        self.client.force_login(self.user)
+
+        self.assertContains(self.client.get(reverse("PortfolioAdmin:profile_captures")), summary["id"])
+        response = self.client.get(reverse("PortfolioAdmin:profile_capture", args=[summary["id"]]))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(PRICE_PANEL_CACHE_ENABLED=False, VALUATION_SEGMENT_CACHE_ROWS=0)
+class LoadTestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser("admin", password="x")
+        load_synthetic(cls.user.pk, 3, 2, 30, events=1)
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("value=6,trade=0,chart=2"), {"value": 6, "chart": 2})
+        for invalid in ("value=x", "search=1", "trade=0"):
+            with self.assertRaises(ValueError):
+                parse_mix(invalid)
+
+    def test_traffic_requests_succeed(self):
+        traffic = Traffic(portfolio_ids_for(self.user.pk))
+        self.client.force_login(self.user)
+        rng = random.Random(0)
+
+        for route in ("value", "trade", "chart"):
+            for _ in range(3):
+                method, path, options = getattr(traffic, route)(rng)
+                if method == "get":
+                    response = self.client.get(path, options["params"])
+                else:
+                    response = self.client.post(path, options["json"], content_type="application/json")
+                self.assertLess(response.status_code, 300, (route, response.content[:200]))
+        # Sin persist_trades los trades son dry_run
+        self.assertEqual(PortfolioEvent.objects.count(), 2 * 2)
+
+    def test_summarize_percentiles_and_saturation(self):
+        samples = [("value", n / 100, 200) for n in range(1, 101)] + [("trade", 0.5, 400), ("trade", 1.0, None)]
+        report = summarize(samples, window=10, busy_before=(0, 0), busy_after=(20, 100), workers=4)
+
+        value = report["routes"]["value"]
+        self.assertEqual((value["requests"], value["p50_ms"], value["max_ms"]), (100, 505.0, 1000.0))
+        self.assertEqual((report["routes"]["trade"]["client_errors"], report["routes"]["trade"]["server_errors"]),
+                         (1, 1))
+        self.assertEqual(report["saturation"]["utilization"], 0.5)
+        self.assertEqual(report["saturation"]["server_mean_ms"], 200.0)
@@ -1,72 +1,220 @@
 import datetime
+import logging
 
+import numpy as np
 import pandas as pd
 
+from ..portfolios.materialization import mark_assets_dirty, mark_dirty
 from ..portfolios.models import (Amount, Asset, Portfolio, Price, Quantity,
                                  Weight)
+from ..portfolios.price_cache import invalidate_price_panel
 
+BATCH_SIZE = 5000
 
-def process_excel_file(file_path, user_id, initial_amount=1000000000):
-    weights_df = pd.read_excel(file_path, sheet_name=0)
-    prices_df = pd.read_excel(file_path, sheet_name=1)
+logger = logging.getLogger(__name__)
 
+
+def read_excel_frames(file_path):
+    """Lee las hojas de pesos y precios y las deja en formato largo.
+
+    La hoja de pesos tiene fecha, activo y una columna por portafolio (la
+    cantidad de portafolios es libre); la de precios, fecha y una columna
+    por activo.
+    """
+    return tidy_frames(pd.read_excel(file_path, sheet_name=0), pd.read_excel(file_path, sheet_name=1))
+
+
+def tidy_frames(weights_df, prices_df):
+    """Pasa las hojas de pesos y precios (como DataFrames) a formato largo."""
     # Renombrar columnas
-    weights_df.columns.values[0] = "date"
-    weights_df.columns.values[1] = "asset"
-    weights_df.columns.values[2] = "portfolio_1"
-    weights_df.columns.values[3] = "portfolio_2"
-    prices_df.columns.values[0] = "date"
+    portfolio_names = [f"portfolio_{i}" for i in range(1, len(weights_df.columns) - 1)]
+    weights_df.columns = ["date", "asset", *portfolio_names]
+    prices_df = prices_df.rename(columns={prices_df.columns[0]: "date"})
 
     weights_df["date"] = pd.to_datetime(weights_df["date"]).dt.date
     prices_df["date"] = pd.to_datetime(prices_df["date"]).dt.date
 
-    v0 = initial_amount
+    asset_symbols = list(weights_df["asset"].unique())
+    missing = [symbol for symbol in asset_symbols if symbol not in prices_df.columns]
+    if missing:
+        raise ValueError(f"Activos sin columna de precios: {', '.join(map(str, missing))}")
+
+    weights = weights_df.melt(
+        id_vars=["date", "asset"], var_name="portfolio", value_name="weight"
+    ).dropna(subset=["weight"])
+    prices = prices_df.melt(
+        id_vars="date", value_vars=asset_symbols, var_name="asset", value_name="price"
+    ).dropna(subset=["price"])
+    return weights, prices, portfolio_names
+
+
+def compute_holdings(weights, prices, v0):
+    """Une pesos con precios y calcula cantidades y montos iniciales."""
+    holdings = weights.merge(prices, on=["date", "asset"], how="left")
+    missing = holdings[holdings["price"].isna()]
+    if not missing.empty:
+        first = missing.iloc[0]
+        raise ValueError(f"No hay precio para {first['asset']} en {first['date']}")
+
+    holdings["amount"] = holdings["weight"] * v0
+    holdings["quantity"] = holdings["amount"] / holdings["price"]
+    return holdings
+
+
+def upsert_frame(model, frame, key_fields, value_fields):
+    """Carga ``frame`` en ``model`` insertando solo filas nuevas.
+
+    Las claves se comparan en bloque contra las existentes: las filas nuevas
+    se insertan, las que cambiaron se actualizan con ``ON CONFLICT DO
+    UPDATE`` y las idénticas se omiten. Devuelve los conteos y las filas
+    insertadas o actualizadas.
+    """
+    filters = {}
+    for key in key_fields:
+        if key == "date":
+            filters["date__range"] = (frame["date"].min(), frame["date"].max())
+        else:
+            filters[f"{key}__in"] = frame[key].unique().tolist()
+
+    existing = pd.DataFrame.from_records(
+        model.objects.filter(**filters).values_list(*key_fields, *value_fields),
+        columns=[*key_fields, *[f"{v}_db" for v in value_fields]],
+    )
+    merged = frame.merge(existing, on=key_fields, how="left", indicator=True)
+    new = merged[merged["_merge"] == "left_only"]
+    both = merged[merged["_merge"] == "both"]
+
+    changed_mask = np.zeros(len(both), dtype=bool)
+    for value in value_fields:
+        changed_mask |= ~np.isclose(both[value].astype(float), both[f"{value}_db"].astype(float))
+    changed = both[changed_mask]
+
+    def instances(rows):
+        fields = [*key_fields, *value_fields]
+        return [model(**dict(zip(fields, values)))
+                for values in zip(*(rows[f].tolist() for f in fields))]
+
+    # ignore_conflicts: otra carga en paralelo pudo insertar la misma clave
+    model.objects.bulk_create(instances(new), batch_size=BATCH_SIZE, ignore_conflicts=True)
+    model.objects.bulk_create(
+        instances(changed),
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=[key.removesuffix("_id") for key in key_fields],
+        update_fields=value_fields,
+    )
+    report = {"inserted": len(new), "updated": len(changed), "skipped": len(both) - len(changed)}
+    return report, pd.concat([new, changed])
+
+
+def load_incremental(weights, prices, holdings, portfolio_names, user_id):
+    """Carga incremental e idempotente: reutiliza activos y portafolios del
+    usuario y solo escribe filas nuevas o modificadas."""
+    asset_symbols = list(weights["asset"].unique())
+    Asset.objects.bulk_create(
+        [Asset(symbol=symbol, name=symbol) for symbol in asset_symbols], ignore_conflicts=True)
+    asset_map = dict(Asset.objects.filter(symbol__in=asset_symbols).values_list("symbol", "id"))
+
+    portfolio_map = dict(
+        Portfolio.objects.filter(user_id=user_id, name__in=portfolio_names).values_list("name", "id"))
+    created = Portfolio.objects.bulk_create([
+        Portfolio(user_id=user_id, name=name, created_at=datetime.date.today(), currency="USD")
+        for name in portfolio_names if name not in portfolio_map
+    ])
+    portfolio_map.update({p.name: p.id for p in created})
+
+    prices = prices.assign(asset_id=prices["asset"].map(asset_map))
+    holdings = holdings.assign(
+        asset_id=holdings["asset"].map(asset_map),
+        portfolio_id=holdings["portfolio"].map(portfolio_map),
+    )
+
+    report = {}
+    report["prices"], changed_prices = upsert_frame(
+        Price, prices, ["asset_id", "date"], ["price"])
+    holding_keys = ["portfolio_id", "asset_id", "date"]
+    report["weights"], changed_weights = upsert_frame(Weight, holdings, holding_keys, ["weight"])
+    report["quantities"], _ = upsert_frame(Quantity, holdings, holding_keys, ["quantity"])
+    report["amounts"], changed_amounts = upsert_frame(Amount, holdings, holding_keys, ["amount"])
+
+    # bulk_create no dispara señales: invalidar cachés y valorizaciones a mano
+    if not changed_prices.empty:
+        invalidate_price_panel()
+        mark_assets_dirty(changed_prices["asset_id"].unique().tolist(), changed_prices["date"].min())
+    changed_holdings = pd.concat([changed_weights, changed_amounts])
+    if not changed_holdings.empty:
+        mark_dirty(changed_holdings["portfolio_id"].unique().tolist(), changed_holdings["date"].min())
+
+    return report
+
+
+def process_excel_file(file_path, user_id, initial_amount=1000000000, incremental=False, on_progress=None):
+    progress = on_progress or (lambda stage: None)
+
+    progress("Leyendo archivo")
+    weights, prices, portfolio_names = read_excel_frames(file_path)
+    return load_frames(weights, prices, portfolio_names, user_id, initial_amount, incremental, progress)
+
+
+def load_frames(weights, prices, portfolio_names, user_id, initial_amount=1000000000, incremental=False,
+                on_progress=None):
+    """Carga pesos y precios en formato largo (ver :func:`tidy_frames`)."""
+    progress = on_progress or (lambda stage: None)
+    holdings = compute_holdings(weights, prices, initial_amount)
+
+    if incremental:
+        progress("Cargando datos (incremental)")
+        return load_incremental(weights, prices, holdings, portfolio_names, user_id)
 
     # Create assets
-    asset_symbols = weights_df["asset"].unique()
-    assets = [Asset(symbol=symbol, name=symbol) for symbol in asset_symbols]
-    Asset.objects.bulk_create(assets)
-    asset_map = {a.symbol: a for a in Asset.objects.all()}
-    print(f"Assets created: {asset_map}")
+    asset_symbols = list(weights["asset"].unique())
+    Asset.objects.bulk_create([Asset(symbol=symbol, name=symbol) for symbol in asset_symbols])
+    asset_map = dict(Asset.objects.filter(symbol__in=asset_symbols).values_list("symbol", "id"))
 
     # Create portfolios
-    portfolio_names = weights_df.columns[2:]
-    portfolios = [Portfolio(user_id=user_id, name=name, created_at=datetime.date.today(), currency="USD") for name in portfolio_names]
-    Portfolio.objects.bulk_create(portfolios)
-    portfolio_map = {p.name: p for p in Portfolio.objects.all()}
+    portfolios = Portfolio.objects.bulk_create([
+        Portfolio(user_id=user_id, name=name, created_at=datetime.date.today(), currency="USD")
+        for name in portfolio_names
+    ])
+    portfolio_map = {p.name: p.id for p in portfolios}
 
     # Create prices
+    progress("Cargando precios")
     try:
-        price_entries = []
-        for _, row in prices_df.iterrows():
-            for asset_name in asset_symbols:
-                price_entries.append(Price(
-                    asset=asset_map[asset_name],
-                    date=row["date"],
-                    price=row[asset_name]
-                ))
-        Price.objects.bulk_create(price_entries)
-    except Exception as e:
-        print(f"Error creating prices: {e}")
+        Price.objects.bulk_create(
+            [
+                Price(asset_id=asset_id, date=date, price=price)
+                for date, asset_id, price in zip(
+                    prices["date"], prices["asset"].map(asset_map).tolist(), prices["price"].tolist())
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        invalidate_price_panel()
+    except Exception:
+        logger.exception("Error creando precios")
 
     # Create weights, quantities, and amounts
+    progress("Cargando pesos, cantidades y montos")
+    columns = zip(
+        holdings["portfolio"].map(portfolio_map).tolist(),
+        holdings["asset"].map(asset_map).tolist(),
+        holdings["date"],
+        holdings["weight"].tolist(),
+        holdings["quantity"].tolist(),
+        holdings["amount"].tolist(),
+    )
     weight_entries = []
     quantity_entries = []
     amount_entries = []
-    for _, row in weights_df.iterrows():
-        asset = asset_map[row["asset"]]
-        date = row["date"]
-        for name in portfolio_names:
-            portfolio = portfolio_map[name]
-            weight = row[name]
-            price = Price.objects.get(asset=asset, date=date).price
-            quantity = (weight * v0) / price
-            amount = weight * v0
-
-            weight_entries.append(Weight(portfolio=portfolio, asset=asset, weight=weight, date=date))
-            quantity_entries.append(Quantity(portfolio=portfolio, asset=asset, quantity=quantity, date=date))
-            amount_entries.append(Amount(portfolio=portfolio, asset=asset, amount=amount, date=date))
-
-    Weight.objects.bulk_create(weight_entries)
-    Quantity.objects.bulk_create(quantity_entries)
-    Amount.objects.bulk_create(amount_entries)
\ No newline at end of file
+    for portfolio_id, asset_id, date, weight, quantity, amount in columns:
+        weight_entries.append(Weight(portfolio_id=portfolio_id, asset_id=asset_id, weight=weight, date=date))
+        quantity_entries.append(Quantity(portfolio_id=portfolio_id, asset_id=asset_id, quantity=quantity, date=date))
+        amount_entries.append(Amount(portfolio_id=portfolio_id, asset_id=asset_id, amount=amount, date=date))
+
+    Weight.objects.bulk_create(weight_entries, batch_size=BATCH_SIZE)
+    Quantity.objects.bulk_create(quantity_entries, batch_size=BATCH_SIZE)
+    Amount.objects.bulk_create(amount_entries, batch_size=BATCH_SIZE)
+
+    inserted = {"prices": len(prices), "weights": len(weight_entries),
+                "quantities": len(quantity_entries), "amounts": len(amount_entries)}
+    return {table: {"inserted": n, "updated": 0, "skipped": 0} for table, n in inserted.items()}
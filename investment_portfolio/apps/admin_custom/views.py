@@ -1,14 +1,23 @@
+import json
+import os
 import tempfile
+from datetime import datetime
 
-import requests
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.shortcuts import redirect, render
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 
+from ..common.profiling import list_captures, load_capture, profile_token
 from ..portfolios.models import Portfolio
-from .utils import process_excel_file
+from ..portfolios.services import TradeError, portfolio_value, simulate_trade
 from .forms import ExcelUploadForm, TradeSimulationForm
+from .jobs import enqueue_excel
+from .models import IngestionJob
 
 
 @login_required
@@ -24,81 +33,77 @@ def pre_weights_chart_view(request):
     return render(request, "admin/pre_weights_chart.html", {"portfolios": portfolios})
 
 
+CHART_POINTS = 400  # Puntos por serie que se envían al gráfico
+
+
+def _chart_data(rows):
+    """Series del gráfico: fechas, V_t y pesos (%) por activo."""
+    pesos_por_activo = {}
+    for item in rows:
+        for activo, peso in item["weights"].items():
+            pesos_por_activo.setdefault(activo, []).append(round(peso*100, 2))
+    return {
+        "dates": [item["date"] for item in rows],
+        "vt": [item["portfolio_value"] for item in rows],
+        "weights": pesos_por_activo
+    }
+
+
 def weights_chart_view(request, pk):    
     fecha_inicio = request.GET.get("dateStart", "2022-02-15")
     fecha_fin = request.GET.get("dateEnd", "2023-02-15")
 
-    print(request)
-
-    # Construcción del endpoint local
-    api_url = f"http://localhost:8000/portfolios/v1/portfolios/{pk}/value/?dateStart={fecha_inicio}&dateEnd={fecha_fin}"
-
+    data_url = reverse("admin:weights_chart_data", args=[pk])
     try:
-        response = requests.get(api_url, timeout=100)
-        response.raise_for_status()
-        data = response.json()
+        portfolio = get_object_or_404(Portfolio, pk=pk)
+        start = datetime.strptime(fecha_inicio, "%Y-%m-%d").date()
+        end = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
+        # Serie reducida para todo el rango; el detalle se pide al hacer zoom
+        data = portfolio_value(portfolio, start, end, max_points=CHART_POINTS)
 
         if not data:
             messages.warning(request, "No hay datos disponibles para las fechas seleccionadas.")
-            return render(request, "admin/weights_chart.html", {"chart_data": {}})
-
-        # Preparar datos
-        fechas = [item["date"] for item in data]
-        vt = [item["portfolio_value"] for item in data]
-
-        # Agrupar pesos por activo
-        pesos_por_activo = {}
-        for item in data:
-            for activo, peso in item["weights"].items():
-                pesos_por_activo.setdefault(activo, []).append(round(peso*100, 2))
-
-        chart_data = {
-            "dates": fechas,
-            "vt": vt,
-            "weights": pesos_por_activo
-        }
-
-    except requests.exceptions.RequestException as e:
-        messages.error(request, f"Error al conectar con el API: {e}")
+            return render(request, "admin/weights_chart.html", {"chart_data": "{}", "data_url": data_url})
+
+        chart_data = _chart_data(data)
+
+    except ValueError as e:
+        messages.error(request, f"Error al calcular la evolución: {e}")
         chart_data = {"dates": [], "vt": [], "weights": {}}
 
-    return render(request, "admin/weights_chart.html", {"chart_data": chart_data})
+    return render(request, "admin/weights_chart.html",
+                  {"chart_data": json.dumps(chart_data, cls=DjangoJSONEncoder), "data_url": data_url})
+
+
+def weights_chart_data_view(request, pk):
+    """Tramo de la serie del gráfico, reducido a ``CHART_POINTS`` fechas."""
+    portfolio = get_object_or_404(Portfolio, pk=pk)
+    try:
+        start = datetime.strptime(request.GET.get("dateStart", ""), "%Y-%m-%d").date()
+        end = datetime.strptime(request.GET.get("dateEnd", ""), "%Y-%m-%d").date()
+        data = portfolio_value(portfolio, start, end, max_points=CHART_POINTS)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(_chart_data(data), encoder=DjangoJSONEncoder)
+
 
 def trade_simulation_view(request):
     if request.method == "POST":
         form = TradeSimulationForm(request.POST)
         if form.is_valid():
-            pk = form.cleaned_data["portfolio"].id
+            portfolio = form.cleaned_data["portfolio"]
             date = form.cleaned_data["date"]
             sell_asset = form.cleaned_data["sell_asset"]
             buy_asset = form.cleaned_data["buy_asset"]
             amount = form.cleaned_data["amount"]
 
-            # Llama a la API interna
-            url = f"http://localhost:8000/portfolios/v1/portfolios/{pk}/trade/"
-            payload = {
-                "date": date.strftime("%Y-%m-%d"),
-                "sell_asset_symbol": sell_asset.symbol,
-                "buy_asset_symbol": buy_asset.symbol,
-                "amount": amount,
-            }
-
+            # Registra el trade directamente en la capa de servicios
             try:
-                response = requests.post(url, json=payload)
-
-                if response.status_code in [200, 201]:
-                    messages.success(request, "Trade simulation successful.")
-                    return redirect(f"/admin/")
-                else:
-                    try:
-                        error_data = response.json()
-                        error_message = error_data.get("error", "Unknown error")
-                    except ValueError:
-                        error_message = response.text
-
-                    messages.error(request, f"Error: {response.status_code} - {error_message}")
-            except requests.exceptions.RequestException as e:
-                messages.error(request, f"Error connecting to the API: {e}")
+                simulate_trade(portfolio, date, sell_asset, buy_asset, amount)
+                messages.success(request, "Trade simulation successful.")
+                return redirect("/admin/")
+            except TradeError as e:
+                messages.error(request, f"Error: {e}")
         else:
             # Mostrar errores específicos del formulario
             for field, errors in form.errors.items():
@@ -137,21 +142,63 @@ def upload_excel_view(request):
         if form.is_valid():
             excel_file = request.FILES["file"]
 
-            # Guardar el archivo temporalmente
-            with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            # Guardar el archivo donde el worker de cargas pueda leerlo
+            os.makedirs(settings.INGESTION_UPLOAD_DIR, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=settings.INGESTION_UPLOAD_DIR, suffix=".xlsx", delete=False) as tmp:
                 for chunk in excel_file.chunks():
                     tmp.write(chunk)
                 tmp_path = tmp.name
 
-            try:
-                # Procesar el archivo Excel con el ID del usuario seleccionado y el monto inicial
-                process_excel_file(tmp_path, user_id=selected_user_id, initial_amount=float(initial_amount))
-                messages.success(request, "✅ Archivo procesado correctamente.")
-                return redirect("/admin/")
-            except Exception as e:
-                messages.error(request, f"❌ Error al procesar: {str(e)}")
+            # Encolar el procesamiento; la respuesta vuelve de inmediato
+            job = enqueue_excel(
+                tmp_path,
+                excel_file.name,
+                user_id=selected_user_id,
+                initial_amount=float(initial_amount),
+                incremental=bool(request.POST.get("incremental")),
+            )
+            messages.success(request, f"✅ Archivo encolado (carga #{job.pk}).")
+            return redirect("admin:ingestion_job", pk=job.pk)
     else:
         form = ExcelUploadForm()
 
     # Renderizar el formulario con la lista de usuarios
-    return render(request, "admin/upload_excel.html", {"form": form, "users": users})
\ No newline at end of file
+    return render(request, "admin/upload_excel.html", {"form": form, "users": users})
+
+
+def ingestion_job_view(request, pk):
+    job = get_object_or_404(IngestionJob, pk=pk)
+    return render(request, "admin/ingestion_job.html", {"job": job})
+
+
+def ingestion_job_status_view(request, pk):
+    job = get_object_or_404(IngestionJob, pk=pk)
+    return JsonResponse({
+        "id": job.pk,
+        "file_name": job.file_name,
+        "status": job.status,
+        "stage": job.stage,
+        "report": job.report,
+        "rows_written": job.rows_written,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "duration": job.duration,
+    })
+
+
+def profile_captures_view(request):
+    """Capturas de solicitudes lentas y un token para perfilar a pedido."""
+    return render(request, "admin/profile_captures.html", {
+        "captures": list_captures(),
+        "token": profile_token() if request.user.is_superuser else None,
+        "budget_ms": settings.SLOW_REQUEST_BUDGET_MS,
+    })
+
+
+def profile_capture_view(request, capture_id):
+    capture = load_capture(capture_id)
+    if capture is None:
+        raise Http404("La captura no existe o ya fue rotada")
+    return render(request, "admin/profile_capture.html", {"capture": capture})
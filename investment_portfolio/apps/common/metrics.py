@@ -0,0 +1,131 @@
+import os
+import time
+from contextlib import asynccontextmanager
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.db import connection
+from django.http import HttpResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Histogram, generate_latest,
+                               multiprocess)
+
+# Con PROMETHEUS_MULTIPROC_DIR (ver settings) cada worker escribe sus valores
+# en archivos mapeados en memoria de ese directorio y /metrics los suma
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Latencia de la solicitud por vista",
+    ["view", "method", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+SQL_QUERIES = Histogram(
+    "http_request_sql_queries", "Consultas SQL por solicitud",
+    ["view"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+SQL_TIME = Histogram(
+    "http_request_sql_duration_seconds", "Tiempo total en SQL por solicitud",
+    ["view"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Tamaño del cuerpo de la respuesta por vista",
+    ["view"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
+
+METRICS_VIEW = "metrics"  # Nombre de la ruta de /metrics (no se mide a sí misma)
+UNRESOLVED_VIEW = "<unresolved>"  # 404: una sola etiqueta para no multiplicar series
+
+
+class QueryCounter:
+    """``execute_wrapper`` que cuenta las consultas y suma su duración."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+@asynccontextmanager
+async def async_execute_wrapper(wrapper):
+    """``connection.execute_wrapper`` para código async.
+
+    Las conexiones son por hilo: el wrapper se instala en la del hilo donde
+    ``sync_to_async`` ejecuta el ORM de la solicitud (uno por solicitud bajo
+    ASGI), no en la del hilo del event loop.
+    """
+    await sync_to_async(lambda: connection.execute_wrappers.append(wrapper))()
+    try:
+        yield
+    finally:
+        await sync_to_async(lambda: connection.execute_wrappers.remove(wrapper))()
+
+
+class MetricsMiddleware:
+    """Registra latencia, consultas SQL, tiempo en SQL y tamaño de respuesta
+    por nombre de vista.
+
+    En respuestas en streaming solo cuenta lo ejecutado antes de empezar a
+    enviar el cuerpo, y el tamaño no se registra.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        observe(request, response, queries, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        queries = QueryCounter()
+        started = time.perf_counter()
+        async with async_execute_wrapper(queries):
+            response = await self.get_response(request)
+        observe(request, response, queries, time.perf_counter() - started)
+        return response
+
+
+def observe(request, response, queries, elapsed):
+    view = view_label(request)
+    if view == METRICS_VIEW:
+        return
+    REQUEST_LATENCY.labels(view, request.method, str(response.status_code)).observe(elapsed)
+    SQL_QUERIES.labels(view).observe(queries.count)
+    SQL_TIME.labels(view).observe(queries.duration)
+    if not response.streaming:
+        RESPONSE_SIZE.labels(view).observe(len(response.content))
+
+
+def view_label(request):
+    """Nombre de la ruta resuelta (o la ruta de la función si no tiene nombre)."""
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else UNRESOLVED_VIEW
+
+
+def metrics_view(request):
+    """Métricas en formato de texto de Prometheus, sumadas entre workers."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,414 @@
+import cProfile
+import heapq
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from apps.common.metrics import async_execute_wrapper
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core import signing
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "HTTP_X_DEBUG_PROFILE"  # Header X-Debug-Profile con un token de profile_token()
+TOKEN_SALT = "apps.common.profiling"
+SAMPLE_INTERVAL = 0.005  # Segundos entre muestras de la pila
+TOP_ENTRIES = 40  # Funciones y pilas que se guardan en cada captura
+MAX_SQL_CHARS = 20_000
+
+# Planes por motor; EXPLAIN ANALYZE vuelve a ejecutar la consulta (solo SELECT)
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    "mysql": "EXPLAIN ANALYZE ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+# SELECT que bloquean filas o tienen efectos: no se vuelven a ejecutar
+UNSAFE_SQL = re.compile(
+    r"\bFOR\s+(?:NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b|\bINTO\b|\b(?:NEXTVAL|SETVAL|PG_ADVISORY\w*)\s*\(",
+    re.IGNORECASE)
+EXPLAIN_TIMEOUT_MS = 5000
+CAPTURE_ID = re.compile(r"^[0-9T]+-[0-9a-f]{8}$")
+
+
+def profile_token():
+    """Token firmado para perfilar una solicitud con el header X-Debug-Profile
+    (vale ``PROFILE_TOKEN_MAX_AGE`` segundos)."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign("profile")
+
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class SlowQueryRecorder:
+    """``execute_wrapper`` que guarda las ``keep`` consultas más lentas."""
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self._slowest = []  # Montículo de (duración, orden, sql, params, many)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            entry = (duration, self.count, sql, params, many)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        return sorted(self._slowest, reverse=True)
+
+
+class StackSampler:
+    """Hilo que muestrea la pila de las solicitudes que pasaron su plazo.
+
+    Cada solicitud se registra con un plazo; mientras no lo supere no se
+    toman muestras, así las solicitudes rápidas casi no tienen costo.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self._watched = {}  # id del hilo -> (plazo, Counter de pilas)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def watch(self, deadline, thread_id):
+        """Registra el hilo y devuelve el Counter donde se acumulan sus pilas."""
+        samples = Counter()
+        with self._lock:
+            self._watched[thread_id] = (deadline, samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return samples
+
+    def unwatch(self, thread_id):
+        with self._lock:
+            self._watched.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                watched = list(self._watched.items())
+            if not watched:
+                self._wake.wait()
+                continue
+
+            now = time.perf_counter()
+            due = [(thread_id, samples) for thread_id, (deadline, samples) in watched if deadline <= now]
+            if due:
+                frames = sys._current_frames()
+                for thread_id, samples in due:
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+                time.sleep(self.interval)
+            else:
+                # Nadie pasó su plazo: dormir hasta el más próximo (o hasta otro registro)
+                self._wake.wait(min(deadline for deadline, _ in dict(watched).values()) - now)
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        stack.append(f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+_sampler = None
+_profiler_lock = threading.Lock()  # cProfile admite un solo perfilador activo
+
+
+def sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = StackSampler()
+    return _sampler
+
+
+class SlowRequestMiddleware:
+    """Captura perfil y consultas de las solicitudes lentas o marcadas.
+
+    Con un token válido en el header X-Debug-Profile la vista se perfila con
+    cProfile; si no, las que superan ``SLOW_REQUEST_BUDGET_MS`` se muestrean
+    desde que pasan el presupuesto. En ambos casos se guardan las
+    ``PROFILE_SLOW_SQL`` consultas más lentas con su plan (que se obtiene
+    después de responder) en ``PROFILE_CAPTURE_DIR``, que conserva las
+    ``PROFILE_CAPTURE_KEEP`` más recientes. En streaming solo se mide hasta
+    que empieza el cuerpo.
+
+    Bajo ASGI el muestreo y cProfile se instalan en el hilo donde corre el
+    código síncrono de la solicitud (ORM y cálculo de la valorización, ver
+    ``sync_to_async``); el event loop no se mide.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        capture = _Capture.begin(request)
+        if capture is None:
+            return self.get_response(request)
+
+        capture.attach()
+        try:
+            with connection.execute_wrapper(capture.queries):
+                response = self.get_response(request)
+        finally:
+            capture.detach()
+        capture.save(request, response)
+        return response
+
+    async def __acall__(self, request):
+        capture = _Capture.begin(request)
+        if capture is None:
+            return await self.get_response(request)
+
+        # Mismo hilo en el que sync_to_async corre el código de la solicitud
+        await sync_to_async(capture.attach)()
+        try:
+            async with async_execute_wrapper(capture.queries):
+                response = await self.get_response(request)
+        finally:
+            await sync_to_async(capture.detach)()
+        await sync_to_async(capture.save)(request, response)
+        return response
+
+
+class _Capture:
+    """Estado de una solicitud que se está midiendo."""
+
+    def __init__(self, forced, budget):
+        self.forced = forced
+        self.budget = budget
+        self.queries = SlowQueryRecorder(settings.PROFILE_SLOW_SQL)
+        self.profiler = None
+        if forced and _profiler_lock.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+        self.samples = None
+        self.thread_id = None
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    @classmethod
+    def begin(cls, request):
+        """Captura para la solicitud, o None si no hay nada que medir."""
+        budget = settings.SLOW_REQUEST_BUDGET_MS / 1000
+        forced = PROFILE_HEADER in request.META and valid_token(request.META[PROFILE_HEADER])
+        if not forced and not budget:
+            return None
+        return cls(forced, budget)
+
+    def attach(self):
+        """Empieza a medir el hilo actual: cProfile solo ve el hilo donde se
+        activa y el muestreo sigue la pila de un hilo."""
+        if self.profiler:
+            self.profiler.enable()
+        else:
+            self.thread_id = threading.get_ident()
+            self.samples = sampler().watch(self.started + (0 if self.forced else self.budget), self.thread_id)
+
+    def detach(self):
+        """Deja de medir; debe llamarse en el mismo hilo que :meth:`attach`."""
+        if self.profiler:
+            self.profiler.disable()
+            _profiler_lock.release()
+        elif self.thread_id is not None:
+            sampler().unwatch(self.thread_id)
+        self.elapsed = time.perf_counter() - self.started
+
+    def save(self, request, response):
+        if not (self.forced or self.elapsed > self.budget):
+            return
+        try:
+            write_capture(request, response, self.elapsed, "header" if self.forced else "budget", self.queries,
+                          _profile_text(self.profiler) if self.profiler else _samples_text(self.samples))
+        except Exception:
+            logger.exception("No se pudo guardar la captura de %s", request.path)
+
+
+def _profile_text(profiler):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(TOP_ENTRIES)
+    return out.getvalue()
+
+
+def _samples_text(samples):
+    total = sum(samples.values())
+    if not total:
+        return "Sin muestras"
+    own = Counter()
+    for stack, count in samples.items():
+        own[stack.rsplit(";", 1)[-1]] += count
+
+    lines = [f"{total} muestras cada {SAMPLE_INTERVAL * 1000:.0f} ms", "", "Tiempo propio por función:"]
+    lines += [f"{count:7d} {count / total:7.1%}  {function}" for function, count in own.most_common(TOP_ENTRIES)]
+    lines += ["", "Pilas más frecuentes:"]
+    lines += [f"{count:7d} {count / total:7.1%}  {stack}" for stack, count in samples.most_common(TOP_ENTRIES)]
+    return "\n".join(lines)
+
+
+def explain(sql, params, many):
+    """Plan de ejecución de una consulta SELECT, o None si no aplica.
+
+    Corre en una transacción que se revierte y, en PostgreSQL, con un límite
+    de ``EXPLAIN_TIMEOUT_MS``; las consultas con bloqueos (``FOR UPDATE``) o
+    efectos no se ejecutan.
+    """
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if (many or prefix is None or not sql.lstrip().upper().startswith("SELECT")
+            or UNSAFE_SQL.search(sql)):
+        return None
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+            cursor.execute(prefix + sql, params)
+            plan = "\n".join(" ".join(str(value) for value in row) for row in cursor.fetchall())
+            transaction.set_rollback(True)
+        return plan
+    except Exception as e:
+        return f"No se pudo obtener el plan: {e}"
+
+
+_planner = None
+
+
+def planner():
+    """Hilo que obtiene los planes de las capturas después de responder."""
+    global _planner
+    if _planner is None:
+        _planner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+    return _planner
+
+
+def wait_for_plans():
+    """Espera a que se guarden los planes pendientes."""
+    planner().submit(lambda: None).result()
+
+
+def write_capture(request, response, elapsed, trigger, queries, profile):
+    """Guarda la captura como JSON y rota el directorio.
+
+    Los planes de las consultas se obtienen después, en el hilo de
+    :func:`planner`, para no demorar la respuesta.
+    """
+    directory = Path(settings.PROFILE_CAPTURE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    capture_id = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+
+    slowest = queries.slowest()
+    match = getattr(request, "resolver_match", None)
+    capture = {
+        "id": capture_id,
+        "created_at": now.isoformat(),
+        "method": request.method,
+        "path": request.get_full_path(),
+        "view": match.view_name if match else None,
+        "status": response.status_code,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "trigger": trigger,
+        "sql_count": queries.count,
+        "sql_ms": round(queries.duration * 1000, 1),
+        "profile": profile,
+        "plans_pending": bool(slowest),
+        "slow_sql": [
+            {"duration_ms": round(duration * 1000, 2), "sql": sql[:MAX_SQL_CHARS],
+             "params": repr(params)[:MAX_SQL_CHARS], "plan": None}
+            for duration, _, sql, params, many in slowest
+        ],
+    }
+
+    path = directory / f"{capture_id}.json"
+    _write_json(path, capture)
+    for old in sorted(directory.glob("*.json"))[:-settings.PROFILE_CAPTURE_KEEP or None]:
+        old.unlink(missing_ok=True)
+
+    if slowest:
+        planner().submit(_add_plans, path, [(sql, params, many) for _, _, sql, params, many in slowest])
+    return capture_id
+
+
+def _add_plans(path, queries):
+    try:
+        plans = [explain(sql, params, many) for sql, params, many in queries]
+        try:
+            capture = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return  # La captura ya se rotó
+        for query, plan in zip(capture["slow_sql"], plans):
+            query["plan"] = plan
+        capture["plans_pending"] = False
+        _write_json(path, capture)
+    except Exception:
+        logger.exception("No se pudieron guardar los planes de %s", path.name)
+    finally:
+        # El hilo es de larga vida: no conservar su conexión entre capturas
+        connection.close()
+
+
+def _write_json(path, data):
+    tmp = path.with_name(f".{path.stem}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2))
+    os.replace(tmp, path)
+
+
+def list_captures():
+    """Resumen de las capturas guardadas, de la más reciente a la más antigua."""
+    captures = []
+    for path in sorted(Path(settings.PROFILE_CAPTURE_DIR).glob("*.json"), reverse=True):
+        try:
+            capture = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        captures.append({key: capture[key] for key in (
+            "id", "created_at", "method", "path", "view", "status", "elapsed_ms", "trigger", "sql_count", "sql_ms")})
+    return captures
+
+
+def load_capture(capture_id):
+    """Captura completa, o None si no existe."""
+    if not CAPTURE_ID.match(capture_id):
+        return None
+    try:
+        return json.loads((Path(settings.PROFILE_CAPTURE_DIR) / f"{capture_id}.json").read_text())
+    except (OSError, ValueError):
+        return None
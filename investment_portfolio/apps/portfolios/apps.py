@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class PortfoliosConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "apps.portfolios"
+
+    def ready(self):
+        from apps.portfolios import signals  # noqa: F401
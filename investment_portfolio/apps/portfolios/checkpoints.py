@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.db.models import Max
+
+from apps.portfolios.models import HoldingSnapshot
+from apps.portfolios.sampling import RESAMPLE_RULES
+
+BATCH_SIZE = 1000
+
+
+def latest_checkpoints(portfolio_ids, day):
+    """Checkpoint más reciente en o antes de ``day`` de cada portafolio.
+
+    Devuelve ``{portfolio_id: (fecha, {asset_id: cantidad})}`` con dos
+    consultas; los portafolios sin checkpoint no aparecen.
+    """
+    latest = dict(_latest_dates(portfolio_ids, day))
+    if not latest:
+        return {}
+    return _checkpoints(latest, _holdings_queryset(latest))
+
+
+async def alatest_checkpoints(portfolio_ids, day):
+    """Versión async de :func:`latest_checkpoints`."""
+    latest = {pid: d async for pid, d in _latest_dates(portfolio_ids, day)}
+    if not latest:
+        return {}
+    return _checkpoints(latest, [row async for row in _holdings_queryset(latest)])
+
+
+def _latest_dates(portfolio_ids, day):
+    return (HoldingSnapshot.objects.filter(portfolio_id__in=portfolio_ids, date__lte=day)
+            .values_list("portfolio_id").annotate(last=Max("date")))
+
+
+def _holdings_queryset(latest):
+    return HoldingSnapshot.objects.filter(
+        portfolio_id__in=list(latest), date__in=set(latest.values())).values_list(
+        "portfolio_id", "date", "asset_id", "quantity")
+
+
+def _checkpoints(latest, rows):
+    checkpoints = {pid: (d, {}) for pid, d in latest.items()}
+    for pid, d, asset_id, quantity in rows:
+        if d == latest[pid]:
+            checkpoints[pid][1][asset_id] = quantity
+    return checkpoints
+
+
+def invalidate_checkpoints(portfolio_ids, since):
+    """Borra los checkpoints que dejan de valer por cambios desde ``since``."""
+    HoldingSnapshot.objects.filter(portfolio_id__in=portfolio_ids, date__gte=since).delete()
+
+
+def write_checkpoints(portfolio, series, after):
+    """Guarda como checkpoints las cantidades del cierre de cada período.
+
+    Toma de ``series`` (una :class:`ValuationSeries`) la última fecha de cada
+    período de ``HOLDING_CHECKPOINT_FREQUENCY`` posterior a ``after`` y
+    guarda solo las posiciones distintas de cero. El período en curso queda
+    con un checkpoint provisorio que se reemplaza cuando el período avanza.
+    """
+    period_of = RESAMPLE_RULES[settings.HOLDING_CHECKPOINT_FREQUENCY]
+    dates = series.python_dates()
+    rows = [i for i, d in enumerate(dates)
+            if d > after and (i + 1 == len(dates) or period_of(dates[i + 1]) != period_of(d))]
+    if not rows:
+        return
+
+    # Compactación: un solo checkpoint por período
+    periods = {period_of(dates[i]) for i in rows}
+    existing = HoldingSnapshot.objects.filter(portfolio=portfolio)
+    replaced = {d for d in existing.values_list("date", flat=True).distinct() if period_of(d) in periods}
+    if replaced:
+        existing.filter(date__in=replaced).delete()
+
+    HoldingSnapshot.objects.bulk_create(
+        [HoldingSnapshot(portfolio=portfolio, asset_id=asset_id, date=dates[i], quantity=quantity)
+         for i in rows
+         for asset_id, quantity in zip(series.asset_ids, series.quantities[i].tolist()) if quantity],
+        batch_size=BATCH_SIZE,
+    )
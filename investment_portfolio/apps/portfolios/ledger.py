@@ -0,0 +1,123 @@
+import math
+
+import numpy as np
+
+from apps.portfolios.models import PortfolioEvent
+
+
+class PositionLedger:
+    """Libro de posiciones construido a partir de los eventos del portafolio.
+
+    Los eventos se leen una sola vez, ordenados por fecha, y se consumen con
+    un cursor: ``advance_to(d)`` aplica los eventos con fecha <= d y
+    ``positions`` entrega el vector de cantidades c_{i,t} vigente. Recorrer
+    todas las fechas de un rango cuesta O(fechas + eventos).
+    """
+
+    def __init__(self, asset_ids, initial, events):
+        self.asset_ids = list(asset_ids)
+        self._columns = {asset_id: i for i, asset_id in enumerate(self.asset_ids)}
+        self._running = np.array(initial, dtype=float)
+        self._events = list(events)
+        self._cursor = 0
+        self.date = None
+        self.rejected = []  # Eventos sin precio o ventas sin cantidad suficiente
+
+    @classmethod
+    def for_portfolio(cls, portfolio, asset_ids, initial, start, end):
+        """Lee en una consulta los eventos de compra/venta entre start y end."""
+        events = load_events([portfolio.pk], start, end).get(portfolio.pk, [])
+        return cls(asset_ids, initial, events)
+
+    @property
+    def positions(self):
+        return self._running.copy()
+
+    def advance_to(self, day, prices=None):
+        """Aplica los eventos pendientes con fecha <= day.
+
+        ``prices`` es el vector de precios del día, usado para los eventos
+        que no registran su precio de ejecución.
+        """
+        if self.date is not None and day < self.date:
+            raise ValueError("El cursor del ledger no puede retroceder")
+        self.date = day
+
+        events = self._events
+        while self._cursor < len(events) and events[self._cursor][0] <= day:
+            self._apply(events[self._cursor], prices)
+            self._cursor += 1
+        return self._running
+
+    def _apply(self, event, prices):
+        _, asset_id, event_type, amount, price = event
+        col = self._columns.get(asset_id)
+        if col is None:
+            self.rejected.append(event)
+            return
+
+        if not price and prices is not None:
+            price = prices[col]
+        if not price or math.isnan(price) or price <= 0:
+            self.rejected.append(event)
+            return
+
+        units = amount / price
+        if event_type == PortfolioEvent.EventType.BUY:
+            self._running[col] += units
+        elif event_type == PortfolioEvent.EventType.SELL:
+            if self._running[col] >= units:
+                self._running[col] -= units
+            else:
+                self.rejected.append(event)
+
+    def quantity_matrix(self, panel):
+        """Matriz fechas × activos de cantidades alineada con ``panel``.
+
+        Solo se mueve el cursor en las fechas donde hay eventos; entre ellas
+        las cantidades se copian por bloques.
+        """
+        quantities = np.empty((len(panel.dates), len(self.asset_ids)))
+        pending = np.array([e[0] for e in self._events[self._cursor:]], dtype="datetime64[D]")
+        change_rows = np.unique(np.searchsorted(panel.dates, pending))
+
+        row = 0
+        for change in change_rows[change_rows < len(panel.dates)]:
+            quantities[row:change] = self._running
+            self.advance_to(panel.dates[change].astype(object), panel.prices[change])
+            row = change
+        quantities[row:] = self._running
+        return quantities
+
+
+def load_events(portfolio_ids, start, end):
+    """Eventos de compra/venta de varios portafolios en una sola consulta.
+
+    Devuelve ``{portfolio_id: [(date, asset_id, type, amount, price), ...]}``
+    con los eventos de cada portafolio ordenados por fecha.
+    """
+    return _group_events(_events_queryset(portfolio_ids, start, end))
+
+
+async def aload_events(portfolio_ids, start, end):
+    """Versión async de :func:`load_events`."""
+    return _group_events([row async for row in _events_queryset(portfolio_ids, start, end)])
+
+
+def _events_queryset(portfolio_ids, start, end):
+    return (
+        PortfolioEvent.objects.filter(
+            portfolio_id__in=portfolio_ids,
+            date__range=(start, end),
+            type__in=(PortfolioEvent.EventType.BUY, PortfolioEvent.EventType.SELL),
+        )
+        .order_by("date", "id")
+        .values_list("portfolio_id", "date", "asset_id", "type", "amount", "price")
+    )
+
+
+def _group_events(rows):
+    events = {}
+    for portfolio_id, *event in rows:
+        events.setdefault(portfolio_id, []).append(tuple(event))
+    return events
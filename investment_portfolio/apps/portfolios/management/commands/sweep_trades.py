@@ -0,0 +1,63 @@
+import json
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from apps.portfolios.models import Portfolio
+from apps.portfolios.services import TradeError, sweep_trades
+
+
+def _date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _pair(value):
+    sell, sep, buy = value.partition(":")
+    if not sep or not sell or not buy:
+        raise ValueError(value)
+    return sell, buy
+
+
+class Command(BaseCommand):
+    help = "Simula en memoria una grilla de trades (fechas × montos × pares) y resume cada escenario."
+
+    def add_arguments(self, parser):
+        parser.add_argument("portfolio_id", type=int, help="ID del portafolio")
+        parser.add_argument("--dates", type=_date, nargs="+", required=True, help="Fechas de los trades (YYYY-MM-DD)")
+        parser.add_argument("--amounts", type=float, nargs="+", required=True, help="Montos en USD")
+        parser.add_argument("--pairs", type=_pair, nargs="+", required=True,
+                            help="Pares VENTA:COMPRA de símbolos, p. ej. EEUU:Europa")
+        parser.add_argument("--date-end", type=_date, help="Última fecha de valorización (por defecto, hoy)")
+        parser.add_argument("--processes", type=int, help="Procesos del pool (por defecto, SCENARIO_SWEEP_PROCESSES)")
+        parser.add_argument("--output", help="Guarda los resultados en este archivo JSON")
+
+    def handle(self, *args, **kwargs):
+        try:
+            portfolio = Portfolio.objects.get(pk=kwargs["portfolio_id"])
+        except Portfolio.DoesNotExist:
+            raise CommandError("Portafolio no encontrado")
+
+        started = time.perf_counter()
+        try:
+            results = sweep_trades(portfolio, kwargs["dates"], kwargs["amounts"], kwargs["pairs"],
+                                   kwargs["date_end"], kwargs["processes"])
+        except TradeError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        for row in results:
+            label = f"{row['date']} {row['sell']}→{row['buy']} {row['amount']:,.0f} USD"
+            if row["error"]:
+                self.stdout.write(f"{label}: {row['error']}")
+            else:
+                self.stdout.write(
+                    f"{label}: V_t final {row['final_value']:,.2f} | "
+                    f"drift {row['weight_drift']:.4f} | max drawdown {row['max_drawdown']:.2%}")
+
+        if kwargs["output"]:
+            with open(kwargs["output"], "w") as f:
+                json.dump(results, f, cls=DjangoJSONEncoder, ensure_ascii=False, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ {len(results)} escenarios en {elapsed:.2f} s"))
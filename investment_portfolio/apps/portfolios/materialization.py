@@ -0,0 +1,293 @@
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, DateField, F, Max, Q, Value, When
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from apps.portfolios.checkpoints import invalidate_checkpoints, write_checkpoints
+from apps.portfolios.models import (MaterializedWeight, Portfolio,
+                                    PortfolioEvent, PortfolioValuationState,
+                                    PortfolioValue, Price, Weight)
+from apps.portfolios.segment_cache import (cached_segments, month_end,
+                                           month_start, segment_cache)
+from apps.portfolios.valuation import (held_assets, initial_weight_date,
+                                       portfolio_valuation)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+STREAM_CHUNK_DAYS = 90
+
+
+def mark_dirty(portfolio_ids, since):
+    """Marca que la valorización de los portafolios cambia desde ``since``.
+
+    Los checkpoints de posiciones y los tramos en caché desde esa fecha
+    dejan de valer y se borran.
+    """
+    invalidate_checkpoints(portfolio_ids, since)
+    if settings.VALUATION_SEGMENT_CACHE_ROWS:
+        segment_cache().invalidate(portfolio_ids, since)
+    # Las lecturas no crean el estado: sin él, el cambio no llegaría al ETag
+    PortfolioValuationState.objects.bulk_create(
+        [PortfolioValuationState(portfolio_id=pk) for pk in portfolio_ids], ignore_conflicts=True)
+    PortfolioValuationState.objects.filter(portfolio_id__in=portfolio_ids).update(
+        dirty_since=Case(
+            When(Q(dirty_since__isnull=True) | Q(dirty_since__gt=since), then=Value(since, output_field=DateField())),
+            default=F("dirty_since"),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def mark_assets_dirty(asset_ids, since):
+    """Marca como sucios los portafolios que tienen alguno de los activos."""
+    held = Weight.objects.filter(asset_id__in=asset_ids).values("portfolio_id")
+    traded = PortfolioEvent.objects.filter(asset_id__in=asset_ids).values("portfolio_id")
+    portfolio_ids = list(Portfolio.objects.filter(Q(pk__in=held) | Q(pk__in=traded)).values_list("pk", flat=True))
+    mark_dirty(portfolio_ids, since)
+
+
+def ensure_materialized(portfolio):
+    """Deja al día V_t, x_{i,t} y w_{i,t} materializados del portafolio.
+
+    Solo se recalcula el sufijo de fechas afectado: desde la fecha marcada
+    como sucia o desde el día siguiente al último materializado si llegaron
+    precios nuevos.
+    """
+    with transaction.atomic():
+        state, created = PortfolioValuationState.objects.select_for_update().get_or_create(
+            portfolio=portfolio)
+        latest = _latest_price_date(portfolio)
+
+        if created or state.materialized_through is None:
+            since = None
+        elif state.dirty_since is not None:
+            since = state.dirty_since
+        elif latest is not None and latest > state.materialized_through:
+            since = state.materialized_through + timedelta(days=1)
+        else:
+            return state
+
+        _materialize(portfolio, since, latest)
+        state.dirty_since = None
+        state.materialized_through = latest
+        # updated_at marca cambios en los datos (ver mark_dirty), no el recálculo
+        state.save(update_fields=["dirty_since", "materialized_through"])
+    return state
+
+
+def materialize_pending(limit=100):
+    """Materializa los portafolios sucios o aún sin materializar.
+
+    Lo corre el worker entre cargas, así las lecturas nunca escriben ni
+    bloquean. Los portafolios que no se pueden valorizar quedan sucios y se
+    reintentan en la siguiente pasada. Devuelve cuántos se materializaron.
+    """
+    pending = (
+        Portfolio.objects.filter(weights__isnull=False)
+        .filter(Q(valuation_state__isnull=True) | Q(valuation_state__dirty_since__isnull=False))
+        .distinct().order_by("pk")[:limit]
+    )
+    materialized = 0
+    for portfolio in pending:
+        try:
+            ensure_materialized(portfolio)
+        except ValueError as e:
+            logger.warning("No se pudo materializar el portafolio %s: %s", portfolio.pk, e)
+            continue
+        materialized += 1
+    return materialized
+
+
+def _latest_price_date(portfolio):
+    return Price.objects.filter(held_assets(portfolio=portfolio)).aggregate(last=Max("date"))["last"]
+
+
+def _materialize(portfolio, since, until):
+    initial_date = initial_weight_date(portfolio)
+    if initial_date is None:
+        raise ValueError("No hay pesos asociados al portafolio")
+    if since is None or since < initial_date:
+        since = initial_date
+
+    PortfolioValue.objects.filter(portfolio=portfolio, date__gte=since).delete()
+    MaterializedWeight.objects.filter(portfolio=portfolio, date__gte=since).delete()
+
+    if until is None or until < since:
+        return
+
+    series, assets = portfolio_valuation(portfolio, since, until)
+    dates = series.python_dates()
+
+    PortfolioValue.objects.bulk_create(
+        [PortfolioValue(portfolio=portfolio, date=d, value=v)
+         for d, v in zip(dates, series.values.tolist())],
+        batch_size=BATCH_SIZE,
+    )
+
+    MaterializedWeight.objects.bulk_create(
+        [MaterializedWeight(portfolio=portfolio, asset=asset, date=d, amount=amount, weight=weight)
+         for d, amount_row, weight_row in zip(dates, series.amounts.tolist(), series.weights.tolist())
+         for asset, amount, weight in zip(assets, amount_row, weight_row)],
+        batch_size=BATCH_SIZE,
+    )
+
+    # Posiciones al cierre de cada período, para valorizar desde ellas
+    write_checkpoints(portfolio, series, initial_date)
+
+
+def materialized_series(portfolio, start, end):
+    """Lee V_t y w_{i,t} del rango como filas por fecha, sin escribir ni
+    bloquear.
+
+    Las fechas ya materializadas y limpias se arman desde tramos mensuales
+    en caché (ver :func:`cached_segments`), así rangos distintos que se
+    solapan comparten lecturas; el resto (fechas sucias o aún sin
+    materializar) se valoriza en memoria hasta que el worker lo materialice
+    (ver :func:`materialize_pending`). Las filas devueltas no deben
+    modificarse.
+    """
+    clean_end, pending_start = _split_range(_clean_through(portfolio), start, end)
+    rows = []
+    if clean_end is not None:
+        rows = cached_segments(portfolio.pk, start, clean_end, _segment_versions(portfolio, start, clean_end),
+                               lambda since, until: _read_rows(portfolio, since, until))
+    if pending_start is not None:
+        rows = [*rows, *_pending_rows(portfolio, pending_start, end)]
+    return rows
+
+
+def iter_materialized_series(portfolio, start, end, chunk_days=STREAM_CHUNK_DAYS):
+    """Como :func:`materialized_series`, pero leyendo el rango por tramos.
+
+    Cada tramo de ``chunk_days`` fechas materializadas se lee con dos
+    consultas y se entrega fila a fila. Las fechas pendientes se valorizan
+    al llamar a la función, antes de entregar la primera fila, para que sus
+    errores no corten el stream.
+    """
+    clean_end, pending_start = _split_range(_clean_through(portfolio), start, end)
+    pending = _pending_rows(portfolio, pending_start, end) if pending_start is not None else []
+    return _iter_chunks(portfolio, start, clean_end, chunk_days, pending)
+
+
+async def aiter_materialized_series(portfolio, start, end, chunk_days=STREAM_CHUNK_DAYS):
+    """Versión async de :func:`iter_materialized_series`: devuelve un
+    iterador async."""
+    state = await _state_dates(portfolio).afirst()
+    clean_end, pending_start = _split_range(_clean_date(state), start, end)
+    pending = []
+    if pending_start is not None:
+        pending = await sync_to_async(_pending_rows)(portfolio, pending_start, end)
+    return _aiter_chunks(portfolio, start, clean_end, chunk_days, pending)
+
+
+def _state_dates(portfolio):
+    return PortfolioValuationState.objects.filter(portfolio=portfolio).values_list(
+        "materialized_through", "dirty_since")
+
+
+def _clean_through(portfolio):
+    return _clean_date(_state_dates(portfolio).first())
+
+
+def _clean_date(state):
+    """Última fecha materializada que sigue valiendo, o None."""
+    if state is None or state[0] is None:
+        return None
+    materialized_through, dirty_since = state
+    if dirty_since is not None:
+        return min(materialized_through, dirty_since - timedelta(days=1))
+    return materialized_through
+
+
+def _split_range(clean_through, start, end):
+    """Divide [start, end] en el tramo materializado y limpio y el pendiente.
+
+    Devuelve ``(fin del tramo limpio, inicio del pendiente)``; cada uno es
+    None si su tramo queda vacío.
+    """
+    if clean_through is None or clean_through < start:
+        return None, start
+    if clean_through >= end:
+        return end, None
+    return clean_through, clean_through + timedelta(days=1)
+
+
+def _pending_rows(portfolio, start, end):
+    """Filas de las fechas aún sin materializar, valorizadas en memoria."""
+    series, assets = portfolio_valuation(portfolio, start, end)
+    names = [asset.name for asset in assets]
+    return [
+        {"date": d, "portfolio_value": v, "weights": dict(zip(names, w))}
+        for d, v, w in zip(series.python_dates(), series.values.tolist(), series.weights.tolist())
+    ]
+
+
+def _iter_chunks(portfolio, start, end, chunk_days, pending):
+    for chunk_start, chunk_end in _chunks(start, end, chunk_days):
+        yield from _read_rows(portfolio, chunk_start, chunk_end)
+    yield from pending
+
+
+async def _aiter_chunks(portfolio, start, end, chunk_days, pending):
+    for chunk_start, chunk_end in _chunks(start, end, chunk_days):
+        values, weights = _row_querysets(portfolio, chunk_start, chunk_end)
+        values, weights = await _alist(values), await _alist(weights)
+        for row in _rows(values, weights):
+            yield row
+    for row in pending:
+        yield row
+
+
+def _chunks(start, end, chunk_days):
+    chunk_start = start
+    while end is not None and chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end + timedelta(days=1)
+
+
+async def _alist(queryset):
+    return [row async for row in queryset]
+
+
+def _segment_versions(portfolio, start, end):
+    """Versión de cada mes materializado del rango, en una consulta.
+
+    Rematerializar borra e inserta las filas de V_t (con ids nuevos), así que
+    el id máximo y la cantidad de filas del mes cambian cuando cambia el tramo.
+    """
+    months = (
+        PortfolioValue.objects.filter(portfolio=portfolio, date__range=(month_start(start), month_end(end)))
+        .annotate(month=TruncMonth("date")).values("month")
+        .annotate(last_id=Max("id"), rows=Count("id")).order_by()
+    )
+    return {m["month"]: (m["last_id"], m["rows"]) for m in months}
+
+
+def _read_rows(portfolio, start, end):
+    values, weights = _row_querysets(portfolio, start, end)
+    return _rows(values, weights)
+
+
+def _row_querysets(portfolio, start, end):
+    values = PortfolioValue.objects.filter(
+        portfolio=portfolio, date__range=(start, end)).order_by("date").values_list("date", "value")
+    weights = MaterializedWeight.objects.filter(
+        portfolio=portfolio, date__range=(start, end)).order_by("date", "asset_id").values_list(
+        "date", "asset__name", "weight")
+    return values, weights
+
+
+def _rows(values, weights):
+    rows = {d: {"date": d, "portfolio_value": v, "weights": {}} for d, v in values}
+    for d, name, weight in weights:
+        row = rows.get(d)
+        if row is not None:
+            row["weights"][name] = weight
+    return list(rows.values())
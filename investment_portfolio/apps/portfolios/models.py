@@ -75,6 +75,25 @@ class Amount(models.Model):
         return f"{self.portfolio.name} - {self.asset.name} ({self.date}): {self.amount}"
 
 
+class MaterializedWeight(models.Model):
+    """Monto y peso diarios de cada activo, derivados de la valorización.
+
+    Weight y Amount guardan solo los datos de entrada (la fecha inicial);
+    estas filas las reescribe la materialización.
+    """
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name="materialized_weights")
+    asset = models.ForeignKey(Asset, on_delete=models.CASCADE)
+    date = models.DateField()
+    amount = models.FloatField()
+    weight = models.FloatField()
+
+    class Meta:
+        unique_together = ("portfolio", "date", "asset")
+
+    def __str__(self):
+        return f"{self.portfolio.name} - {self.asset.name} ({self.date}): {self.weight}"
+
+
 class PortfolioEvent(models.Model):
     class EventType(models.TextChoices):
         BUY = "buy", "Buy"
@@ -119,3 +138,13 @@ class PortfolioValue(models.Model):
 
     def __str__(self):
         return f"{self.date} - {self.portfolio.name}: ${self.value:,.2f}"
+
+
+class PortfolioValuationState(models.Model):
+    portfolio = models.OneToOneField(Portfolio, on_delete=models.CASCADE, related_name="valuation_state")
+    dirty_since = models.DateField(null=True, blank=True)
+    materialized_through = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.portfolio.name}: {self.materialized_through} (dirty since {self.dirty_since})"
@@ -0,0 +1,237 @@
+import fcntl
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from apps.portfolios.models import Price
+
+
+def build_dense(rows, asset_ids):
+    """Arma (fechas, matriz fechas × activos) a partir de filas (date, asset_id, price)."""
+    if not rows:
+        return np.array([], dtype="datetime64[D]"), np.empty((0, len(asset_ids)))
+
+    row_dates, row_assets, row_prices = zip(*rows)
+    dates, date_idx = np.unique(np.array(row_dates, dtype="datetime64[D]"), return_inverse=True)
+
+    order = np.argsort(asset_ids)
+    sorted_ids = np.asarray(asset_ids)[order]
+    asset_idx = order[np.searchsorted(sorted_ids, row_assets)]
+
+    prices = np.full((len(dates), len(asset_ids)), np.nan)
+    prices[date_idx, asset_idx] = row_prices
+    return dates, prices
+
+
+def asof_dense(dates, prices, days, max_staleness=None):
+    """Precio vigente de cada columna de ``prices`` a cada día de ``days``.
+
+    Por activo se toma el arreglo ordenado de fechas con precio y se busca
+    (bisect) la última en o antes de cada día; si es más antigua que
+    ``max_staleness`` días se descarta. Devuelve ``(precios, fechas)`` como
+    matrices días × activos, con NaN / NaT donde no hay precio vigente.
+    """
+    days = np.asarray(days, dtype="datetime64[D]")
+    out_prices = np.full((len(days), prices.shape[1]), np.nan)
+    out_dates = np.full((len(days), prices.shape[1]), np.datetime64("NaT"), dtype="datetime64[D]")
+
+    for col in range(prices.shape[1]):
+        known = ~np.isnan(prices[:, col])
+        asset_dates = dates[known]
+        idx = np.searchsorted(asset_dates, days, side="right") - 1
+        found = idx >= 0
+        if max_staleness is not None and len(asset_dates):
+            found &= days - asset_dates[np.maximum(idx, 0)] <= np.timedelta64(max_staleness, "D")
+        out_prices[found, col] = prices[known, col][idx[found]]
+        out_dates[found, col] = asset_dates[idx[found]]
+    return out_prices, out_dates
+
+
+class SharedPricePanel:
+    """Panel completo de precios en archivos .npy mapeados en memoria.
+
+    Todos los workers de gunicorn mapean los mismos archivos, así que el
+    panel ocupa memoria una sola vez en el host. Un sello de versión en disco
+    se incrementa cada vez que cambian los precios; solo ante una versión
+    nueva se vuelve a leer la base de datos. Junto al panel se guarda la
+    máscara de fechas con precio de cada activo, con la que se arma el
+    calendario de negociación (:attr:`calendar`) de cada versión.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._version = None
+        self._dates = None
+        self._asset_ids = None
+        self._prices = None
+        self.calendar = None
+
+    @property
+    def _version_path(self):
+        return self.directory / "version"
+
+    def _paths(self, version):
+        return {name: self.directory / f"{name}-{version}.npy" for name in ("dates", "assets", "prices", "calendar")}
+
+    @contextmanager
+    def _lock(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def current_version(self):
+        try:
+            return int(self._version_path.read_text() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump_version(self):
+        with self._lock():
+            version = self.current_version() + 1
+            tmp = self._version_path.with_suffix(".tmp")
+            tmp.write_text(str(version))
+            os.replace(tmp, self._version_path)
+        return version
+
+    def _write(self, version):
+        rows = list(Price.objects.values_list("date", "asset_id", "price"))
+        asset_ids = sorted({asset_id for _, asset_id, _ in rows})
+        dates, prices = build_dense(rows, asset_ids)
+
+        arrays = {"dates": dates, "assets": np.array(asset_ids, dtype=np.int64), "prices": prices,
+                  "calendar": ~np.isnan(prices)}
+        for name, path in self._paths(version).items():
+            tmp = path.with_suffix(".tmp.npy")
+            np.save(tmp, arrays[name])
+            os.replace(tmp, path)
+
+        # Solo se borran versiones anteriores: una más nueva pudo escribirla
+        # otro proceso. Los workers que aún mapean las viejas conservan su mapeo
+        for path in self.directory.glob("*-*.npy"):
+            try:
+                path_version = int(path.stem.rsplit("-", 1)[1])
+            except ValueError:
+                continue  # Archivo temporal de otra escritura en curso
+            if path_version < version:
+                path.unlink(missing_ok=True)
+
+    def _map(self, version):
+        from apps.portfolios.trading_calendar import TradingCalendar
+
+        paths = self._paths(version)
+        self._dates = np.load(paths["dates"], mmap_mode="r")
+        self._asset_ids = np.load(paths["assets"], mmap_mode="r")
+        self._prices = np.load(paths["prices"], mmap_mode="r")
+        self.calendar = TradingCalendar(
+            self._dates, self._asset_ids.tolist(), np.load(paths["calendar"], mmap_mode="r"))
+        self._version = version
+
+    def refresh(self):
+        """Mapea la versión vigente, reconstruyéndola desde la BD si no existe."""
+        version = self.current_version()
+        if version == self._version:
+            return
+        try:
+            self._map(version)
+        except FileNotFoundError:
+            with self._lock():
+                # Si mientras tanto se publicó una versión más nueva, se usa
+                # esa en vez de reconstruir la vieja
+                version = max(version, self.current_version())
+                if not all(path.exists() for path in self._paths(version).values()):
+                    self._write(version)
+                self._map(version)
+
+    def slice(self, asset_ids, start, end):
+        """Fechas y precios de ``asset_ids`` entre start y end, más el
+        calendario de la versión leída.
+
+        Solo se copian las celdas pedidas; se omiten fechas sin ningún precio
+        para esos activos, igual que en una consulta directa.
+        """
+        self.refresh()
+        lo = np.searchsorted(self._dates, np.datetime64(start, "D"))
+        hi = np.searchsorted(self._dates, np.datetime64(end, "D"), side="right")
+
+        cols, known = self._columns(asset_ids)
+        prices = np.full((hi - lo, len(asset_ids)), np.nan)
+        prices[:, known] = self._prices[lo:hi][:, cols[known]]
+        has_price = ~np.isnan(prices).all(axis=1)
+        return np.array(self._dates[lo:hi][has_price]), prices[has_price], self.calendar
+
+    def asof(self, asset_ids, days, max_staleness=None):
+        """Precios vigentes de ``asset_ids`` a cada día (ver :func:`asof_dense`)."""
+        self.refresh()
+        days = np.asarray(days, dtype="datetime64[D]")
+        hi = np.searchsorted(self._dates, days.max(), side="right") if len(days) else 0
+        lo = 0
+        if max_staleness is not None and len(days):
+            lo = np.searchsorted(self._dates, days.min() - np.timedelta64(max_staleness, "D"))
+
+        cols, known = self._columns(asset_ids)
+        prices = np.full((len(days), len(asset_ids)), np.nan)
+        dates = np.full((len(days), len(asset_ids)), np.datetime64("NaT"), dtype="datetime64[D]")
+        prices[:, known], dates[:, known] = asof_dense(
+            np.asarray(self._dates[lo:hi]), self._prices[lo:hi][:, cols[known]], days, max_staleness)
+        return prices, dates
+
+    def _columns(self, asset_ids):
+        """Columnas del panel para ``asset_ids`` y máscara de los que están."""
+        known = np.zeros(len(asset_ids), dtype=bool)
+        cols = np.zeros(len(asset_ids), dtype=np.int64)
+        if len(self._asset_ids):
+            cols = np.minimum(np.searchsorted(self._asset_ids, asset_ids), len(self._asset_ids) - 1)
+            known = self._asset_ids[cols] == asset_ids
+        return cols, known
+
+
+_shared_panel = None
+
+
+def shared_panel():
+    global _shared_panel
+    if _shared_panel is None:
+        database = Path(str(settings.DATABASES["default"]["NAME"])).name
+        _shared_panel = SharedPricePanel(Path(settings.PRICE_PANEL_CACHE_DIR) / database)
+    return _shared_panel
+
+
+@contextmanager
+def private_panel():
+    """Usa un panel compartido propio, en un directorio temporal, durante el
+    bloque.
+
+    Sirve para leer precios de una transacción que no se confirma (p. ej. los
+    benchmarks): el panel armado con ellos no llega a los demás procesos.
+    """
+    global _shared_panel
+    previous = _shared_panel
+    with tempfile.TemporaryDirectory() as directory:
+        _shared_panel = SharedPricePanel(directory)
+        try:
+            yield _shared_panel
+        finally:
+            _shared_panel = previous
+
+
+def cached_prices(asset_ids, start, end):
+    """``(fechas, precios, calendario)`` desde el panel compartido, o None si
+    la caché está desactivada."""
+    if not settings.PRICE_PANEL_CACHE_ENABLED:
+        return None
+    return shared_panel().slice(np.asarray(asset_ids, dtype=np.int64), start, end)
+
+
+def invalidate_price_panel():
+    """Publica una nueva versión del panel al confirmar la transacción en curso."""
+    if settings.PRICE_PANEL_CACHE_ENABLED:
+        transaction.on_commit(lambda: shared_panel().bump_version())
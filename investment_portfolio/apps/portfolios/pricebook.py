@@ -0,0 +1,115 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from apps.portfolios.models import Price
+from apps.portfolios.price_cache import asof_dense, build_dense, shared_panel
+
+_DEFAULT = object()
+
+
+class PriceBook:
+    """Precios vigentes ("as-of"): el último precio de cada activo en o antes
+    de cada fecha pedida.
+
+    ``asof`` resuelve todos los pares activo × fecha de una vez: sobre un
+    panel ya cargado, sobre el panel compartido si la caché está activa o,
+    si no, con una sola consulta (``LATERAL`` en PostgreSQL). Con panel, los
+    pares que no tienen precio dentro de él (p. ej. el último precio es
+    anterior a su primera fecha) se completan con una búsqueda sin panel.
+    Los precios con más de ``max_staleness`` días de antigüedad no cuentan
+    como vigentes (por defecto ``PRICE_ASOF_MAX_STALENESS_DAYS``; None es
+    sin límite).
+    """
+
+    def __init__(self, panel=None, max_staleness=_DEFAULT):
+        self.panel = panel
+        if max_staleness is _DEFAULT:
+            max_staleness = settings.PRICE_ASOF_MAX_STALENESS_DAYS
+        self.max_staleness = max_staleness
+
+    def asof(self, asset_ids, dates):
+        """Devuelve ``(precios, fechas_de_precio)`` como matrices fechas ×
+        activos, con NaN / NaT donde no hay precio vigente."""
+        asset_ids = np.asarray(list(asset_ids), dtype=np.int64)
+        days = np.asarray(list(dates), dtype="datetime64[D]")
+        if not len(asset_ids) or not len(days):
+            return (np.full((len(days), len(asset_ids)), np.nan),
+                    np.full((len(days), len(asset_ids)), np.datetime64("NaT"), dtype="datetime64[D]"))
+
+        if self.panel is None:
+            return self._lookup(asset_ids, days)
+
+        prices, dates = self._from_panel(asset_ids, days)
+        missing = np.isnan(prices)
+        if missing.any():
+            rows, cols = missing.any(axis=1), missing.any(axis=0)
+            found_prices, found_dates = self._lookup(asset_ids[cols], days[rows])
+            block = np.ix_(rows, cols)
+            prices[block] = np.where(missing[block], found_prices, prices[block])
+            dates[block] = np.where(missing[block], found_dates, dates[block])
+        return prices, dates
+
+    def _lookup(self, asset_ids, days):
+        if settings.PRICE_PANEL_CACHE_ENABLED:
+            return shared_panel().asof(asset_ids, days, self.max_staleness)
+        if connection.vendor == "postgresql":
+            return self._lateral(asset_ids, days)
+        return self._range_scan(asset_ids, days)
+
+    def _from_panel(self, asset_ids, days):
+        columns = {asset_id: i for i, asset_id in enumerate(self.panel.asset_ids)}
+        known = np.array([a in columns for a in asset_ids.tolist()], dtype=bool)
+        cols = [columns[a] for a in asset_ids[known].tolist()]
+
+        prices = np.full((len(days), len(asset_ids)), np.nan)
+        dates = np.full((len(days), len(asset_ids)), np.datetime64("NaT"), dtype="datetime64[D]")
+        prices[:, known], dates[:, known] = asof_dense(
+            self.panel.dates, self.panel.prices[:, cols], days, self.max_staleness)
+        return prices, dates
+
+    def _lateral(self, asset_ids, days):
+        # Por cada (fecha pedida, activo), el precio más reciente en o antes de
+        # la fecha: una búsqueda en el índice (asset_id, date) por par. Las
+        # fechas repetidas se consultan una vez y se copian al final
+        days, day_rows = np.unique(days, return_inverse=True)
+        staleness = "AND p.date >= q.day - %s" if self.max_staleness is not None else ""
+        sql = f"""
+            SELECT q.day, a.asset_id, p.date, p.price
+            FROM unnest(%s::date[]) AS q(day)
+            CROSS JOIN unnest(%s::bigint[]) AS a(asset_id)
+            CROSS JOIN LATERAL (
+                SELECT p.date, p.price
+                FROM {Price._meta.db_table} AS p
+                WHERE p.asset_id = a.asset_id AND p.date <= q.day {staleness}
+                ORDER BY p.date DESC
+                LIMIT 1
+            ) AS p
+        """
+        params = [days.astype(object).tolist(), asset_ids.tolist()]
+        if self.max_staleness is not None:
+            params.append(int(self.max_staleness))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        row_of = {day: i for i, day in enumerate(days.astype(object).tolist())}
+        col_of = {asset_id: i for i, asset_id in enumerate(asset_ids.tolist())}
+        prices = np.full((len(days), len(asset_ids)), np.nan)
+        dates = np.full((len(days), len(asset_ids)), np.datetime64("NaT"), dtype="datetime64[D]")
+        for day, asset_id, price_date, price in rows:
+            prices[row_of[day], col_of[asset_id]] = price
+            dates[row_of[day], col_of[asset_id]] = price_date
+        return prices[day_rows], dates[day_rows]
+
+    def _range_scan(self, asset_ids, days):
+        # Bases sin LATERAL: una consulta por rango y bisect en memoria
+        end = days.max().astype(object)
+        queryset = Price.objects.filter(asset_id__in=asset_ids.tolist(), date__lte=end)
+        if self.max_staleness is not None:
+            queryset = queryset.filter(date__gte=days.min().astype(object) - timedelta(days=self.max_staleness))
+        rows = list(queryset.values_list("date", "asset_id", "price"))
+        panel_dates, panel_prices = build_dense(rows, asset_ids.tolist())
+        return asof_dense(panel_dates, panel_prices, days, self.max_staleness)
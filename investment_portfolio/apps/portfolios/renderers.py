@@ -0,0 +1,151 @@
+import datetime
+import json
+
+import msgpack
+import pyarrow as pa
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class NDJSONRenderer(BaseRenderer):
+    """JSON delimitado por saltos de línea: un objeto JSON por línea.
+
+    Las vistas que soportan streaming generan las líneas ellas mismas (ver
+    :func:`ndjson_lines`); este renderer cubre las respuestas normales, por
+    ejemplo los errores, cuando el cliente pidió ``format=ndjson``.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        rows = data if isinstance(data, list) else [data]
+        return "".join(ndjson_lines(rows)).encode(self.charset)
+
+
+def ndjson_lines(rows):
+    """Serializa cada fila como una línea JSON, de forma perezosa."""
+    for row in rows:
+        yield _ndjson_line(row)
+
+
+async def andjson_lines(rows):
+    """Versión async de :func:`ndjson_lines`, para iteradores async: así
+    Django transmite la respuesta bajo ASGI sin juntarla antes en memoria."""
+    async for row in rows:
+        yield _ndjson_line(row)
+
+
+def _ndjson_line(row):
+    return json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+def to_columns(rows):
+    """Pasa filas por fecha a columnas: ``dates``, ``V_t`` y un arreglo de
+    pesos por activo (``None`` donde el activo no tiene peso ese día)."""
+    assets = list(dict.fromkeys(name for row in rows for name in row["weights"]))
+    return {
+        "dates": [row["date"] for row in rows],
+        "V_t": [row["V_t"] if "V_t" in row else row["portfolio_value"] for row in rows],
+        "weights": {asset: [row["weights"].get(asset) for row in rows] for asset in assets},
+    }
+
+
+def columnar(data):
+    """Aplica :func:`to_columns` a una serie o a cada serie de un lote.
+
+    Los errores (``{"error": ...}``) se dejan tal cual.
+    """
+    if isinstance(data, list):
+        return to_columns(data)
+    if isinstance(data, dict) and "error" not in data:
+        return {str(key): columnar(value) for key, value in data.items()}
+    return data
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """Series en formato columnar como JSON."""
+
+    media_type = "application/vnd.portfolio.columnar+json"
+    format = "columnar"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(columnar(data), accepted_media_type, renderer_context)
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Series en formato columnar como MessagePack."""
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(columnar(data), default=_msgpack_default)
+
+
+class ArrowRenderer(BaseRenderer):
+    """Series como stream IPC de Apache Arrow.
+
+    Una tabla con columnas ``date``, ``V_t`` y una por activo; en un lote se
+    agrega ``portfolio_id`` y los errores por portafolio van en los metadatos
+    del esquema (clave ``errors``). Los buffers son float64 contiguos, así
+    que ``pyarrow`` los entrega a pandas sin copiar.
+    """
+
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        table = self._table(data)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    def _table(self, data):
+        if isinstance(data, list):
+            return self._series_table(data)
+        if isinstance(data, dict) and "error" in data:
+            return pa.table({"error": pa.array([str(data["error"])], pa.string())})
+
+        # Lote: una sola tabla con la unión de activos y la columna portfolio_id
+        series = {key: rows for key, rows in data.items() if isinstance(rows, list)}
+        errors = {str(key): value["error"] for key, value in data.items() if key not in series}
+        assets = list(dict.fromkeys(
+            name for rows in series.values() for row in rows for name in row["weights"]))
+        rows = [row for rows in series.values() for row in rows]
+        table = self._series_table(rows, assets)
+        portfolio_ids = [int(key) for key, rows in series.items() for _ in rows]
+        table = table.add_column(0, "portfolio_id", pa.array(portfolio_ids, pa.int64()))
+        return table.replace_schema_metadata({"errors": json.dumps(errors, ensure_ascii=False)})
+
+    def _series_table(self, rows, assets=None):
+        columns = to_columns(rows)
+        if assets is not None:
+            columns["weights"] = {
+                asset: [row["weights"].get(asset) for row in rows] for asset in assets}
+        return pa.table({
+            "date": pa.array(columns["dates"], pa.date32()),
+            "V_t": pa.array(columns["V_t"], pa.float64()),
+            **{asset: pa.array(values, pa.float64()) for asset, values in columns["weights"].items()},
+        })
+
+
+SERIES_RENDERERS = [ColumnarJSONRenderer, MessagePackRenderer, ArrowRenderer]
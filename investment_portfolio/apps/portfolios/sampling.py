@@ -0,0 +1,68 @@
+import numpy as np
+
+# Clave del período al que pertenece cada fecha
+RESAMPLE_RULES = {
+    "weekly": lambda d: d.isocalendar()[:2],
+    "monthly": lambda d: (d.year, d.month),
+    "quarterly": lambda d: (d.year, (d.month - 1) // 3),
+}
+
+
+def resample_rows(rows, rule):
+    """Deja una fila por período: la última fecha disponible (cierre).
+
+    ``rows`` son filas ``{"date", ...}`` ordenadas por fecha y ``rule`` una
+    de las claves de ``RESAMPLE_RULES``.
+    """
+    if rule not in RESAMPLE_RULES:
+        raise ValueError(f"Frecuencia inválida. Use una de: {', '.join(RESAMPLE_RULES)}")
+
+    period_of = RESAMPLE_RULES[rule]
+    sampled = []
+    for row in rows:
+        if sampled and period_of(sampled[-1]["date"]) == period_of(row["date"]):
+            sampled[-1] = row
+        else:
+            sampled.append(row)
+    return sampled
+
+
+def lttb_indices(x, y, threshold):
+    """Índices elegidos por Largest-Triangle-Three-Buckets.
+
+    Conserva el primer y el último punto y, de cada balde intermedio, el que
+    forma el triángulo de mayor área con el punto anterior elegido y el
+    promedio del balde siguiente; así se mantienen picos y caídas.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_rows(rows, max_points, value_key="portfolio_value"):
+    """Reduce las filas a ``max_points`` con LTTB sobre ``value_key``."""
+    if max_points < 3:
+        raise ValueError("La cantidad de puntos debe ser al menos 3")
+    if len(rows) <= max_points:
+        return rows
+
+    x = np.array([row["date"].toordinal() for row in rows], dtype=float)
+    y = np.array([row[value_key] for row in rows], dtype=float)
+    return [rows[i] for i in lttb_indices(x, y, max_points)]
@@ -0,0 +1,108 @@
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.conf import settings
+
+# Este módulo no importa modelos a nivel de módulo: los procesos "spawn" lo
+# importan para llegar a _init_worker antes de ejecutar django.setup().
+
+SWEEP_CHUNK_SIZE = 25  # Escenarios por tarea enviada a cada proceso
+# Escenarios × celdas del panel desde las que compensa levantar procesos:
+# cada proceso "spawn" tarda ~1 s en arrancar y un escenario cuesta del
+# orden de 50 ns por celda fechas × activos
+MIN_PARALLEL_WORK = 50_000_000
+
+
+def build_grid(dates, amounts, pairs):
+    """Producto fechas × montos × pares (venta, compra) como lista de escenarios."""
+    return [
+        {"date": day, "amount": float(amount), "sell_asset_id": sell, "buy_asset_id": buy}
+        for day, amount, (sell, buy) in itertools.product(dates, amounts, pairs)
+    ]
+
+
+def evaluate_scenario(base, scenario):
+    """Resultado de un escenario sobre ``base`` (un :class:`WhatIfBase`).
+
+    ``final_value`` es V_t al final del rango, ``weight_drift`` la mitad de
+    la suma de |w_{i,fin} - w_{i,trade}| (cuánto se alejan los pesos de los
+    que quedan tras el trade) y ``max_drawdown`` la mayor caída de V_t
+    desde un máximo previo, ambos desde la fecha del trade.
+    """
+    from apps.portfolios.models import PortfolioEvent
+
+    day, amount = scenario["date"], scenario["amount"]
+    trades = [
+        (day, scenario["sell_asset_id"], PortfolioEvent.EventType.SELL, amount),
+        (day, scenario["buy_asset_id"], PortfolioEvent.EventType.BUY, amount),
+    ]
+    outcome = {"final_value": None, "weight_drift": None, "max_drawdown": None, "error": None}
+    try:
+        series, rejected = base.run(trades, day)
+    except ValueError as e:
+        return {**outcome, "error": str(e)}
+
+    if rejected:
+        _, _, event_type, _, price = rejected[0]
+        if np.isnan(price):
+            error = "Sin precio para el activo a la fecha del trade"
+        elif event_type == PortfolioEvent.EventType.SELL:
+            error = "Cantidad insuficiente para vender"
+        else:
+            error = "No se pudo aplicar el trade"
+        return {**outcome, "error": error}
+    if not len(series):
+        return {**outcome, "error": "Sin precios desde la fecha del trade"}
+
+    values = series.values
+    peaks = np.maximum.accumulate(values)
+    return {
+        **outcome,
+        "final_value": float(values[-1]),
+        "weight_drift": float(np.abs(series.weights[-1] - series.weights[0]).sum() / 2),
+        "max_drawdown": float((1 - values / peaks).max()),
+    }
+
+
+# Base compartida por los escenarios de cada proceso (ver _init_worker)
+_worker_base = None
+
+
+def _init_worker(dates, asset_ids, prices, initial, events, initial_date, checkpoint_date, asof_prices):
+    """Arma la base una vez por proceso a partir de arreglos simples."""
+    global _worker_base
+    django.setup()
+    from apps.portfolios.valuation import PricePanel, WhatIfBase
+
+    _worker_base = WhatIfBase(PricePanel(dates, asset_ids, prices), initial, events, initial_date,
+                              checkpoint_date, asof_prices)
+
+
+def _evaluate_in_worker(scenario):
+    return evaluate_scenario(_worker_base, scenario)
+
+
+def run_sweep(base, scenarios, processes=None):
+    """Evalúa ``scenarios`` sobre ``base`` repartiéndolos en un pool de procesos.
+
+    La base (panel de precios, cantidades y eventos) se envía una sola vez a
+    cada proceso; los resultados vuelven en el orden de ``scenarios``. Los
+    barridos chicos se evalúan en el proceso actual.
+    """
+    # Precios vigentes de todas las fechas de la grilla en una sola llamada
+    base.prices_at(sorted({scenario["date"] for scenario in scenarios}))
+
+    processes = processes or settings.SCENARIO_SWEEP_PROCESSES
+    if processes <= 1 or len(scenarios) * base.panel.prices.size < MIN_PARALLEL_WORK:
+        return [evaluate_scenario(base, scenario) for scenario in scenarios]
+
+    panel = base.panel
+    initargs = (panel.dates, panel.asset_ids, panel.prices, base.initial, base.events, base.initial_date,
+                base.checkpoint_date, base.asof_prices)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                             initializer=_init_worker, initargs=initargs) as pool:
+        return list(pool.map(_evaluate_in_worker, scenarios, chunksize=SWEEP_CHUNK_SIZE))
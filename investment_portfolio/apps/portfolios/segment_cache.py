@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def month_end(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def months_between(start, end):
+    """Primeros días de los meses que cubren ``[start, end]``."""
+    months = []
+    current = month_start(start)
+    while current <= end:
+        months.append(current)
+        current = month_end(current) + timedelta(days=1)
+    return months
+
+
+class SegmentCache:
+    """Caché LRU en memoria de la serie materializada por tramos mensuales.
+
+    Cada tramo ``(portfolio_id, mes)`` guarda sus filas junto con la versión
+    con la que se leyó; si la versión en la base cambió (otro proceso
+    rematerializó el tramo), la entrada no se usa. El tamaño se limita por
+    cantidad total de filas y se descartan primero los tramos menos usados.
+    """
+
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self._segments = OrderedDict()  # (portfolio_id, mes) -> (versión, filas)
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, portfolio_id, month, version):
+        key = (portfolio_id, month)
+        with self._lock:
+            entry = self._segments.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._segments.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, portfolio_id, month, version, rows):
+        if len(rows) > self.max_rows:
+            return
+        key = (portfolio_id, month)
+        with self._lock:
+            self._discard(key)
+            self._segments[key] = (version, rows)
+            self._rows += len(rows)
+            while self._rows > self.max_rows:
+                self._discard(next(iter(self._segments)))
+
+    def invalidate(self, portfolio_ids, since):
+        """Descarta los tramos de ``portfolio_ids`` que terminan en o después de ``since``."""
+        if not self._segments:
+            return
+        portfolio_ids = set(portfolio_ids)
+        with self._lock:
+            for key in [k for k in self._segments if k[0] in portfolio_ids and month_end(k[1]) >= since]:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._segments.clear()
+            self._rows = 0
+
+    def _discard(self, key):
+        entry = self._segments.pop(key, None)
+        if entry is not None:
+            self._rows -= len(entry[1])
+
+
+_segment_cache = None
+
+
+def segment_cache():
+    global _segment_cache
+    if _segment_cache is None:
+        _segment_cache = SegmentCache(settings.VALUATION_SEGMENT_CACHE_ROWS)
+    return _segment_cache
+
+
+def cached_segments(portfolio_id, start, end, versions, read):
+    """Filas del rango armadas desde los tramos en caché.
+
+    ``versions`` es ``{mes: versión}`` de los tramos con filas en la base y
+    ``read(desde, hasta)`` lee filas materializadas; los tramos que faltan se
+    leen juntos, desde el primero hasta el último, y quedan en caché.
+    """
+    if not settings.VALUATION_SEGMENT_CACHE_ROWS:
+        return read(start, end)
+
+    cache = segment_cache()
+    months = [m for m in months_between(start, end) if m in versions]
+    segments = {m: cache.get(portfolio_id, m, versions[m]) for m in months}
+    missing = [m for m in months if segments[m] is None]
+    if missing:
+        by_month = {m: [] for m in missing}
+        for row in read(missing[0], month_end(missing[-1])):
+            month = month_start(row["date"])
+            if month in by_month:
+                by_month[month].append(row)
+        for month, rows in by_month.items():
+            cache.put(portfolio_id, month, versions[month], rows)
+            segments[month] = rows
+
+    return [row for m in months for row in segments[m] if start <= row["date"] <= end]
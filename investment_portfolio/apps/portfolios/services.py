@@ -0,0 +1,327 @@
+import hashlib
+import math
+from datetime import date, datetime, time, timezone
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+from apps.portfolios.materialization import (aiter_materialized_series,
+                                             iter_materialized_series,
+                                             mark_dirty, materialized_series)
+from apps.portfolios.models import (Asset, Portfolio, PortfolioEvent,
+                                    PortfolioValuationState, Price, Quantity)
+from apps.portfolios.price_cache import shared_panel
+from apps.portfolios.sampling import downsample_rows, resample_rows
+from apps.portfolios.scenarios import build_grid, run_sweep
+from apps.portfolios.valuation import (WhatIfBase, abatch_valuation,
+                                       awhat_if_valuation, batch_valuation,
+                                       held_assets, what_if_valuation)
+
+
+class TradeError(ValueError):
+    """Error de negocio al registrar un trade (se responde como 400)."""
+
+
+def portfolio_value(portfolio, start, end, resample=None, max_points=None):
+    """V_t y w_{i,t} diarios del portafolio entre start y end.
+
+    Devuelve una lista de filas ``{"date", "portfolio_value", "weights"}``.
+    ``resample`` deja el cierre de cada período (ver ``RESAMPLE_RULES``) y
+    ``max_points`` reduce la serie con LTTB a lo más esa cantidad de filas.
+    """
+    if start > end:
+        raise ValueError("La fecha de inicio no puede ser posterior a la fecha de fin")
+    rows = materialized_series(portfolio, start, end)
+    if resample:
+        rows = resample_rows(rows, resample)
+    if max_points:
+        rows = downsample_rows(rows, max_points)
+    return rows
+
+
+def iter_portfolio_value(portfolio, start, end):
+    """Igual que :func:`portfolio_value`, pero entrega las filas de forma
+    perezosa, leyendo el rango por tramos de fechas."""
+    if start > end:
+        raise ValueError("La fecha de inicio no puede ser posterior a la fecha de fin")
+    return iter_materialized_series(portfolio, start, end)
+
+
+async def aportfolio_value(portfolio, start, end, resample=None, max_points=None):
+    """Versión async de :func:`portfolio_value`.
+
+    La lectura por tramos en caché y la valorización de las fechas
+    pendientes corren completas en el hilo de la solicitud.
+    """
+    return await sync_to_async(portfolio_value)(portfolio, start, end, resample, max_points)
+
+
+async def aiter_portfolio_value(portfolio, start, end):
+    """Versión async de :func:`iter_portfolio_value` (iterador async)."""
+    if start > end:
+        raise ValueError("La fecha de inicio no puede ser posterior a la fecha de fin")
+    return await aiter_materialized_series(portfolio, start, end)
+
+
+def batch_portfolio_values(portfolio_ids, start, end, gaps=None):
+    """V_t y w_{i,t} diarios de varios portafolios con una sola lectura de precios.
+
+    Devuelve ``{portfolio_id: filas}`` con filas como las de
+    :func:`portfolio_value`; los portafolios que no se pueden valorizar
+    quedan como ``{"error": mensaje}``. ``gaps`` elige cómo tratar fechas
+    con precios faltantes (por defecto ``VALUATION_GAP_POLICY``).
+    """
+    if start > end:
+        raise ValueError("La fecha de inicio no puede ser posterior a la fecha de fin")
+
+    existing = set(Portfolio.objects.filter(id__in=portfolio_ids).values_list("id", flat=True))
+    results, errors = batch_valuation(sorted(existing), start, end, gaps)
+    return _batch_response(portfolio_ids, existing, results, errors)
+
+
+async def abatch_portfolio_values(portfolio_ids, start, end, gaps=None):
+    """Versión async de :func:`batch_portfolio_values`."""
+    if start > end:
+        raise ValueError("La fecha de inicio no puede ser posterior a la fecha de fin")
+
+    existing = await _aexisting(portfolio_ids)
+    results, errors = await abatch_valuation(sorted(existing), start, end, gaps)
+    return _batch_response(portfolio_ids, existing, results, errors)
+
+
+async def _aexisting(portfolio_ids):
+    return {pk async for pk in Portfolio.objects.filter(id__in=portfolio_ids).values_list("id", flat=True)}
+
+
+def _batch_response(portfolio_ids, existing, results, errors):
+    response = {}
+    for portfolio_id in portfolio_ids:
+        if portfolio_id not in existing:
+            response[portfolio_id] = {"error": "Portafolio no encontrado"}
+        elif portfolio_id in errors:
+            response[portfolio_id] = {"error": errors[portfolio_id]}
+        else:
+            series, assets = results[portfolio_id]
+            names = [asset.name for asset in assets]
+            response[portfolio_id] = [
+                {"date": d, "portfolio_value": v, "weights": dict(zip(names, w))}
+                for d, v, w in zip(series.python_dates(), series.values.tolist(),
+                                   series.weights.tolist())
+            ]
+    return response
+
+
+def portfolio_data_version(portfolio_id):
+    """Versión de los datos de los que depende la valorización del portafolio.
+
+    Combina la versión del panel de precios compartido, la última fecha con
+    precio de sus activos, el último evento y el último cambio de datos
+    registrado en el estado de materialización (ediciones de precios y
+    pesos). Devuelve ``(etag, last_modified)`` con consultas agregadas, sin
+    valorizar nada.
+    """
+    events = _events_version(portfolio_id).aggregate(last_id=Max("id"), count=Count("id"), last_date=Max("date"))
+    last_price = _prices_version(portfolio_id).aggregate(last=Max("date"))["last"]
+    panel_version = shared_panel().current_version() if settings.PRICE_PANEL_CACHE_ENABLED else None
+    changed_at = _state_version(portfolio_id).first()
+    return _data_version(portfolio_id, events, last_price, panel_version, changed_at)
+
+
+async def aportfolio_data_version(portfolio_id):
+    """Versión async de :func:`portfolio_data_version`."""
+    async def panel_version():
+        if settings.PRICE_PANEL_CACHE_ENABLED:
+            return await sync_to_async(shared_panel().current_version)()
+        return None
+
+    events = await _events_version(portfolio_id).aaggregate(
+        last_id=Max("id"), count=Count("id"), last_date=Max("date"))
+    last_price = await _prices_version(portfolio_id).aaggregate(last=Max("date"))
+    panel = await panel_version()
+    changed_at = await _state_version(portfolio_id).afirst()
+    return _data_version(portfolio_id, events, last_price["last"], panel, changed_at)
+
+
+def _events_version(portfolio_id):
+    return PortfolioEvent.objects.filter(portfolio_id=portfolio_id)
+
+
+def _prices_version(portfolio_id):
+    return Price.objects.filter(held_assets(portfolio_id=portfolio_id))
+
+
+def _state_version(portfolio_id):
+    return PortfolioValuationState.objects.filter(portfolio_id=portfolio_id).values_list("updated_at", flat=True)
+
+
+def _data_version(portfolio_id, events, last_price, panel_version, changed_at):
+    version = (f"{portfolio_id}:{panel_version}:{last_price}:{events['last_id']}:{events['count']}:"
+               f"{changed_at.isoformat() if changed_at else None}")
+    etag = hashlib.sha1(version.encode()).hexdigest()
+
+    candidates = [datetime.combine(d, time.min, tzinfo=timezone.utc)
+                  for d in (last_price, events["last_date"]) if d]
+    last_modified = max(filter(None, [*candidates, changed_at]), default=None)
+    return etag, last_modified
+
+
+def preview_trade(portfolio, transaction_date, sell_asset, buy_asset, amount, end=None):
+    """Simula en memoria vender ``amount`` USD de ``sell_asset`` y comprar lo
+    mismo de ``buy_asset``, sin registrar nada.
+
+    Devuelve filas ``{"date", "V_t", "weights"}`` desde la fecha del trade
+    hasta ``end`` (por defecto, hoy).
+    """
+    end, trades = _preview_trades(transaction_date, sell_asset, buy_asset, amount, end)
+    try:
+        series, assets, rejected = what_if_valuation(portfolio, transaction_date, end, trades)
+    except ValueError as e:
+        raise TradeError(str(e))
+    _raise_rejected(rejected, sell_asset, float(amount))
+    return _preview_rows(series, assets)
+
+
+async def apreview_trade(portfolio, transaction_date, sell_asset, buy_asset, amount, end=None):
+    """Versión async de :func:`preview_trade`."""
+    end, trades = _preview_trades(transaction_date, sell_asset, buy_asset, amount, end)
+    try:
+        series, assets, rejected = await awhat_if_valuation(portfolio, transaction_date, end, trades)
+    except ValueError as e:
+        raise TradeError(str(e))
+    _raise_rejected(rejected, sell_asset, float(amount))
+    return _preview_rows(series, assets)
+
+
+def _preview_trades(transaction_date, sell_asset, buy_asset, amount, end):
+    end = end or date.today()
+    if transaction_date > end:
+        raise TradeError("La fecha del trade no puede ser posterior a la fecha de fin")
+    amount = float(amount)
+    return end, [
+        (transaction_date, sell_asset.id, PortfolioEvent.EventType.SELL, amount),
+        (transaction_date, buy_asset.id, PortfolioEvent.EventType.BUY, amount),
+    ]
+
+
+def _preview_rows(series, assets):
+    names = [asset.name for asset in assets]
+    return [
+        {"date": d, "V_t": v, "weights": dict(zip(names, w))}
+        for d, v, w in zip(series.python_dates(), series.values.tolist(), series.weights.tolist())
+    ]
+
+
+def sweep_trades(portfolio, dates, amounts, pairs, end=None, processes=None):
+    """Evalúa la grilla fechas × montos × pares de símbolos (venta, compra).
+
+    Cada escenario es un trade simulado en memoria como en
+    :func:`preview_trade`; todos comparten un mismo panel de precios y se
+    reparten en un pool de procesos. Devuelve una fila por escenario con
+    ``final_value``, ``weight_drift``, ``max_drawdown`` y ``error``.
+    """
+    if not dates or not amounts or not pairs:
+        raise TradeError("La grilla debe tener al menos una fecha, un monto y un par de activos")
+    end = end or date.today()
+    if max(dates) > end:
+        raise TradeError("Las fechas de los trades no pueden ser posteriores a la fecha de fin")
+
+    symbols = {symbol for pair in pairs for symbol in pair}
+    asset_ids = dict(Asset.objects.filter(symbol__in=symbols).values_list("symbol", "id"))
+    missing = sorted(symbols - set(asset_ids))
+    if missing:
+        raise TradeError(f"Activos no encontrados: {', '.join(missing)}")
+
+    try:
+        base = WhatIfBase.load(portfolio, min(dates), end, asset_ids.values())
+    except ValueError as e:
+        raise TradeError(str(e))
+
+    id_pairs = [(asset_ids[sell], asset_ids[buy]) for sell, buy in pairs]
+    scenarios = build_grid(dates, amounts, id_pairs)
+    outcomes = run_sweep(base, scenarios, processes)
+
+    symbol_of = {asset_id: symbol for symbol, asset_id in asset_ids.items()}
+    return [
+        {"date": scenario["date"], "sell": symbol_of[scenario["sell_asset_id"]],
+         "buy": symbol_of[scenario["buy_asset_id"]], "amount": scenario["amount"], **outcome}
+        for scenario, outcome in zip(scenarios, outcomes)
+    ]
+
+
+def simulate_trade(portfolio, transaction_date, sell_asset, buy_asset, amount):
+    """Vende ``amount`` USD de ``sell_asset`` y compra lo mismo de ``buy_asset``.
+
+    Registra los eventos y las cantidades a la fecha de la transacción
+    dentro de una transacción, así que un error no deja escrituras a
+    medias. Montos, pesos y V_t se derivan de ahí: el portafolio queda
+    sucio desde la fecha del trade y se rematerializa desde ella.
+    """
+    amount = float(amount)
+    trades = [
+        (transaction_date, sell_asset.id, PortfolioEvent.EventType.SELL, amount),
+        (transaction_date, buy_asset.id, PortfolioEvent.EventType.BUY, amount),
+    ]
+
+    with transaction.atomic():
+        # Serializa los trades del mismo portafolio: la validación de la venta
+        # debe ver las posiciones ya confirmadas. La fila del portafolio
+        # siempre existe, así que también bloquea el primer trade
+        Portfolio.objects.select_for_update().only("pk").get(pk=portfolio.pk)
+
+        # Paso 1: Posiciones y precios a la fecha del trade
+        try:
+            base = WhatIfBase.load(portfolio, transaction_date, transaction_date,
+                                   [sell_asset.id, buy_asset.id])
+            positions, rejected = base.positions_at(trades, transaction_date)
+        except ValueError as e:
+            raise TradeError(str(e))
+        _raise_rejected(rejected, sell_asset, amount)
+
+        asset_ids = base.panel.asset_ids
+        prices = base.prices_at([transaction_date])[0]
+        if np.isnan(prices[positions > 0]).any():
+            raise TradeError("No se encontró un precio para alguno de los activos del portafolio")
+
+        # Paso 2: Registrar la transacción
+        PortfolioEvent.objects.bulk_create([
+            PortfolioEvent(portfolio=portfolio, asset_id=asset_id, type=event_type, amount=amount,
+                           price=price, date=transaction_date, currency="USD")
+            for _, asset_id, event_type, _, price in _priced(trades, prices, asset_ids)
+        ])
+
+        # Paso 3: Cantidades a la fecha del trade
+        Quantity.objects.bulk_create(
+            [Quantity(portfolio=portfolio, asset_id=asset_id, date=transaction_date, quantity=quantity)
+             for asset_id, quantity in zip(asset_ids, positions.tolist())],
+            update_conflicts=True,
+            unique_fields=["portfolio", "asset", "date"],
+            update_fields=["quantity"],
+        )
+
+        # bulk_create no dispara señales: la valorización cambia desde la fecha del trade
+        mark_dirty([portfolio.pk], transaction_date)
+
+
+async def asimulate_trade(portfolio, transaction_date, sell_asset, buy_asset, amount):
+    """Versión async de :func:`simulate_trade`. La transacción y el bloqueo
+    del portafolio necesitan una sola conexión: corre entera en el hilo de
+    la solicitud."""
+    await sync_to_async(simulate_trade)(portfolio, transaction_date, sell_asset, buy_asset, amount)
+
+
+def _priced(trades, prices, asset_ids):
+    """Trades con el precio de ejecución (último precio a la fecha)."""
+    return [(day, asset_id, event_type, amount, float(prices[asset_ids.index(asset_id)]))
+            for day, asset_id, event_type, amount in trades]
+
+
+def _raise_rejected(rejected, sell_asset, amount):
+    for _, asset_id, event_type, _, price in rejected:
+        if math.isnan(price):
+            raise TradeError("No se encontraron precios históricos para los activos")
+        if event_type == PortfolioEvent.EventType.SELL:
+            raise TradeError(f"No hay cantidad suficiente de {sell_asset.symbol} para vender {amount} USD")
+        raise TradeError("No se pudo aplicar el trade")
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.portfolios.materialization import mark_assets_dirty, mark_dirty
+from apps.portfolios.models import PortfolioEvent, Price, Weight
+from apps.portfolios.price_cache import invalidate_price_panel
+
+
+@receiver(post_save, sender=Price)
+@receiver(post_delete, sender=Price)
+def price_changed(sender, instance, **kwargs):
+    mark_assets_dirty([instance.asset_id], instance.date)
+    invalidate_price_panel()
+
+
+@receiver(post_save, sender=PortfolioEvent)
+@receiver(post_delete, sender=PortfolioEvent)
+def event_changed(sender, instance, **kwargs):
+    mark_dirty([instance.portfolio_id], instance.date)
+
+
+@receiver(post_save, sender=Weight)
+@receiver(post_delete, sender=Weight)
+def weight_changed(sender, instance, **kwargs):
+    mark_dirty([instance.portfolio_id], instance.date)
@@ -0,0 +1,973 @@
+import json
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
+
+import msgpack
+import numpy as np
+import pyarrow as pa
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.portfolios.checkpoints import invalidate_checkpoints, latest_checkpoints
+from apps.portfolios.ledger import PositionLedger
+from apps.portfolios.materialization import (ensure_materialized,
+                                             iter_materialized_series,
+                                             materialize_pending)
+from apps.portfolios.models import (Amount, Asset, HoldingSnapshot,
+                                    MaterializedWeight, Portfolio,
+                                    PortfolioEvent, PortfolioValuationState,
+                                    PortfolioValue, Price, Weight)
+from apps.portfolios.price_cache import SharedPricePanel
+from apps.portfolios.pricebook import PriceBook
+from apps.portfolios.sampling import (downsample_rows, lttb_indices,
+                                      resample_rows)
+from apps.portfolios.scenarios import build_grid
+from apps.portfolios.segment_cache import SegmentCache, cached_segments
+from apps.portfolios.services import (TradeError, portfolio_value,
+                                      preview_trade, simulate_trade,
+                                      sweep_trades)
+from apps.portfolios.trading_calendar import TradingCalendar, fill_gaps
+from apps.portfolios.valuation import (INITIAL_PORTFOLIO_VALUE, PricePanel,
+                                       batch_valuation, portfolio_valuation,
+                                       value_series)
+
+START = date(2024, 1, 1)  # Lunes
+DAYS = 10
+BUY, SELL = PortfolioEvent.EventType.BUY, PortfolioEvent.EventType.SELL
+
+
+def day(n):
+    return START + timedelta(days=n)
+
+
+@override_settings(PRICE_PANEL_CACHE_ENABLED=False, VALUATION_SEGMENT_CACHE_ROWS=0)
+class PortfolioTestCase(TestCase):
+    """Un portafolio con dos activos (A y B) más un tercero sin peso inicial (C)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create(username="tester")
+        cls.portfolio = Portfolio.objects.create(user=user, name="portfolio_1", created_at=START)
+        cls.a, cls.b, cls.c = (Asset.objects.create(name=f"Asset {s}", symbol=s) for s in "ABC")
+        Price.objects.bulk_create([
+            Price(asset=asset, date=day(n), price=price(n))
+            for n in range(DAYS)
+            for asset, price in ((cls.a, lambda n: 100 + n),
+                                 (cls.b, lambda n: 50 - 0.5 * n),
+                                 (cls.c, lambda n: 20 + 0.3 * n))
+        ])
+        Weight.objects.bulk_create([
+            Weight(portfolio=cls.portfolio, asset=cls.a, weight=0.6, date=START),
+            Weight(portfolio=cls.portfolio, asset=cls.b, weight=0.4, date=START),
+        ])
+
+    def value_rows(self, start, end):
+        response = self.client.get(reverse("portfolio-value", args=[self.portfolio.pk]),
+                                   {"dateStart": start.isoformat(), "dateEnd": end.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def trade(self, sell, buy, amount, on, **extra):
+        return self.client.post(
+            reverse("portfolio-trade", args=[self.portfolio.pk]),
+            {"date": on.isoformat(), "sell_asset_symbol": sell.symbol,
+             "buy_asset_symbol": buy.symbol, "amount": amount, **extra},
+            content_type="application/json",
+        )
+
+    def add_day(self, prices):
+        """Agrega precios para el día siguiente al último, como hace el ETL."""
+        Price.objects.bulk_create([Price(asset=asset, date=day(DAYS), price=p) for asset, p in prices.items()])
+
+
+class ValuationTests(PortfolioTestCase):
+    def assert_values(self, rows, quantities):
+        """Compara las filas con V_t = Σ c_i * p_{i,t} calculado a mano."""
+        for row in rows:
+            n = (date.fromisoformat(row["date"]) - START).days
+            a, b = quantities(n)
+            a, b = a * (100 + n), b * (50 - 0.5 * n)
+            self.assertAlmostEqual(row["portfolio_value"], a + b, places=4)
+            self.assertAlmostEqual(row["weights"][self.a.name], a / (a + b))
+            self.assertAlmostEqual(row["weights"][self.b.name], b / (a + b))
+
+    def test_value_from_initial_weights(self):
+        rows = self.value_rows(START, day(DAYS - 1))
+
+        self.assertEqual([row["date"] for row in rows], [day(n).isoformat() for n in range(DAYS)])
+        self.assertAlmostEqual(rows[0]["portfolio_value"], INITIAL_PORTFOLIO_VALUE)
+        self.assert_values(rows, lambda n: (0.6 * INITIAL_PORTFOLIO_VALUE / 100, 0.4 * INITIAL_PORTFOLIO_VALUE / 50))
+
+    def test_events_change_quantities_from_their_date(self):
+        for asset, event_type, price in ((self.a, SELL, 103), (self.b, BUY, 48.5)):
+            PortfolioEvent.objects.create(portfolio=self.portfolio, asset=asset, type=event_type,
+                                          amount=1_000_000, price=price, date=day(3), currency="USD")
+        qa, qb = 0.6 * INITIAL_PORTFOLIO_VALUE / 100, 0.4 * INITIAL_PORTFOLIO_VALUE / 50
+
+        self.assert_values(self.value_rows(START, day(DAYS - 1)),
+                           lambda n: (qa, qb) if n < 3 else (qa - 1_000_000 / 103, qb + 1_000_000 / 48.5))
+
+    def test_dates_without_all_prices_are_skipped(self):
+        Price.objects.filter(asset=self.b, date=day(4)).delete()
+        dates = [row["date"] for row in self.value_rows(START, day(DAYS - 1))]
+        self.assertEqual(len(dates), DAYS - 1)
+        self.assertNotIn(day(4).isoformat(), dates)
+
+    def test_portfolio_without_weights_is_rejected(self):
+        Weight.objects.filter(portfolio=self.portfolio).delete()
+        response = self.client.get(reverse("portfolio-value", args=[self.portfolio.pk]),
+                                   {"dateStart": START.isoformat(), "dateEnd": day(3).isoformat()})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "No hay pesos asociados al portafolio"})
+
+    def test_value_series_treats_missing_prices(self):
+        dates = np.array([day(0), day(1)], dtype="datetime64[D]")
+        panel = PricePanel(dates, [1, 2], np.array([[10.0, 5.0], [12.0, np.nan]]))
+
+        complete = value_series(panel, np.array([1.0, 2.0]))
+        self.assertEqual(complete.values.tolist(), [20.0])
+        self.assertEqual(complete.weights.tolist(), [[0.5, 0.5]])
+        partial = value_series(panel, np.array([1.0, 2.0]), complete_only=False)
+        self.assertEqual(partial.values.tolist(), [20.0, 12.0])
+
+
+class PositionLedgerTests(SimpleTestCase):
+    def ledger(self, events):
+        return PositionLedger([1, 2], [10.0, 0.0], events)
+
+    def test_advance_applies_events_up_to_the_day(self):
+        ledger = self.ledger([(day(1), 1, SELL, 50.0, 10.0), (day(3), 2, BUY, 50.0, 5.0)])
+        self.assertEqual(ledger.advance_to(day(0)).tolist(), [10.0, 0.0])
+        self.assertEqual(ledger.advance_to(day(2)).tolist(), [5.0, 0.0])
+        self.assertEqual(ledger.advance_to(day(3)).tolist(), [5.0, 10.0])
+        with self.assertRaises(ValueError):
+            ledger.advance_to(day(1))
+
+    def test_events_without_price_use_the_day_price(self):
+        ledger = self.ledger([(day(1), 2, BUY, 10.0, None)])
+        ledger.advance_to(day(1), np.array([10.0, 4.0]))
+        self.assertEqual(ledger.positions.tolist(), [10.0, 2.5])
+
+    def test_rejects_oversized_unknown_and_unpriced_events(self):
+        events = [(day(1), 1, SELL, 500.0, 10.0),  # 50 unidades, hay 10
+                  (day(1), 3, BUY, 10.0, 1.0),  # Activo fuera del libro
+                  (day(1), 2, BUY, 10.0, None)]  # Sin precio ese día
+        ledger = self.ledger(events)
+        ledger.advance_to(day(1), np.array([10.0, np.nan]))
+        self.assertEqual(ledger.positions.tolist(), [10.0, 0.0])
+        self.assertEqual(ledger.rejected, events)
+
+    def test_quantity_matrix_follows_panel_dates(self):
+        dates = np.array([day(n) for n in range(4)], dtype="datetime64[D]")
+        panel = PricePanel(dates, [1, 2], np.full((4, 2), 5.0))
+        ledger = self.ledger([(day(2), 2, BUY, 10.0, None), (day(9), 1, SELL, 5.0, None)])
+        self.assertEqual(ledger.quantity_matrix(panel).tolist(),
+                         [[10.0, 0.0], [10.0, 0.0], [10.0, 2.0], [10.0, 2.0]])
+        self.assertEqual(ledger.rejected, [])
+
+
+class MaterializationTests(PortfolioTestCase):
+    def state(self):
+        return PortfolioValuationState.objects.get(portfolio=self.portfolio)
+
+    def value_ids(self):
+        return dict(PortfolioValue.objects.filter(portfolio=self.portfolio).values_list("date", "id"))
+
+    def assert_matches_valuation(self):
+        values = PortfolioValue.objects.filter(portfolio=self.portfolio).order_by("date").values_list("value", flat=True)
+        series, _ = portfolio_valuation(self.portfolio, START, self.state().materialized_through)
+        np.testing.assert_allclose(list(values), series.values)
+
+    def test_materializes_the_whole_series_once(self):
+        ensure_materialized(self.portfolio)
+        self.assertEqual(self.state().materialized_through, day(DAYS - 1))
+        self.assertEqual(MaterializedWeight.objects.filter(portfolio=self.portfolio).count(), 2 * DAYS)
+        self.assert_matches_valuation()
+
+        ids = self.value_ids()
+        ensure_materialized(self.portfolio)
+        self.assertEqual(self.value_ids(), ids)
+
+    def test_derived_rows_stay_out_of_the_inputs(self):
+        ensure_materialized(self.portfolio)
+        self.assertEqual(Weight.objects.filter(portfolio=self.portfolio).count(), 2)
+        self.assertFalse(Amount.objects.exists())
+
+    def test_price_edit_rematerializes_only_the_suffix(self):
+        ensure_materialized(self.portfolio)
+        before = self.value_ids()
+        price = Price.objects.get(asset=self.a, date=day(6))
+        price.price = 150
+        price.save()
+        self.assertEqual(self.state().dirty_since, day(6))
+
+        ensure_materialized(self.portfolio)
+        after = self.value_ids()
+        self.assertIsNone(self.state().dirty_since)
+        self.assertEqual({d for d in before if before[d] == after[d]}, {day(n) for n in range(6)})
+        self.assert_matches_valuation()
+
+    def test_new_prices_extend_the_series(self):
+        ensure_materialized(self.portfolio)
+        self.add_day({self.a: 120, self.b: 40})
+
+        ensure_materialized(self.portfolio)
+        self.assertEqual(self.state().materialized_through, day(DAYS))
+        self.assertEqual(PortfolioValue.objects.filter(portfolio=self.portfolio).count(), DAYS + 1)
+        self.assert_matches_valuation()
+
+    def test_weight_edits_rematerialize_from_the_initial_date(self):
+        ensure_materialized(self.portfolio)
+        for weight in Weight.objects.filter(portfolio=self.portfolio):
+            weight.weight = 0.5
+            weight.save()
+        self.assertEqual(self.state().dirty_since, START)
+
+        rows = self.value_rows(START, day(DAYS - 1))
+        self.assertAlmostEqual(rows[0]["weights"][self.a.name], 0.5)
+        self.assertEqual(materialize_pending(), 1)
+        self.assertIsNone(self.state().dirty_since)
+        self.assertEqual(self.value_rows(START, day(DAYS - 1)), rows)
+
+    def test_reads_take_no_locks_and_write_nothing(self):
+        ensure_materialized(self.portfolio)
+        price = Price.objects.get(asset=self.a, date=day(6))
+        price.price = 150
+        price.save()
+        ids = self.value_ids()
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.value_rows(START, day(DAYS - 1))
+        statements = " ".join(query["sql"].upper() for query in queries)
+        for keyword in ("FOR UPDATE", "INSERT", "UPDATE ", "DELETE"):
+            self.assertNotIn(keyword, statements)
+        self.assertEqual((self.state().dirty_since, self.value_ids()), (day(6), ids))
+
+        # Las fechas sucias se valorizan en memoria igual que al materializarlas
+        self.assertEqual(materialize_pending(), 1)
+        self.assertEqual(self.value_rows(START, day(DAYS - 1)), rows)
+        self.assertEqual(materialize_pending(), 0)
+
+    def test_traded_assets_mark_the_portfolio_dirty(self):
+        self.trade(self.a, self.c, 1_000_000, day(4))
+        ensure_materialized(self.portfolio)
+
+        price = Price.objects.get(asset=self.c, date=day(7))
+        price.price = 40
+        price.save()
+        self.assertEqual(self.state().dirty_since, day(7))
+
+
+class SharedPricePanelTests(PortfolioTestCase):
+    def shared_panel(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return SharedPricePanel(directory.name)
+
+    def test_slice_matches_the_database(self):
+        asset_ids = [self.a.pk, self.c.pk]
+        dates, prices, _ = self.shared_panel().slice(np.array(asset_ids), day(2), day(5))
+        direct = PricePanel.load(asset_ids, day(2), day(5))
+        np.testing.assert_array_equal(dates, direct.dates)
+        np.testing.assert_array_equal(prices, direct.prices)
+
+    def test_unknown_assets_have_no_prices(self):
+        shared = self.shared_panel()
+        dates, prices, _ = shared.slice(np.array([self.a.pk, self.c.pk + 100]), START, day(1))
+        self.assertEqual(prices[:, 0].tolist(), [100.0, 101.0])
+        self.assertTrue(np.isnan(prices[:, 1]).all())
+        dates, prices, _ = shared.slice(np.array([self.c.pk + 100]), START, day(1))
+        self.assertEqual((len(dates), prices.shape), (0, (0, 1)))
+
+    def test_new_versions_reread_prices(self):
+        shared = self.shared_panel()
+        shared.slice(np.array([self.a.pk]), START, day(1))
+        self.add_day({self.a: 120})
+        shared.bump_version()
+
+        _, prices, _ = shared.slice(np.array([self.a.pk]), day(DAYS), day(DAYS))
+        self.assertEqual(prices.tolist(), [[120.0]])
+        self.assertEqual(sorted(path.name for path in Path(shared.directory).glob("*.npy")),
+                         ["assets-1.npy", "calendar-1.npy", "dates-1.npy", "prices-1.npy"])
+
+    def test_stale_versions_never_replace_newer_ones(self):
+        shared = self.shared_panel()
+        shared.refresh()
+        shared.bump_version()
+        shared.refresh()
+        newer = set(shared._paths(1).values())
+
+        # Un proceso atrasado que lee la versión 0 no la reconstruye
+        late = SharedPricePanel(shared.directory)
+        with mock.patch.object(late, "current_version", side_effect=[0, 1]):
+            late.refresh()
+        self.assertEqual(late._version, 1)
+        self.assertEqual(set(Path(shared.directory).glob("*.npy")), newer)
+
+        # Escribir una versión vieja no borra las más nuevas
+        shared._write(0)
+        self.assertTrue(newer <= set(Path(shared.directory).glob("*.npy")))
+
+    def test_valuation_through_the_shared_panel(self):
+        expected = self.value_rows(START, day(DAYS - 1))
+        PortfolioValue.objects.all().delete()
+        PortfolioValuationState.objects.all().delete()
+        with override_settings(PRICE_PANEL_CACHE_ENABLED=True), \
+                mock.patch("apps.portfolios.price_cache._shared_panel", self.shared_panel()):
+            self.assertEqual(self.value_rows(START, day(DAYS - 1)), expected)
+
+
+class ServicesTests(PortfolioTestCase):
+    def test_portfolio_value_matches_the_endpoint(self):
+        rows = portfolio_value(self.portfolio, START, day(DAYS - 1))
+        self.assertEqual(json.loads(json.dumps(rows, default=str)), self.value_rows(START, day(DAYS - 1)))
+
+    def test_portfolio_value_rejects_reversed_ranges(self):
+        with self.assertRaisesMessage(ValueError, "La fecha de inicio no puede ser posterior"):
+            portfolio_value(self.portfolio, day(3), day(1))
+
+    def test_trade_without_prices_is_rejected(self):
+        with self.assertRaises(TradeError):
+            simulate_trade(self.portfolio, START - timedelta(days=1), self.a, self.b, 1000)
+        self.assertFalse(PortfolioEvent.objects.exists())
+
+    def test_admin_chart_renders_in_process(self):
+        admin = get_user_model().objects.create_superuser("admin", password="x")
+        self.client.force_login(admin)
+        response = self.client.get(reverse("PortfolioAdmin:weights_chart", args=[self.portfolio.pk]),
+                                   {"dateStart": START.isoformat(), "dateEnd": day(DAYS - 1).isoformat()})
+
+        self.assertEqual(response.status_code, 200)
+        chart = json.loads(response.context["chart_data"])
+        self.assertEqual(len(chart["dates"]), DAYS)
+        self.assertEqual(sorted(chart["weights"]), [self.a.name, self.b.name])
+
+
+class ConditionalGetTests(PortfolioTestCase):
+    def get(self, **headers):
+        return self.client.get(reverse("portfolio-value", args=[self.portfolio.pk]),
+                               {"dateStart": START.isoformat(), "dateEnd": day(DAYS - 1).isoformat()},
+                               headers=headers)
+
+    def test_matching_etag_returns_304(self):
+        first = self.get()
+        self.assertIn("ETag", first)
+        self.assertIn("Last-Modified", first)
+
+        etag = first["ETag"]
+        with mock.patch("apps.portfolios.views.aportfolio_value") as valuation:
+            response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        valuation.assert_not_called()
+
+    def test_new_events_change_the_etag(self):
+        etag = self.get()["ETag"]
+        PortfolioEvent.objects.create(portfolio=self.portfolio, asset=self.a, type=SELL,
+                                      amount=1000, price=103, date=day(3))
+
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_price_edit_changes_etag(self):
+        etag = self.get()["ETag"]
+        price = Price.objects.get(asset=self.a, date=day(5))
+        price.price = 200
+        price.save()
+
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        edited = next(r for r in response.json() if r["date"] == day(5).isoformat())
+        self.assertGreater(edited["weights"][self.a.name], 0.7)
+
+    def test_weight_edit_changes_etag(self):
+        etag = self.get()["ETag"]
+        for asset in (self.a, self.b):
+            weight = Weight.objects.get(portfolio=self.portfolio, asset=asset)
+            weight.weight = 0.5
+            weight.save()
+
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.json()[0]["weights"][self.a.name], 0.5)
+
+
+    def test_errors_map_to_status_codes(self):
+        self.assertEqual(self.get().status_code, 200)
+        response = self.client.get(reverse("portfolio-value", args=[self.portfolio.pk]), {"dateStart": "x"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse("portfolio-value", args=[self.portfolio.pk + 100]),
+                                   {"dateStart": START.isoformat(), "dateEnd": day(1).isoformat()})
+        self.assertEqual(response.status_code, 404)
+
+        self.assertEqual(self.trade(self.a, self.c, "muchos", day(4)).status_code, 400)
+        response = self.client.post(reverse("portfolio-trade", args=[self.portfolio.pk + 100]),
+                                    {"date": day(4).isoformat(), "sell_asset_symbol": "A",
+                                     "buy_asset_symbol": "C", "amount": 1000},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+
+        # Los errores inesperados no se disfrazan de errores del cliente
+        with mock.patch("apps.portfolios.views.aportfolio_value", side_effect=RuntimeError("falla")), \
+                self.assertRaises(RuntimeError):
+            self.get(if_none_match="otro")
+
+
+class BatchValueTests(PortfolioTestCase):
+    def post(self, body):
+        return self.client.post(reverse("portfolio-value-batch"), body, content_type="application/json")
+
+    def test_batch_matches_single_portfolio_values(self):
+        other = Portfolio.objects.create(user=self.portfolio.user, name="portfolio_2", created_at=START)
+        Weight.objects.bulk_create([
+            Weight(portfolio=other, asset=self.b, weight=0.5, date=START),
+            Weight(portfolio=other, asset=self.c, weight=0.5, date=START),
+        ])
+        body = {"portfolio_ids": [self.portfolio.pk],
+                "dateStart": START.isoformat(), "dateEnd": day(DAYS - 1).isoformat()}
+        with CaptureQueriesContext(connection) as single:
+            self.post(body)
+
+        body["portfolio_ids"] += [other.pk, 999]
+        with self.assertNumQueries(len(single)):
+            response = self.post(body)
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result[str(self.portfolio.pk)], self.value_rows(START, day(DAYS - 1)))
+        self.assertEqual(len(result[str(other.pk)]), DAYS)
+        self.assertEqual(result["999"], {"error": "Portafolio no encontrado"})
+
+    def test_invalid_bodies_are_rejected(self):
+        for body in ({}, {"portfolio_ids": [], "dateStart": "2024-01-01", "dateEnd": "2024-01-05"},
+                     {"portfolio_ids": [self.portfolio.pk], "dateStart": "2024-01-05", "dateEnd": "2024-01-01"}):
+            self.assertEqual(self.post(body).status_code, 400, body)
+
+
+class NDJSONTests(PortfolioTestCase):
+    def get_value(self, start=START, end=day(DAYS - 1), **params):
+        return self.client.get(reverse("portfolio-value", args=[self.portfolio.pk]),
+                               {"dateStart": start.isoformat(), "dateEnd": end.isoformat(), **params})
+
+    async def test_ndjson_streams_one_row_per_line(self):
+        url = reverse("portfolio-value", args=[self.portfolio.pk])
+        params = {"dateStart": START.isoformat(), "dateEnd": day(DAYS - 1).isoformat()}
+        rows = (await self.async_client.get(url, params)).json()
+
+        response = await self.async_client.get(url, {**params, "format": "ndjson"})
+        self.assertTrue(response.streaming)
+        lines = b"".join([chunk async for chunk in response.streaming_content]).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], rows)
+
+    def test_chunks_cover_the_whole_range(self):
+        chunked = list(iter_materialized_series(self.portfolio, START, day(DAYS - 1), chunk_days=3))
+        self.assertEqual(chunked, portfolio_value(self.portfolio, START, day(DAYS - 1)))
+
+    def test_accept_header_selects_ndjson(self):
+        response = self.client.get(reverse("portfolio-value", args=[self.portfolio.pk]),
+                                   {"dateStart": START.isoformat(), "dateEnd": day(3).isoformat()},
+                                   headers={"accept": "application/x-ndjson"})
+        self.assertTrue(response.streaming)
+
+    def test_ndjson_errors_are_a_single_line(self):
+        response = self.get_value(start=day(3), end=START, format="ndjson")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", json.loads(response.content))
+
+
+class RendererTests(PortfolioTestCase):
+    def get_value(self, fmt):
+        return self.client.get(reverse("portfolio-value", args=[self.portfolio.pk]),
+                               {"dateStart": START.isoformat(), "dateEnd": day(3).isoformat(), "format": fmt})
+
+    def expected_columns(self):
+        rows = self.value_rows(START, day(3))
+        return {
+            "dates": [row["date"] for row in rows],
+            "V_t": [row["portfolio_value"] for row in rows],
+            "weights": {name: [row["weights"][name] for row in rows] for name in (self.a.name, self.b.name)},
+        }
+
+    def test_columnar_json_and_msgpack(self):
+        expected = self.expected_columns()
+        self.assertEqual(self.get_value("columnar").json(), expected)
+        response = self.get_value("msgpack")
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content), expected)
+
+    def test_arrow_stream(self):
+        expected = self.expected_columns()
+        table = pa.ipc.open_stream(self.get_value("arrow").content).read_all()
+
+        self.assertEqual(table.column_names, ["date", "V_t", self.a.name, self.b.name])
+        self.assertEqual([d.isoformat() for d in table["date"].to_pylist()], expected["dates"])
+        self.assertEqual(table["V_t"].to_pylist(), expected["V_t"])
+        self.assertEqual(table[self.a.name].to_pylist(), expected["weights"][self.a.name])
+
+    def test_batch_arrow_carries_errors_in_metadata(self):
+        response = self.client.post(
+            reverse("portfolio-value-batch") + "?format=arrow",
+            {"portfolio_ids": [self.portfolio.pk, 999], "dateStart": START.isoformat(), "dateEnd": day(3).isoformat()},
+            content_type="application/json")
+        table = pa.ipc.open_stream(response.content).read_all()
+
+        self.assertEqual(table["portfolio_id"].to_pylist(), [self.portfolio.pk] * 4)
+        self.assertEqual(json.loads(table.schema.metadata[b"errors"]), {"999": "Portafolio no encontrado"})
+
+
+class SamplingTests(PortfolioTestCase):
+    def test_lttb_keeps_ends_and_extremes(self):
+        y = np.zeros(100)
+        y[37], y[71] = 10, -5
+        indices = lttb_indices(np.arange(100, dtype=float), y, 10)
+
+        self.assertEqual(len(indices), 10)
+        self.assertEqual((indices[0], indices[-1]), (0, 99))
+        self.assertIn(37, indices)
+        self.assertIn(71, indices)
+        self.assertTrue((np.diff(indices) > 0).all())
+
+    def test_short_series_are_not_downsampled(self):
+        rows = [{"date": day(n), "portfolio_value": n} for n in range(DAYS)]
+        self.assertIs(downsample_rows(rows, DAYS), rows)
+        with self.assertRaises(ValueError):
+            downsample_rows(rows, 2)
+
+    def test_resample_keeps_the_period_close(self):
+        rows = [{"date": day(n), "portfolio_value": n} for n in range(DAYS)]
+        self.assertEqual([row["date"] for row in resample_rows(rows, "weekly")], [day(6), day(DAYS - 1)])
+        with self.assertRaises(ValueError):
+            resample_rows(rows, "daily")
+
+    def test_value_endpoint_options(self):
+        url = reverse("portfolio-value", args=[self.portfolio.pk])
+        params = {"dateStart": START.isoformat(), "dateEnd": day(DAYS - 1).isoformat()}
+        rows = self.value_rows(START, day(DAYS - 1))
+
+        sampled = self.client.get(url, {**params, "points": 4}).json()
+        self.assertEqual(len(sampled), 4)
+        self.assertEqual((sampled[0], sampled[-1]), (rows[0], rows[-1]))
+        weekly = self.client.get(url, {**params, "resample": "weekly"}).json()
+        self.assertEqual(weekly, [rows[6], rows[-1]])
+        self.assertEqual(self.client.get(url, {**params, "resample": "daily"}).status_code, 400)
+
+
+
+
+class TradeDryRunTests(PortfolioTestCase):
+    def test_dry_run_writes_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.trade(self.a, self.c, 1_000_000, day(4), dry_run=True,
+                                  date_end=day(DAYS - 1).isoformat())
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([row["date"] for row in response.json()], [day(n).isoformat() for n in range(4, DAYS)])
+        self.assertTrue(all(q["sql"].lstrip().upper().startswith("SELECT") for q in queries.captured_queries))
+        self.assertFalse(PortfolioEvent.objects.exists())
+
+    def test_dry_run_matches_persisted_trade(self):
+        preview = self.trade(self.a, self.b, 1_000_000, day(4), dry_run=True, date_end=day(DAYS - 1).isoformat())
+        self.assertEqual(self.trade(self.a, self.b, 1_000_000, day(4)).status_code, 200)
+
+        rows = self.value_rows(day(4), day(DAYS - 1))
+        self.assertEqual([r["date"] for r in rows], [r["date"] for r in preview.json()])
+        for expected, row in zip(preview.json(), rows):
+            self.assertAlmostEqual(row["portfolio_value"], expected["V_t"], places=4)
+            for name, weight in expected["weights"].items():
+                self.assertAlmostEqual(row["weights"][name], weight, places=9)
+
+    def test_dry_run_rejects_oversized_sales_and_early_dates(self):
+        self.assertEqual(self.trade(self.b, self.c, 10**12, day(4), dry_run=True).status_code, 400)
+        self.assertEqual(self.trade(self.a, self.b, 1000, START - timedelta(days=1), dry_run=True).status_code, 400)
+
+
+class SweepTests(PortfolioTestCase):
+    def test_build_grid_is_the_full_product(self):
+        grid = build_grid([day(1), day(2)], [10, 20], [(1, 2), (2, 1), (1, 3)])
+        self.assertEqual(len(grid), 12)
+        self.assertEqual(grid[0], {"date": day(1), "amount": 10.0, "sell_asset_id": 1, "buy_asset_id": 2})
+        self.assertEqual(grid[-1], {"date": day(2), "amount": 20.0, "sell_asset_id": 1, "buy_asset_id": 3})
+
+    def test_sweep_matches_previews(self):
+        end = day(DAYS - 1)
+        rows = sweep_trades(self.portfolio, [day(2), day(5)], [1_000_000, 10**12], [("A", "C"), ("B", "A")], end,
+                            processes=1)
+        self.assertEqual(len(rows), 8)
+
+        assets = {asset.symbol: asset for asset in (self.a, self.b, self.c)}
+        for row in rows:
+            if row["amount"] == 10**12:
+                self.assertEqual(row["error"], "Cantidad insuficiente para vender")
+                self.assertIsNone(row["final_value"])
+                continue
+            preview = preview_trade(self.portfolio, row["date"], assets[row["sell"]], assets[row["buy"]],
+                                    row["amount"], end)
+            values = np.array([r["V_t"] for r in preview])
+            drift = sum(abs(preview[-1]["weights"][n] - preview[0]["weights"][n]) for n in preview[0]["weights"]) / 2
+            self.assertIsNone(row["error"])
+            self.assertAlmostEqual(row["final_value"], values[-1], places=4)
+            self.assertAlmostEqual(row["weight_drift"], drift, places=9)
+            self.assertAlmostEqual(row["max_drawdown"], (1 - values / np.maximum.accumulate(values)).max(), places=9)
+
+    @override_settings(SCENARIO_SWEEP_PROCESSES=1)
+    def test_sweep_endpoint(self):
+        url = reverse("portfolio-trade-sweep", args=[self.portfolio.pk])
+        body = {"dates": [day(3).isoformat()], "amounts": [1000], "pairs": [["A", "C"]],
+                "date_end": day(DAYS - 1).isoformat()}
+
+        response = self.client.post(url, body, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        [row] = response.json()
+        self.assertEqual((row["date"], row["sell"], row["buy"], row["error"]), (day(3).isoformat(), "A", "C", None))
+
+        for invalid in ({"pairs": [["A"]]}, {"pairs": [["A", "Z"]]}, {"dates": [day(DAYS).isoformat()]}):
+            self.assertEqual(self.client.post(url, {**body, **invalid}, content_type="application/json").status_code,
+                             400, invalid)
+        # La simulación no escribe nada
+        self.assertFalse(PortfolioEvent.objects.exists())
+
+
+class TradePersistenceTests(PortfolioTestCase):
+    def test_dry_run_matches_persisted_trade_buying_a_new_asset(self):
+        # Materializa antes del trade, como hace el worker en producción
+        ensure_materialized(self.portfolio)
+
+        preview = self.trade(self.a, self.c, 1_000_000, day(4), dry_run=True, date_end=day(DAYS - 1).isoformat())
+        self.assertEqual(preview.status_code, 201)
+        persisted = self.trade(self.a, self.c, 1_000_000, day(4))
+        self.assertEqual(persisted.status_code, 200)
+
+        rows = self.value_rows(day(4), day(DAYS - 1))
+        self.assertEqual([r["date"] for r in rows], [r["date"] for r in preview.json()])
+        for expected, row in zip(preview.json(), rows):
+            self.assertAlmostEqual(row["portfolio_value"], expected["V_t"], places=4)
+            for name, weight in expected["weights"].items():
+                self.assertAlmostEqual(row["weights"][name], weight, places=9)
+        self.assertGreater(rows[-1]["weights"][self.c.name], 0)
+
+    def test_persisted_trade_records_events_and_keeps_inputs(self):
+        self.trade(self.a, self.c, 1_000_000, day(4))
+
+        self.assertEqual(
+            sorted(PortfolioEvent.objects.values_list("type", "asset__symbol")),
+            [(PortfolioEvent.EventType.BUY, "C"), (PortfolioEvent.EventType.SELL, "A")])
+        # Los pesos derivados no se escriben en la tabla de entrada ni en el trade
+        self.assertEqual(Weight.objects.filter(portfolio=self.portfolio).count(), 2)
+        self.assertFalse(MaterializedWeight.objects.exists())
+        ensure_materialized(self.portfolio)
+        self.assertTrue(MaterializedWeight.objects.filter(
+            portfolio=self.portfolio, asset=self.c, date=day(4), weight__gt=0).exists())
+
+    def test_trades_on_the_initial_date_are_rejected(self):
+        for extra in ({"dry_run": True, "date_end": day(DAYS - 1).isoformat()}, {}):
+            response = self.trade(self.a, self.c, 1000, START, **extra)
+            self.assertEqual(response.status_code, 400, extra)
+            self.assertIn("posterior a la fecha inicial", response.json()["error"])
+        self.assertFalse(PortfolioEvent.objects.exists())
+
+    def test_rejected_sale_writes_nothing(self):
+        response = self.trade(self.b, self.c, 10**12, day(4))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PortfolioEvent.objects.exists())
+
+
+class PriceBookTests(PortfolioTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Un activo con un solo precio, al comienzo
+        cls.d = Asset.objects.create(name="Asset D", symbol="D")
+        Price.objects.create(asset=cls.d, date=day(1), price=7.0)
+
+    def asof(self, book, asset_ids, days):
+        prices, dates = book.asof([a.pk for a in asset_ids], days)
+        return prices.tolist(), dates.astype(object).tolist()
+
+    def test_asof_without_panel(self):
+        prices, dates = self.asof(PriceBook(max_staleness=None), [self.a, self.d],
+                                  [START - timedelta(days=1), day(3)])
+        self.assertTrue(np.isnan(prices[0]).all())
+        self.assertEqual(prices[1], [103.0, 7.0])
+        self.assertEqual(dates[1], [day(3), day(1)])
+
+    def test_asof_discards_stale_prices(self):
+        prices, _ = self.asof(PriceBook(max_staleness=2), [self.d], [day(3), day(4)])
+        self.assertEqual(prices[0], [7.0])
+        self.assertTrue(np.isnan(prices[1][0]))
+
+    @skipUnless(connection.vendor == "postgresql", "LATERAL solo en PostgreSQL")
+    def test_lateral_matches_range_scan(self):
+        book = PriceBook(max_staleness=3)
+        asset_ids = np.array([self.a.pk, self.b.pk, self.d.pk])
+        days = np.array([day(n) for n in (-1, 0, 2, 4, 9, 4, 12)], dtype="datetime64[D]")
+        lateral, range_scan = book._lateral(asset_ids, days), book._range_scan(asset_ids, days)
+        np.testing.assert_array_equal(lateral[0], range_scan[0])
+        np.testing.assert_array_equal(lateral[1], range_scan[1])
+
+    def test_lateral_query_on_postgresql(self):
+        cursor = mock.MagicMock()
+        cursor.fetchall.return_value = [(day(2), self.a.pk, day(2), 102.0), (day(4), self.a.pk, day(4), 104.0),
+                                        (day(4), self.d.pk, day(1), 7.0)]
+        with mock.patch.object(connection, "vendor", "postgresql"), \
+                mock.patch.object(connection, "cursor") as connection_cursor:
+            connection_cursor.return_value.__enter__.return_value = cursor
+            prices, dates = self.asof(PriceBook(max_staleness=3), [self.a, self.d], [day(4), day(2), day(4)])
+
+        [(sql, params)] = [c.args for c in cursor.execute.call_args_list]
+        sql = " ".join(sql.split())
+        self.assertIn("FROM unnest(%s::date[]) AS q(day) CROSS JOIN unnest(%s::bigint[]) AS a(asset_id)", sql)
+        self.assertIn("CROSS JOIN LATERAL", sql)
+        self.assertIn("WHERE p.asset_id = a.asset_id AND p.date <= q.day AND p.date >= q.day - %s "
+                      "ORDER BY p.date DESC LIMIT 1", sql)
+        # Cada fecha se consulta una vez, aunque se pida repetida
+        self.assertEqual(params, [[day(2), day(4)], [self.a.pk, self.d.pk], 3])
+        self.assertEqual(prices[0], [104.0, 7.0])
+        self.assertEqual(prices[2], [104.0, 7.0])
+        self.assertEqual(prices[1][0], 102.0)
+        self.assertTrue(np.isnan(prices[1][1]))
+        self.assertEqual(dates[0], [day(4), day(1)])
+
+    def test_panel_falls_back_for_prices_before_its_start(self):
+        panel = PricePanel.load([self.a.pk, self.d.pk], day(5), day(9))
+        prices, dates = self.asof(PriceBook(panel, max_staleness=None), [self.a, self.d], [day(6)])
+        self.assertEqual(prices, [[106.0, 7.0]])
+        self.assertEqual(dates, [[day(6), day(1)]])
+
+    def test_shared_panel_backend(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(PRICE_PANEL_CACHE_ENABLED=True), \
+                mock.patch("apps.portfolios.price_cache._shared_panel", SharedPricePanel(directory)):
+            prices, dates = self.asof(PriceBook(max_staleness=None), [self.b, self.d], [day(2)])
+        self.assertEqual(prices, [[49.0, 7.0]])
+        self.assertEqual(dates, [[day(2), day(1)]])
+
+    def test_trade_uses_price_before_checkpoint(self):
+        # La materialización deja un checkpoint en la última fecha: el panel
+        # del trade empieza ahí y D no tiene precios en él
+        ensure_materialized(self.portfolio)
+        response = self.trade(self.a, self.d, 1_000, day(DAYS - 1))
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(PortfolioEvent.objects.get(type=PortfolioEvent.EventType.BUY).price, 7.0)
+
+
+class TradingCalendarTests(PortfolioTestCase):
+    def shared_cache(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        panel = SharedPricePanel(directory.name)
+        patcher = mock.patch("apps.portfolios.price_cache._shared_panel", panel)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return panel
+
+    def test_complete_mask_aligns_to_panel_dates(self):
+        has_price = np.array([[True, True], [True, False], [True, True]])
+        dates = np.array([day(0), day(1), day(2)], dtype="datetime64[D]")
+        calendar = TradingCalendar(dates, [self.a.pk, self.b.pk], has_price)
+
+        self.assertEqual(calendar.complete_mask([self.a.pk, self.b.pk]).tolist(), [True, False, True])
+        self.assertEqual(calendar.complete_mask([self.b.pk], dates[1:]).tolist(), [False, True])
+        self.assertEqual(calendar.complete_dates([self.a.pk]).tolist(), dates.tolist())
+        self.assertFalse(calendar.complete_mask([self.a.pk, self.c.pk + 100]).any())
+        self.assertIs(calendar.complete_mask([self.b.pk, self.a.pk]), calendar.complete_mask([self.a.pk, self.b.pk]))
+
+    @override_settings(PRICE_PANEL_CACHE_ENABLED=True)
+    def test_shared_calendar_is_rebuilt_only_on_new_versions(self):
+        shared = self.shared_cache()
+        first = PricePanel.load([self.a.pk], START, day(3)).calendar
+        self.assertIs(PricePanel.load([self.b.pk], day(2), day(5)).calendar, first)
+
+        Price.objects.filter(asset=self.b, date=day(2)).delete()
+        shared.bump_version()
+        second = PricePanel.load([self.a.pk], START, day(3)).calendar
+        self.assertIsNot(second, first)
+        self.assertFalse(second.complete_mask([self.a.pk, self.b.pk], [day(2)]).any())
+
+    def test_batch_valuation_matches_with_shared_calendar(self):
+        expected, _ = batch_valuation([self.portfolio.pk], START, day(DAYS - 1))
+        with override_settings(PRICE_PANEL_CACHE_ENABLED=True):
+            self.shared_cache()
+            Price.objects.filter(asset=self.b, date=day(3)).delete()
+            cached, _ = batch_valuation([self.portfolio.pk], START, day(DAYS - 1))
+        direct, _ = batch_valuation([self.portfolio.pk], START, day(DAYS - 1))
+
+        self.assertEqual(len(expected[self.portfolio.pk][0]), DAYS)
+        for series in (cached, direct):
+            self.assertNotIn(np.datetime64(day(3)), series[self.portfolio.pk][0].dates)
+        np.testing.assert_allclose(cached[self.portfolio.pk][0].values, direct[self.portfolio.pk][0].values)
+
+    def test_fill_gaps_never_extrapolates(self):
+        dates = np.array([day(n) for n in range(4)], dtype="datetime64[D]")
+        prices = np.array([[np.nan, 1.0], [2.0, np.nan], [np.nan, 3.0], [4.0, np.nan]])
+
+        ffill = fill_gaps(dates, prices, "ffill")
+        np.testing.assert_array_equal(ffill, [[np.nan, 1.0], [2.0, 1.0], [2.0, 3.0], [4.0, 3.0]])
+        interpolated = fill_gaps(dates, prices, "interpolate")
+        np.testing.assert_array_equal(interpolated, [[np.nan, 1.0], [2.0, 2.0], [3.0, 3.0], [4.0, np.nan]])
+        self.assertIs(fill_gaps(dates, prices, "skip"), prices)
+        with self.assertRaises(ValueError):
+            fill_gaps(dates, prices, "zero")
+
+    def test_batch_endpoint_gap_policy(self):
+        Price.objects.filter(asset=self.b, date=day(3)).delete()
+        body = {"portfolio_ids": [self.portfolio.pk], "dateStart": START.isoformat(),
+                "dateEnd": day(DAYS - 1).isoformat()}
+
+        def dates(**extra):
+            response = self.client.post(reverse("portfolio-value-batch"), {**body, **extra},
+                                        content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+            return [row["date"] for row in response.json()[str(self.portfolio.pk)]]
+
+        self.assertNotIn(day(3).isoformat(), dates())
+        self.assertIn(day(3).isoformat(), dates(gaps="ffill"))
+        response = self.client.post(reverse("portfolio-value-batch"), {**body, "gaps": "zero"},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(HOLDING_CHECKPOINT_FREQUENCY="weekly")
+class CheckpointTests(PortfolioTestCase):
+    def checkpoint_dates(self):
+        return sorted(set(HoldingSnapshot.objects.filter(portfolio=self.portfolio).values_list("date", flat=True)))
+
+    def test_one_checkpoint_per_period(self):
+        ensure_materialized(self.portfolio)
+        # Cierre del domingo 7 y checkpoint provisorio de la semana en curso
+        self.assertEqual(self.checkpoint_dates(), [day(6), day(DAYS - 1)])
+
+        self.add_day({self.a: 120, self.b: 40})
+        ensure_materialized(self.portfolio)
+        self.assertEqual(self.checkpoint_dates(), [day(6), day(DAYS)])
+
+    def test_edits_drop_later_checkpoints(self):
+        ensure_materialized(self.portfolio)
+        price = Price.objects.get(asset=self.b, date=day(8))
+        price.price = 10
+        price.save()
+        self.assertEqual(self.checkpoint_dates(), [day(6)])
+
+    def test_valuation_from_checkpoint_matches_full_replay(self):
+        # Un trade antes del checkpoint y otro después
+        self.trade(self.a, self.c, 1_000_000, day(4))
+        self.trade(self.b, self.c, 2_000_000, day(8))
+        ensure_materialized(self.portfolio)
+
+        checkpoint_date, holdings = latest_checkpoints([self.portfolio.pk], day(8))[self.portfolio.pk]
+        self.assertEqual(checkpoint_date, day(6))
+        self.assertEqual(set(holdings), {self.a.pk, self.b.pk, self.c.pk})
+
+        from_checkpoint, _ = portfolio_valuation(self.portfolio, day(7), day(DAYS - 1))
+        invalidate_checkpoints([self.portfolio.pk], START)
+        self.assertEqual(self.checkpoint_dates(), [])
+        replayed, _ = portfolio_valuation(self.portfolio, day(7), day(DAYS - 1))
+        np.testing.assert_allclose(from_checkpoint.values, replayed.values)
+        np.testing.assert_allclose(from_checkpoint.weights, replayed.weights)
+
+
+class SegmentCacheTests(PortfolioTestCase):
+    def test_lru_evicts_by_rows_and_checks_versions(self):
+        cache = SegmentCache(max_rows=3)
+        cache.put(1, START, "v1", [{"date": START}] * 2)
+        cache.put(2, START, "v1", [{"date": START}] * 2)  # Desplaza al primero
+
+        self.assertIsNone(cache.get(1, START, "v1"))
+        self.assertIsNone(cache.get(2, START, "v2"))
+        self.assertEqual(len(cache.get(2, START, "v1")), 2)
+
+        cache.invalidate([2], date(2024, 2, 1))
+        self.assertIsNotNone(cache.get(2, START, "v1"))
+        cache.invalidate([2], date(2024, 1, 31))
+        self.assertIsNone(cache.get(2, START, "v1"))
+
+    @override_settings(VALUATION_SEGMENT_CACHE_ROWS=100)
+    def test_reads_only_missing_or_changed_months(self):
+        rows = [{"date": date(2024, m, d)} for m in (1, 2, 3) for d in (1, 15)]
+        versions = {date(2024, m, 1): 1 for m in (1, 2, 3)}
+        reads = []
+
+        def read(since, until):
+            reads.append((since, until))
+            return [row for row in rows if since <= row["date"] <= until]
+
+        with mock.patch("apps.portfolios.segment_cache._segment_cache", SegmentCache(100)):
+            self.assertEqual(cached_segments(1, date(2024, 1, 10), date(2024, 2, 20), versions, read), rows[1:4])
+            self.assertEqual(cached_segments(1, START, date(2024, 3, 31), versions, read), rows)
+            versions[date(2024, 2, 1)] = 2
+            self.assertEqual(cached_segments(1, START, date(2024, 3, 31), versions, read), rows)
+
+        self.assertEqual(reads, [(START, date(2024, 2, 29)),
+                                 (date(2024, 3, 1), date(2024, 3, 31)),
+                                 (date(2024, 2, 1), date(2024, 2, 29))])
+
+    @override_settings(VALUATION_SEGMENT_CACHE_ROWS=1000)
+    def test_value_endpoint_sees_edits_through_the_cache(self):
+        cache = SegmentCache(1000)
+        ensure_materialized(self.portfolio)
+        with mock.patch("apps.portfolios.segment_cache._segment_cache", cache):
+            first = self.value_rows(START, day(DAYS - 1))
+            self.assertEqual(self.value_rows(day(2), day(5)), first[2:6])
+            self.assertEqual(cache.hits, 1)
+
+            price = Price.objects.get(asset=self.a, date=day(5))
+            price.price = 200
+            price.save()
+            edited = self.value_rows(START, day(DAYS - 1))
+
+        self.assertEqual(edited[:5], first[:5])
+        self.assertGreater(edited[5]["weights"][self.a.name], first[5]["weights"][self.a.name])
+
+
+class MetricsTests(PortfolioTestCase):
+    def scrape(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_value_requests_are_measured_per_view(self):
+        self.value_rows(START, day(3))
+        body = self.scrape()
+
+        self.assertIn('http_request_duration_seconds_count{method="GET",status="200",view="portfolio-value"}', body)
+        self.assertIn('http_request_sql_queries_count{view="portfolio-value"}', body)
+        self.assertIn('http_response_size_bytes_count{view="portfolio-value"}', body)
+        # /metrics no se mide a sí misma
+        self.assertNotIn('view="metrics"', self.scrape())
+
+    def test_unresolved_paths_share_one_label(self):
+        self.client.get("/no-existe/")
+        self.assertIn('view="<unresolved>"', self.scrape())
+
+
+class AsyncViewTests(PortfolioTestCase):
+    async def test_async_value_and_batch_match_the_services(self):
+        ensure = sync_to_async(ensure_materialized)
+        await ensure(self.portfolio)
+        expected = await sync_to_async(portfolio_value)(self.portfolio, START, day(DAYS - 1))
+        params = {"dateStart": START.isoformat(), "dateEnd": day(DAYS - 1).isoformat()}
+
+        response = await self.async_client.get(reverse("portfolio-value", args=[self.portfolio.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), json.loads(json.dumps(expected, default=str)))
+
+        response = await self.async_client.post(reverse("portfolio-value-batch"),
+                                                {"portfolio_ids": [self.portfolio.pk], **params},
+                                                content_type="application/json")
+        self.assertEqual(response.json()[str(self.portfolio.pk)], json.loads(json.dumps(expected, default=str)))
+
+    async def test_async_trade_persists_through_the_sync_write_path(self):
+        response = await self.async_client.post(
+            reverse("portfolio-trade", args=[self.portfolio.pk]),
+            {"date": day(4).isoformat(), "sell_asset_symbol": "A", "buy_asset_symbol": "B", "amount": 1000},
+            content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await PortfolioEvent.objects.filter(portfolio=self.portfolio).acount(), 2)
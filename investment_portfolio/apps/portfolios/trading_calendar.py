@@ -0,0 +1,78 @@
+import numpy as np
+
+from apps.portfolios.price_cache import asof_dense
+
+# skip: solo fechas con precio de todos los activos
+# ffill: se arrastra el último precio (con el límite de antigüedad as-of)
+# interpolate: interpolación lineal en el tiempo entre precios conocidos
+GAP_POLICIES = ("skip", "ffill", "interpolate")
+
+
+def fill_gaps(dates, prices, policy, max_staleness=None):
+    """Matriz fechas × activos con los huecos tratados según ``policy``.
+
+    Nunca se extrapola: antes del primer precio de un activo (y, al
+    interpolar, después del último) el hueco queda en NaN.
+    """
+    if policy not in GAP_POLICIES:
+        raise ValueError(f"Política de huecos inválida. Use una de: {', '.join(GAP_POLICIES)}")
+    if policy == "skip" or not len(dates):
+        return prices
+    if policy == "ffill":
+        return asof_dense(dates, prices, dates, max_staleness)[0]
+
+    x = dates.astype("datetime64[D]").astype(float)
+    filled = prices.copy()
+    for col in range(prices.shape[1]):
+        known = ~np.isnan(prices[:, col])
+        if known.sum() < 2:
+            continue
+        inside = (x >= x[known][0]) & (x <= x[known][-1])
+        filled[inside, col] = np.interp(x[inside], x[known], prices[known, col])
+    return filled
+
+
+class TradingCalendar:
+    """Índice de fechas con precio por activo sobre un panel de precios.
+
+    Para cada universo de activos guarda la máscara de fechas con precios
+    completos, calculada una sola vez: las fechas válidas de un portafolio
+    salen de una intersección en memoria y los portafolios que comparten
+    universo reutilizan la misma máscara. El panel compartido arma uno por
+    versión (ver ``SharedPricePanel.calendar``), así que las máscaras se
+    reutilizan entre solicitudes hasta que llegan precios nuevos.
+    """
+
+    MAX_UNIVERSES = 1024
+
+    def __init__(self, dates, asset_ids, has_price):
+        self.dates = dates
+        self._columns = {asset_id: i for i, asset_id in enumerate(asset_ids)}
+        self._has_price = has_price
+        self._complete = {}
+
+    @classmethod
+    def from_panel(cls, panel):
+        return cls(panel.dates, panel.asset_ids, ~np.isnan(panel.prices))
+
+    def complete_mask(self, asset_ids, dates=None):
+        """Máscara de fechas con precio para todos los ``asset_ids``, sobre
+        las fechas del calendario o, si se indican, sobre ``dates`` (que
+        deben ser un subconjunto ordenado de ellas)."""
+        universe = frozenset(asset_ids)
+        mask = self._complete.get(universe)
+        if mask is None:
+            if universe <= self._columns.keys():
+                mask = np.asarray(self._has_price[:, [self._columns[a] for a in sorted(universe)]]).all(axis=1)
+            else:
+                # Un activo sin ningún precio no completa ninguna fecha
+                mask = np.zeros(len(self.dates), dtype=bool)
+            if len(self._complete) >= self.MAX_UNIVERSES:
+                self._complete.clear()
+            self._complete[universe] = mask
+        if dates is None:
+            return mask
+        return mask[np.searchsorted(self.dates, dates)]
+
+    def complete_dates(self, asset_ids):
+        return self.dates[self.complete_mask(asset_ids)]
@@ -1,7 +1,9 @@
 from django.urls import path
 from apps.portfolios.views import (
+    BatchPortfolioValueAPIView,
     PortfolioValueAPIView,
     TradeSimulationAPIView,
+    TradeSweepAPIView,
 )
 
 PREFIX = "portfolios/"
@@ -9,6 +11,8 @@ VERSION = "v1/"
 
 
 urlpatterns = [
+    path(f"{VERSION}{PREFIX}value/", BatchPortfolioValueAPIView.as_view(), name="portfolio-value-batch"),
     path(f"{VERSION}{PREFIX}<int:pk>/value/", PortfolioValueAPIView.as_view(), name="portfolio-value"),
     path(f"{VERSION}{PREFIX}<int:pk>/trade/", TradeSimulationAPIView.as_view(), name="portfolio-trade"),
+    path(f"{VERSION}{PREFIX}<int:pk>/trade/sweep/", TradeSweepAPIView.as_view(), name="portfolio-trade-sweep"),
 ]
@@ -0,0 +1,466 @@
+import math
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Min, Q
+
+from apps.portfolios.checkpoints import alatest_checkpoints, latest_checkpoints
+from apps.portfolios.ledger import PositionLedger, aload_events, load_events
+from apps.portfolios.models import (Amount, Asset, PortfolioEvent, Price,
+                                    Weight)
+from apps.portfolios.price_cache import build_dense, cached_prices
+from apps.portfolios.pricebook import PriceBook
+from apps.portfolios.trading_calendar import TradingCalendar, fill_gaps
+
+INITIAL_PORTFOLIO_VALUE = 1_000_000_000  # Valor inicial del portafolio (V0)
+
+
+class PricePanel:
+    """Precios de un conjunto de activos como matriz densa fechas × activos.
+
+    Las celdas sin precio quedan en NaN. ``calendar`` es el
+    :class:`TradingCalendar` del panel compartido del que salió, si lo hay.
+    """
+
+    def __init__(self, dates, asset_ids, prices, calendar=None):
+        self.dates = dates
+        self.asset_ids = list(asset_ids)
+        self.prices = prices
+        self.calendar = calendar
+
+    @classmethod
+    def load(cls, asset_ids, start, end):
+        """Carga los precios del rango desde el panel compartido o, si está
+        desactivado, con una sola consulta."""
+        asset_ids = list(asset_ids)
+        cached = cached_prices(asset_ids, start, end)
+        if cached is None:
+            cached = (*build_dense(list(cls._rows(asset_ids, start, end)), asset_ids), None)
+        return cls(cached[0], asset_ids, cached[1], cached[2])
+
+    @classmethod
+    async def aload(cls, asset_ids, start, end):
+        """Versión async de :meth:`load`."""
+        asset_ids = list(asset_ids)
+        # Reconstruir el panel compartido puede leer todos los precios: en el hilo de la solicitud
+        cached = await sync_to_async(cached_prices)(asset_ids, start, end)
+        if cached is None:
+            cached = (*build_dense([row async for row in cls._rows(asset_ids, start, end)], asset_ids), None)
+        return cls(cached[0], asset_ids, cached[1], cached[2])
+
+    @staticmethod
+    def _rows(asset_ids, start, end):
+        return (Price.objects.filter(asset_id__in=asset_ids, date__range=(start, end))
+                .values_list("date", "asset_id", "price"))
+
+    def row_index(self, day):
+        """Índice de la primera fecha del panel >= day."""
+        return int(np.searchsorted(self.dates, np.datetime64(day, "D")))
+
+    def select(self, columns, asset_ids):
+        """Sub-panel con las columnas indicadas (sin volver a leer precios)."""
+        return PricePanel(self.dates, asset_ids, self.prices[:, columns])
+
+    def fill_gaps(self, policy=None):
+        """Panel con los huecos de precios tratados según ``policy`` (por
+        defecto ``VALUATION_GAP_POLICY``; ver ``GAP_POLICIES``). El calendario
+        describe los precios originales: si se rellenan huecos, se descarta."""
+        policy = policy or settings.VALUATION_GAP_POLICY
+        prices = fill_gaps(self.dates, self.prices, policy, settings.PRICE_ASOF_MAX_STALENESS_DAYS)
+        return self if prices is self.prices else PricePanel(self.dates, self.asset_ids, prices)
+
+    def complete_rows(self):
+        """Máscara de fechas con precio para todos los activos."""
+        return ~np.isnan(self.prices).any(axis=1)
+
+
+class ValuationSeries:
+    """Serie de valorización: V_t, c_{i,t}, x_{i,t} y w_{i,t} por fecha."""
+
+    def __init__(self, dates, asset_ids, values, amounts, weights, priced, quantities):
+        self.dates = dates
+        self.asset_ids = asset_ids
+        self.values = values
+        self.amounts = amounts
+        self.weights = weights
+        self.priced = priced
+        self.quantities = quantities
+
+    def __len__(self):
+        return len(self.dates)
+
+    def python_dates(self):
+        return self.dates.astype(object).tolist()
+
+    def subset(self, mask):
+        return ValuationSeries(self.dates[mask], self.asset_ids, self.values[mask],
+                               self.amounts[mask], self.weights[mask], self.priced[mask],
+                               self.quantities[mask])
+
+
+def value_series(panel, quantities, complete_only=True, valid=None):
+    """Calcula x_{i,t} = c_{i,t} * p_{i,t}, V_t y w_{i,t} sobre el panel.
+
+    ``quantities`` puede ser un vector por activo (cantidades constantes) o
+    una matriz fechas × activos alineada con el panel. Con ``complete_only``
+    solo se devuelven fechas con precio para todos los activos (``valid``
+    permite pasar esa máscara ya calculada, p. ej. de un
+    :class:`TradingCalendar`); si no, los precios faltantes cuentan como
+    cero y se descartan fechas sin valor.
+    """
+    priced = ~np.isnan(panel.prices)
+    amounts = np.where(priced, panel.prices, 0.0) * quantities
+    values = amounts.sum(axis=1)
+    weights = np.divide(amounts, values[:, None],
+                        out=np.zeros_like(amounts), where=values[:, None] > 0)
+
+    series = ValuationSeries(panel.dates, panel.asset_ids, values, amounts, weights, priced,
+                             np.broadcast_to(quantities, amounts.shape))
+    if not complete_only:
+        return series.subset(values > 0)
+    return series.subset(panel.complete_rows() if valid is None else valid)
+
+
+def initial_weight_date(portfolio):
+    """Fecha de los pesos iniciales w_{i,0} del portafolio."""
+    return Weight.objects.filter(portfolio=portfolio).aggregate(first=Min("date"))["first"]
+
+
+def held_assets(**portfolios):
+    """Filtro de los activos de los portafolios: los de los pesos iniciales
+    y los comprados o vendidos en sus eventos.
+
+    ``portfolios`` filtra pesos y eventos, p. ej. ``portfolio=portfolio``.
+    """
+    return (Q(asset_id__in=Weight.objects.filter(**portfolios).values("asset_id"))
+            | Q(asset_id__in=_traded(**portfolios).values("asset_id")))
+
+
+def _traded(**portfolios):
+    return PortfolioEvent.objects.filter(
+        **portfolios, asset__isnull=False,
+        type__in=(PortfolioEvent.EventType.BUY, PortfolioEvent.EventType.SELL))
+
+
+def portfolio_valuation(portfolio, start, end, gaps=None):
+    """Valoriza un portafolio entre ``start`` y ``end``.
+
+    Parte del checkpoint de posiciones más cercano en o antes de ``start``
+    o, si no hay, de las cantidades iniciales (pesos de la fecha inicial del
+    portafolio y V0, el monto inicial cargado o el valor por defecto); luego
+    se aplican los eventos posteriores hasta ``end``. Usa un número
+    constante de consultas sin importar el largo del rango ni del historial.
+    """
+    results, errors = batch_valuation([portfolio.pk], start, end, gaps)
+    if portfolio.pk in errors:
+        raise ValueError(errors[portfolio.pk])
+    return results[portfolio.pk]
+
+
+def batch_valuation(portfolio_ids, start, end, gaps=None):
+    """Valoriza varios portafolios sobre un mismo rango de fechas.
+
+    Los precios de la unión de sus activos se cargan una sola vez y cada
+    portafolio se valoriza sobre sus columnas del panel compartido. Devuelve
+    ``(resultados, errores)``: ``{id: (serie, activos)}`` y ``{id: mensaje}``
+    para los portafolios que no se pudieron valorizar. ``gaps`` es la
+    política para fechas con precios faltantes (ver ``GAP_POLICIES``).
+    """
+    inputs, errors = _valuation_inputs(portfolio_ids, start)
+    if not inputs:
+        return {}, errors
+
+    asset_ids, first_date = _batch_range(inputs)
+    panel = PricePanel.load(asset_ids, min(start, first_date), end)
+    events = load_events(list(inputs), first_date, end)
+    assets = Asset.objects.in_bulk(asset_ids)
+    return _value_portfolios(inputs, panel, events, assets, start, gaps), errors
+
+
+async def abatch_valuation(portfolio_ids, start, end, gaps=None):
+    """Versión async de :func:`batch_valuation`. Las consultas corren una
+    tras otra en el hilo del ORM de la solicitud, igual que el cálculo, así
+    que el event loop queda libre mientras tanto."""
+    inputs, errors = await _avaluation_inputs(portfolio_ids, start)
+    if not inputs:
+        return {}, errors
+
+    asset_ids, first_date = _batch_range(inputs)
+    panel = await PricePanel.aload(asset_ids, min(start, first_date), end)
+    events = await aload_events(list(inputs), first_date, end)
+    assets = await Asset.objects.ain_bulk(asset_ids)
+    results = await sync_to_async(_value_portfolios)(inputs, panel, events, assets, start, gaps)
+    return results, errors
+
+
+def _batch_range(inputs):
+    """Unión de los activos y primera fecha a reconstruir de los portafolios."""
+    asset_ids = sorted({a for p in inputs.values() for a in p["asset_ids"]})
+    return asset_ids, min(p["base_date"] for p in inputs.values())
+
+
+def _value_portfolios(inputs, panel, events, assets, start, gaps):
+    columns = {asset_id: i for i, asset_id in enumerate(panel.asset_ids)}
+
+    # Los precios con huecos tratados valorizan; los originales ejecutan los eventos
+    valued = panel.fill_gaps(gaps)
+    calendar = valued.calendar or TradingCalendar.from_panel(valued)
+
+    results = {}
+    for portfolio_id, p in inputs.items():
+        cols = [columns[a] for a in p["asset_ids"]]
+        sub_panel = panel.select(cols, p["asset_ids"])
+        initial = _initial_quantities(sub_panel, p)
+        portfolio_events = _replayed(events.get(portfolio_id, []), p)
+        quantities = PositionLedger(p["asset_ids"], initial, portfolio_events).quantity_matrix(sub_panel)
+
+        series = value_series(valued.select(cols, p["asset_ids"]), quantities,
+                              valid=calendar.complete_mask(p["asset_ids"], valued.dates))
+        results[portfolio_id] = (series.subset(series.dates >= np.datetime64(start, "D")),
+                                 [assets[a] for a in p["asset_ids"]])
+    return results
+
+
+class WhatIfBase:
+    """Estado real de un portafolio listo para simular trades en memoria.
+
+    Guarda el panel de precios, las cantidades iniciales y los eventos
+    reales; ``run`` no vuelve a consultar la base de datos, así que la misma
+    base sirve para muchos escenarios (y se puede enviar a otros procesos).
+    """
+
+    def __init__(self, panel, initial, events, initial_date, checkpoint_date=None, asof_prices=None):
+        self.panel = panel
+        self.initial = initial  # Cantidades iniciales o del checkpoint
+        self.events = events
+        self.initial_date = initial_date
+        self.checkpoint_date = checkpoint_date
+        self.asof_prices = dict(asof_prices or {})  # {día: precios vigentes por activo}
+
+        # Fechas válidas y precios de valorización, comunes a todos los escenarios
+        self.valued = panel.fill_gaps()
+        self.valid = self.valued.complete_rows()
+
+    @classmethod
+    def load(cls, portfolio, start, end, extra_asset_ids=()):
+        """Carga la base; ``extra_asset_ids`` agrega activos que se podrían comprar."""
+        inputs, errors = _valuation_inputs([portfolio.pk], start)
+        p = cls._inputs(portfolio, inputs, errors, extra_asset_ids)
+        panel = PricePanel.load(p["asset_ids"], min(start, p["base_date"]), end)
+        events = load_events([portfolio.pk], p["base_date"], end)
+        return cls._from_inputs(portfolio, p, panel, events)
+
+    @classmethod
+    async def aload(cls, portfolio, start, end, extra_asset_ids=()):
+        """Versión async de :meth:`load`."""
+        inputs, errors = await _avaluation_inputs([portfolio.pk], start)
+        p = cls._inputs(portfolio, inputs, errors, extra_asset_ids)
+        panel = await PricePanel.aload(p["asset_ids"], min(start, p["base_date"]), end)
+        events = await aload_events([portfolio.pk], p["base_date"], end)
+        return cls._from_inputs(portfolio, p, panel, events)
+
+    @staticmethod
+    def _inputs(portfolio, inputs, errors, extra_asset_ids):
+        if portfolio.pk in errors:
+            raise ValueError(errors[portfolio.pk])
+        p = inputs[portfolio.pk]
+        p["asset_ids"] = sorted({*p["asset_ids"], *extra_asset_ids})
+        return p
+
+    @classmethod
+    def _from_inputs(cls, portfolio, p, panel, events):
+        events = _replayed(events.get(portfolio.pk, []), p)
+        checkpoint_date = p["checkpoint"][0] if p["checkpoint"] else None
+        return cls(panel, _initial_quantities(panel, p), events, p["initial_date"], checkpoint_date)
+
+    def run(self, trades, start):
+        """Valoriza desde ``start`` como si además se hubieran hecho ``trades``.
+
+        ``trades`` son tuplas ``(date, asset_id, type, amount)`` que se
+        ejecutan al último precio disponible a esa fecha, después de los
+        eventos reales del mismo día. Devuelve ``(serie, rechazados)``, con
+        los trades que no se pudieron aplicar (sin precio o sin cantidad
+        suficiente para vender).
+        """
+        ledger, hypothetical = self._ledger(trades)
+        series = value_series(self.valued, ledger.quantity_matrix(self.panel), valid=self.valid)
+        return series.subset(series.dates >= np.datetime64(start, "D")), self._rejected(ledger, hypothetical)
+
+    def positions_at(self, trades, day):
+        """Cantidades c_i al cierre de ``day`` aplicando además ``trades``.
+
+        Devuelve ``(cantidades, rechazados)``; el panel debe llegar hasta ``day``.
+        """
+        ledger, hypothetical = self._ledger(trades)
+        ledger.quantity_matrix(self.panel)
+        # Eventos posteriores a la última fecha con precios del panel
+        ledger.advance_to(day, self.prices_at([day])[0])
+        return ledger.positions, self._rejected(ledger, hypothetical)
+
+    def prices_at(self, days):
+        """Precios vigentes de todos los activos a cada día (días × activos).
+
+        Los días que faltan se resuelven en una sola llamada a
+        :class:`PriceBook` y quedan memorizados para los siguientes trades.
+        """
+        missing = sorted(set(days) - set(self.asof_prices))
+        if missing:
+            prices, _ = PriceBook(self.panel).asof(self.panel.asset_ids, missing)
+            self.asof_prices.update(zip(missing, prices))
+        return np.array([self.asof_prices[day] for day in days])
+
+    def _ledger(self, trades):
+        # Los datos de la fecha inicial son la base de la valorización
+        if any(trade[0] <= self.initial_date for trade in trades):
+            raise ValueError("La fecha del trade debe ser posterior a la fecha inicial del portafolio")
+        if self.checkpoint_date and any(trade[0] < self.checkpoint_date for trade in trades):
+            raise ValueError("La fecha del trade es anterior al checkpoint de posiciones cargado")
+
+        # Sin precio vigente queda NaN: el ledger rechaza el trade en vez de
+        # usar un precio posterior
+        prices = self.prices_at([trade[0] for trade in trades])
+        columns = {asset_id: i for i, asset_id in enumerate(self.panel.asset_ids)}
+        hypothetical = [(day, asset_id, event_type, amount, float(row[columns[asset_id]]))
+                        for (day, asset_id, event_type, amount), row in zip(trades, prices)]
+        # sorted es estable: los trades quedan después de los eventos reales del día
+        events = sorted([*self.events, *hypothetical], key=lambda event: event[0])
+        return PositionLedger(self.panel.asset_ids, self.initial, events), hypothetical
+
+    @staticmethod
+    def _rejected(ledger, hypothetical):
+        return [event for event in hypothetical if any(event is r for r in ledger.rejected)]
+
+
+def what_if_valuation(portfolio, start, end, trades):
+    """Valoriza el portafolio como si además se hubieran hecho ``trades``.
+
+    Todo ocurre en memoria: no se escribe en la base de datos (ver
+    :meth:`WhatIfBase.run`). Devuelve ``(serie, activos, rechazados)``.
+    """
+    base = WhatIfBase.load(portfolio, start, end, [trade[1] for trade in trades])
+    series, rejected = base.run(trades, start)
+    assets = Asset.objects.in_bulk(base.panel.asset_ids)
+    return series, [assets[a] for a in base.panel.asset_ids], rejected
+
+
+async def awhat_if_valuation(portfolio, start, end, trades):
+    """Versión async de :func:`what_if_valuation`."""
+    base = await WhatIfBase.aload(portfolio, start, end, [trade[1] for trade in trades])
+    series, rejected = await sync_to_async(base.run)(trades, start)
+    assets = await Asset.objects.ain_bulk(base.panel.asset_ids)
+    return series, [assets[a] for a in base.panel.asset_ids], rejected
+
+
+def holdings_at(portfolio, day):
+    """Cantidades c_i al cierre de ``day``: el checkpoint más cercano más
+    los eventos posteriores. Devuelve ``(activos, cantidades)``."""
+    base = WhatIfBase.load(portfolio, day, day)
+    if day < base.initial_date:
+        raise ValueError("La fecha es anterior a la fecha inicial del portafolio")
+    positions, _ = base.positions_at([], day)
+    assets = Asset.objects.in_bulk(base.panel.asset_ids)
+    return [assets[a] for a in base.panel.asset_ids], positions
+
+
+def _valuation_inputs(portfolio_ids, start):
+    """Activos, fecha inicial, pesos iniciales y V0 de cada portafolio, con
+    un número fijo de consultas.
+
+    Incluye el checkpoint de posiciones más cercano en o antes de
+    ``start``; ``base_date`` es la fecha desde la que hay que reconstruir
+    las posiciones (la del checkpoint o la inicial).
+    """
+    initial_dates = dict(_initial_dates(portfolio_ids))
+    traded, weights, amounts = (list(queryset) for queryset in _initial_rows(initial_dates))
+    checkpoints = latest_checkpoints(list(initial_dates), start) if initial_dates else {}
+    return _build_inputs(portfolio_ids, initial_dates, traded, weights, amounts, checkpoints)
+
+
+async def _avaluation_inputs(portfolio_ids, start):
+    """Versión async de :func:`_valuation_inputs`."""
+    initial_dates = {pid: d async for pid, d in _initial_dates(portfolio_ids)}
+    if not initial_dates:
+        return _build_inputs(portfolio_ids, {}, [], [], [], {})
+    traded, weights, amounts = [await _alist(queryset) for queryset in _initial_rows(initial_dates)]
+    checkpoints = await alatest_checkpoints(list(initial_dates), start)
+    return _build_inputs(portfolio_ids, initial_dates, traded, weights, amounts, checkpoints)
+
+
+async def _alist(queryset):
+    return [row async for row in queryset]
+
+
+def _initial_dates(portfolio_ids):
+    return (Weight.objects.filter(portfolio_id__in=portfolio_ids)
+            .values_list("portfolio_id").annotate(first=Min("date")))
+
+
+def _initial_rows(initial_dates):
+    """Consultas de activos negociados, pesos iniciales y montos iniciales."""
+    # Un activo comprado después de la fecha inicial no tiene peso inicial
+    traded = _traded(portfolio_id__in=list(initial_dates)).values_list(
+        "portfolio_id", "asset_id").distinct().order_by()
+    # Pesos y montos de la fecha inicial de cada portafolio
+    initial_rows = {"portfolio_id__in": list(initial_dates), "date__in": set(initial_dates.values())}
+    weights = Weight.objects.filter(**initial_rows).values_list("portfolio_id", "date", "asset_id", "weight")
+    amounts = Amount.objects.filter(**initial_rows).values_list("portfolio_id", "date", "amount")
+    return traded, weights, amounts
+
+
+def _build_inputs(portfolio_ids, initial_dates, traded, weights, amounts, checkpoints):
+    errors = {pid: "No hay pesos asociados al portafolio"
+              for pid in portfolio_ids if pid not in initial_dates}
+
+    inputs = {pid: {"initial_date": d, "asset_ids": set(), "weights": {}, "v0": 0}
+              for pid, d in initial_dates.items()}
+    for pid, asset_id in traded:
+        inputs[pid]["asset_ids"].add(asset_id)
+    for pid, d, asset_id, weight in weights:
+        if d == initial_dates[pid]:
+            inputs[pid]["asset_ids"].add(asset_id)
+            inputs[pid]["weights"][asset_id] = weight
+    for pid, d, amount in amounts:
+        if d == initial_dates[pid]:
+            inputs[pid]["v0"] += amount
+
+    for pid, p in list(inputs.items()):
+        if not math.isclose(sum(p["weights"].values()), 1):
+            errors[pid] = "Los pesos iniciales no suman 1"
+            del inputs[pid]
+            continue
+        # V0 es el monto inicial cargado para el portafolio, si existe
+        p["v0"] = p["v0"] or INITIAL_PORTFOLIO_VALUE
+
+    for pid, p in inputs.items():
+        p["asset_ids"] = sorted(p["asset_ids"])
+        checkpoint = checkpoints.get(pid)
+        p["checkpoint"] = checkpoint if checkpoint and checkpoint[0] > p["initial_date"] else None
+        p["base_date"] = p["checkpoint"][0] if p["checkpoint"] else p["initial_date"]
+    return inputs, errors
+
+
+def _replayed(events, inputs):
+    """Eventos a aplicar sobre las cantidades de partida: los posteriores al
+    checkpoint (ya incluye los de su fecha) o desde la fecha inicial."""
+    if inputs["checkpoint"]:
+        return [e for e in events if e[0] > inputs["checkpoint"][0]]
+    return [e for e in events if e[0] >= inputs["initial_date"]]
+
+
+def _initial_quantities(panel, inputs):
+    """Cantidades de partida: las del checkpoint o, si no hay, las iniciales
+    c_{i,0} = w_{i,0} * V0 / p_{i,0}."""
+    if inputs["checkpoint"]:
+        holdings = inputs["checkpoint"][1]
+        return np.array([holdings.get(a, 0.0) for a in panel.asset_ids])
+
+    initial = np.zeros(len(panel.asset_ids))
+    initial_date = inputs["initial_date"]
+    row = panel.row_index(initial_date)
+    if row < len(panel.dates) and panel.dates[row] == np.datetime64(initial_date, "D"):
+        initial_prices = panel.prices[row]
+        target = np.array([inputs["weights"].get(a, 0) for a in panel.asset_ids]) * inputs["v0"]
+        np.divide(target, initial_prices, out=initial,
+                  where=np.nan_to_num(initial_prices) > 0)
+    return initial
@@ -1,18 +1,42 @@
-from collections import defaultdict
-from datetime import datetime, timedelta
-from decimal import Decimal
-
-from apps.portfolios.models import (Amount, Asset, HoldingSnapshot, Portfolio,
-                                    PortfolioEvent, PortfolioValue, Price,
-                                    Quantity, Weight)
-from django.shortcuts import get_object_or_404
-from drf_spectacular.utils import OpenApiParameter, OpenApiTypes, extend_schema
+import datetime as dt
+import hashlib
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import wraps
+
+import numpy as np
+from adrf.views import APIView as AsyncAPIView
+from apps.portfolios.models import Asset, Portfolio, Weight
+from apps.portfolios.renderers import (SERIES_RENDERERS, NDJSONRenderer,
+                                       andjson_lines)
+from apps.portfolios.sampling import RESAMPLE_RULES
+from apps.portfolios.services import (TradeError, abatch_portfolio_values,
+                                      aiter_portfolio_value,
+                                      aportfolio_data_version,
+                                      aportfolio_value, apreview_trade,
+                                      asimulate_trade, sweep_trades)
+from apps.portfolios.trading_calendar import GAP_POLICIES
+from apps.portfolios.valuation import (PricePanel, holdings_at,
+                                       initial_weight_date, value_series)
+from django.http import StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from drf_spectacular.utils import (OpenApiParameter, OpenApiResponse,
+                                   OpenApiTypes, extend_schema)
 from rest_framework import serializers, status
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 
+SERIES_RENDERER_CLASSES = [*api_settings.DEFAULT_RENDERER_CLASSES, *SERIES_RENDERERS]
+
+
 class PortfolioEvolutionAPIView(APIView):
+    renderer_classes = SERIES_RENDERER_CLASSES
+
     def get(self, request, pk):
         fecha_inicio = request.query_params.get("startDate")
         fecha_fin = request.query_params.get("dateEnd")
@@ -32,52 +56,38 @@ class PortfolioEvolutionAPIView(APIView):
 
         portfolio = get_object_or_404(Portfolio, pk=pk)
 
-        # Obtener las cantidades c_{i,0} desde el snapshot inicial
-        initial_snapshots = HoldingSnapshot.objects.filter(
-            portfolio=portfolio, date=start)
-        if not initial_snapshots.exists():
-            return Response({"error": f"No snapshot data found for {start}"}, status=404)
-
-        cantidades = {s.asset_id: Decimal(s.quantity)
-                      for s in initial_snapshots}
-
-        # Obtener precios en el rango
-        prices_qs = Price.objects.filter(
-            asset_id__in=cantidades.keys(),
-            date__range=(start, end)
-        ).order_by("date")
-
-        precios_por_fecha = defaultdict(dict)
-        for p in prices_qs:
-            precios_por_fecha[p.date][p.asset_id] = Decimal(p.price)
-
-        # Calcular evolución
-        resultado = []
-        for fecha in sorted(precios_por_fecha.keys()):
-            total_valor = Decimal("0")
-            xit = {}
-
-            for asset_id, cantidad in cantidades.items():
-                precio = precios_por_fecha[fecha].get(asset_id)
-                if precio:
-                    valor = cantidad * precio
-                    xit[asset_id] = valor
-                    total_valor += valor
-
-            if total_valor > 0:
-                weights = {
-                    Asset.objects.get(pk=aid).name: round(
-                        float(x / total_valor), 6)
-                    for aid, x in xit.items()
-                }
-
-                resultado.append({
-                    "date": fecha,
-                    "V_t": round(float(total_valor), 2),
-                    "weights": weights
-                })
-
-        return Response(resultado, status=200)
+        # Obtener las cantidades c_{i,0} desde el checkpoint más cercano a la fecha de inicio
+        try:
+            assets, cantidades = holdings_at(portfolio, start)
+        except ValueError:
+            return Response({"error": f"No holdings data found for {start}"}, status=404)
+
+        asset_ids = [asset.id for asset in assets]
+        asset_names = {asset.id: asset.name for asset in assets}
+
+        # Calcular evolución sobre el panel de precios del rango
+        panel = PricePanel.load(asset_ids, start, end)
+        series = value_series(panel, cantidades, complete_only=False)
+
+        return Response(_series_rows(series, asset_names), status=200)
+
+
+def _series_rows(series, asset_names):
+    """Filas {date, V_t, weights} con pesos solo para activos con precio."""
+    names = [asset_names[a] for a in series.asset_ids]
+    resultado = []
+    for fecha, total_valor, weights, priced in zip(
+            series.python_dates(), series.values.tolist(),
+            series.weights.tolist(), series.priced.tolist()):
+        resultado.append({
+            "date": fecha,
+            "V_t": round(total_valor, 2),
+            "weights": {
+                name: round(w, 6)
+                for name, w, has_price in zip(names, weights, priced) if has_price
+            }
+        })
+    return resultado
 
 
 class PortfolioWeightsItemSerializer(serializers.Serializer):
@@ -140,6 +150,8 @@ class PortfolioWeightsItemSerializer(serializers.Serializer):
     description="📊 Returns the portfolio value (V_t) and the weights (w_{i,t}) of each asset between the given dates, assuming constant asset quantities since portfolio creation."
 )
 class PortfolioWeightsAPIView(APIView):
+    renderer_classes = SERIES_RENDERER_CLASSES
+
     def get(self, request, pk):
         fecha_inicio = request.query_params.get("fecha_inicio")
         fecha_fin = request.query_params.get("fecha_fin")
@@ -157,74 +169,71 @@ class PortfolioWeightsAPIView(APIView):
 
         portfolio = get_object_or_404(Portfolio, pk=pk)
 
-        # Obtener pesos
-        weights_qs = Weight.objects.filter(
-            portfolio=portfolio).select_related("asset")
-        if not weights_qs.exists():
+        # Obtener pesos iniciales
+        weights = dict(
+            Weight.objects.filter(portfolio=portfolio, date=initial_weight_date(portfolio))
+            .values_list("asset_id", "weight"))
+        if not weights:
             return Response({"error": "No hay pesos asociados al portafolio"}, status=404)
 
         # Mapear asset_id a nombre
-        asset_name_map = {w.asset.id: w.asset.name for w in weights_qs}
+        asset_ids = list(weights)
+        asset_name_map = dict(Asset.objects.filter(pk__in=asset_ids).values_list("id", "name"))
 
-        # Precios iniciales
-        initial_prices = {
-            p.asset_id: Decimal(p.price)
-            for p in Price.objects.filter(date=start, asset_id__in=asset_name_map.keys())
-        }
+        # Precios en rango; la primera fila corresponde a los precios iniciales
+        panel = PricePanel.load(asset_ids, start, end)
+        w = np.array([weights[a] for a in asset_ids])
+        initial_prices = np.full(len(asset_ids), np.nan)
+        if len(panel.dates) and panel.dates[0] == np.datetime64(start, "D"):
+            initial_prices = panel.prices[0]
+        has_initial = ~np.isnan(initial_prices)
 
         # Calcular V0
-        V0 = sum(
-            Decimal(w.weight) * initial_prices.get(w.asset_id, Decimal(0))
-            for w in weights_qs if w.asset_id in initial_prices
-        )
+        V0 = float(np.sum(w[has_initial] * initial_prices[has_initial]))
         if V0 == 0:
             return Response({"error": "No se pudo calcular V0 (precios faltantes para fecha inicial)"}, status=400)
 
         # Cantidades c_{i,0}
-        cantidades = {
-            w.asset_id: (Decimal(w.weight) * V0) / initial_prices[w.asset_id]
-            for w in weights_qs if w.asset_id in initial_prices
-        }
-
-        # Precios en rango
-        precios_qs = Price.objects.filter(
-            asset_id__in=cantidades.keys(),
-            date__range=(start, end)
-        ).values("asset_id", "date", "price")
-
-        # Agrupar precios por fecha
-        precios_por_fecha = {}
-        for p in precios_qs:
-            fecha = p["date"]
-            if fecha not in precios_por_fecha:
-                precios_por_fecha[fecha] = {}
-            precios_por_fecha[fecha][p["asset_id"]] = Decimal(p["price"])
+        cantidades = np.zeros(len(asset_ids))
+        cantidades[has_initial] = w[has_initial] * V0 / initial_prices[has_initial]
 
         # Construir evolución
-        resultado = []
-        for fecha in sorted(precios_por_fecha.keys()):
-            total_valor = Decimal("0")
-            xit = {}
-
-            for asset_id, cantidad in cantidades.items():
-                precio = precios_por_fecha[fecha].get(asset_id)
-                if precio:
-                    x = cantidad * precio
-                    xit[asset_id] = x
-                    total_valor += x
-
-            if total_valor > 0:
-                row = {
-                    "date": fecha,
-                    "V_t": round(float(total_valor), 2),
-                    "weights": {
-                        asset_name_map[aid]: round(float(x / total_valor), 6)
-                        for aid, x in xit.items()
-                    }
-                }
-                resultado.append(row)
-
-        return Response(resultado)
+        series = value_series(panel, cantidades, complete_only=False)
+        return Response(_series_rows(series, asset_name_map))
+
+
+async def _value_version(request, pk):
+    """ETag (versión de los datos + parámetros + formato pedido) y Last-Modified."""
+    etag, last_modified = await aportfolio_data_version(pk)
+    variant = f"{request.META.get('QUERY_STRING', '')}|{request.META.get('HTTP_ACCEPT', '')}"
+    return f"{etag}-{hashlib.sha1(variant.encode()).hexdigest()[:16]}", last_modified
+
+
+def _async_condition(version_func):
+    """Como ``django.views.decorators.http.condition``, para handlers async de
+    una APIView: ``version_func`` es async y devuelve ``(etag, last_modified)``
+    (el de Django llama a sus funciones de forma síncrona)."""
+    def decorator(handler):
+        @wraps(handler)
+        async def inner(self, request, *args, **kwargs):
+            etag, last_modified = await version_func(request, *args, **kwargs)
+            etag = quote_etag(etag) if etag is not None else None
+            if last_modified is not None:
+                if not timezone.is_aware(last_modified):
+                    last_modified = timezone.make_aware(last_modified, dt.timezone.utc)
+                last_modified = int(last_modified.timestamp())
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await handler(self, request, *args, **kwargs)
+            if request.method in ("GET", "HEAD"):
+                if last_modified and not response.has_header("Last-Modified"):
+                    response.headers["Last-Modified"] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault("ETag", etag)
+            return response
+        return inner
+    return decorator
 
 
 @extend_schema(
@@ -250,6 +259,34 @@ class PortfolioWeightsAPIView(APIView):
             location=OpenApiParameter.QUERY,
             required=True,
             description="End date of the time window (format: YYYY-MM-DD)"
+        ),
+        OpenApiParameter(
+            name="resample",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            required=False,
+            enum=list(RESAMPLE_RULES),
+            description="Keep only the last available date (end of period) of each week, month or quarter"
+        ),
+        OpenApiParameter(
+            name="points",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            required=False,
+            description="Downsample the series to at most this many dates (LTTB on V_t, min 3)"
+        ),
+        OpenApiParameter(
+            name="format",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            required=False,
+            enum=["json", "ndjson", "columnar", "msgpack", "arrow"],
+            description=(
+                "Use `ndjson` (or `Accept: application/x-ndjson`) to stream one JSON object per date. "
+                "`columnar` (JSON), `msgpack` and `arrow` (IPC stream) return one `dates` array, "
+                "a `V_t` array and one weights array per asset; they can also be requested "
+                "through the Accept header."
+            )
         )
     ],
     responses={
@@ -273,124 +310,128 @@ class PortfolioWeightsAPIView(APIView):
             },
             "description": "List of daily portfolio values (V_t) and asset weights (w_{i,t}) for the given portfolio and date range."
         },
-        400: OpenApiTypes.OBJECT
+        304: OpenApiResponse(description="Not modified: the If-None-Match ETag or If-Modified-Since date is still current"),
+        400: OpenApiTypes.OBJECT,
+        404: OpenApiTypes.OBJECT
     },
     description="📈 Returns the total portfolio value (V_t) and asset weights (w_{i,t}) for each day in the selected date range."
 )
-class PortfolioValueAPIView(APIView):
-    def get(self, request, pk):
+class PortfolioValueAPIView(AsyncAPIView):
+    renderer_classes = [*SERIES_RENDERER_CLASSES, NDJSONRenderer]
+
+    @_async_condition(_value_version)
+    async def get(self, request, pk):
+        # Paso 1: Validar parámetros de la solicitud
         try:
-            # Paso 1: Obtener parámetros de la solicitud
-            date_start = request.query_params.get('dateStart')
-            date_end = request.query_params.get('dateEnd')
-
-            # Validar fechas
-            date_start = datetime.strptime(date_start, '%Y-%m-%d').date()
-            date_end = datetime.strptime(date_end, '%Y-%m-%d').date()
-
-            # Obtener portafolio y activos
-            portfolio = Portfolio.objects.get(id=pk)
-            assets = Asset.objects.filter(
-                weight__portfolio=portfolio).distinct()
-
-            # Obtener todas las fechas en el rango
-            dates = [date_start + timedelta(days=x)
-                     for x in range((date_end - date_start).days + 1)]
-            valid_dates = []
-            for date in dates:
-                if Price.objects.filter(asset__in=assets, date=date).count() == assets.count():
-                    valid_dates.append(date)
-
-            # Paso 2: Calcular cantidades iniciales
-            initial_date = datetime(2022, 2, 15).date()
-            initial_prices = {
-                p.asset_id: p.price for p in Price.objects.filter(
-                    asset__in=assets,
-                    date=initial_date
-                )
-            }
-            weights = {
-                w.asset_id: w.weight for w in Weight.objects.filter(
-                    portfolio=portfolio,
-                    date=initial_date
-                )
-            }
+            date_start = datetime.strptime(request.query_params.get('dateStart'), '%Y-%m-%d').date()
+            date_end = datetime.strptime(request.query_params.get('dateEnd'), '%Y-%m-%d').date()
+
+            # Remuestreo y reducción opcionales de la serie
+            resample = request.query_params.get('resample')
+            max_points = request.query_params.get('points')
+            max_points = int(max_points) if max_points else None
+        except (TypeError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Validar que los pesos sumen 1
-            weights_sum = sum(weights.values())
-            if weights_sum != 1:
-                return Response({"error": "Los pesos iniciales no suman 1"}, status=status.HTTP_400_BAD_REQUEST)
-
-            V0 = 1_000_000_000  # Valor inicial del portafolio
-            quantities = {}
-            for asset in assets:
-                price = initial_prices.get(asset.id, 0)
-                weight = weights.get(asset.id, 0)
-                if price > 0:
-                    quantities[asset.id] = (weight * V0) / price
-                else:
-                    quantities[asset.id] = 0
-
-            # Paso 3: Procesar cada fecha válida
-            result = []
-            for date in valid_dates:
-                # Obtener precios para todos los activos en esta fecha
-                prices = {
-                    asset.id: Price.objects.filter(
-                        asset=asset, date=date).first().price
-                    if Price.objects.filter(asset=asset, date=date).exists()
-                    else 0
-                    for asset in assets
-                }
+        portfolio = await aget_object_or_404(Portfolio, id=pk)
 
-                # Procesar eventos de compra/venta para actualizar cantidades
-                events = PortfolioEvent.objects.filter(
-                    portfolio=portfolio,
-                    date__lte=date
-                ).order_by("date")
-
-                for event in events:
-                    if event.type == PortfolioEvent.EventType.BUY:
-                        price = prices.get(event.asset_id, 0)
-                        if price > 0:
-                            quantities[event.asset_id] += event.amount / price
-                    elif event.type == PortfolioEvent.EventType.SELL:
-                        price = prices.get(event.asset_id, 0)
-                        if price > 0 and quantities[event.asset_id] >= event.amount / price:
-                            quantities[event.asset_id] -= event.amount / price
-
-                # Calcular x_it y V_t
-                total_value = 0
-                x_it_values = {}
-                for asset in assets:
-                    quantity = quantities.get(asset.id, 0)
-                    price = prices.get(asset.id, 0)
-                    x_it = quantity * price
-                    x_it_values[asset.id] = x_it
-                    total_value += x_it
-
-                # Calcular w_it
-                weights_t = {}
-                if total_value > 0:
-                    for asset in assets:
-                        x_it = x_it_values.get(asset.id, 0)
-                        weights_t[asset.name] = x_it / total_value
-                else:
-                    for asset in assets:
-                        weights_t[asset.name] = 0
-
-                # Agregar resultado
-                result.append({
-                    'date': date,
-                    'portfolio_value': total_value,
-                    'weights': weights_t
-                })
-
-            return Response(result, status=status.HTTP_200_OK)
-
-        except Exception as e:
+        try:
+            # Paso 2 (NDJSON): entregar una línea por fecha a medida que se lee
+            if request.accepted_renderer.format == NDJSONRenderer.format and not (resample or max_points):
+                rows = await aiter_portfolio_value(portfolio, date_start, date_end)
+                return StreamingHttpResponse(
+                    andjson_lines(rows), content_type=NDJSONRenderer.media_type)
+
+            # Paso 2: Leer V_t y w_it materializados (las fechas pendientes se valorizan en memoria)
+            result = await aportfolio_value(portfolio, date_start, date_end, resample, max_points)
+        except ValueError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        return Response(result, status=status.HTTP_200_OK)
+
+
+MAX_BATCH_PORTFOLIOS = 500
+
+
+@extend_schema(
+    tags=["Portfolio Value"],
+    request={
+        "application/json": {
+            "type": "object",
+            "properties": {
+                "portfolio_ids": {
+                    "type": "array",
+                    "items": {"type": "integer"},
+                    "example": [1, 2],
+                    "description": f"IDs of the portfolios to value (max {MAX_BATCH_PORTFOLIOS})"
+                },
+                "dateStart": {"type": "string", "format": "date", "example": "2022-02-15"},
+                "dateEnd": {"type": "string", "format": "date", "example": "2022-03-15"},
+                "gaps": {
+                    "type": "string",
+                    "enum": list(GAP_POLICIES),
+                    "example": "skip",
+                    "description": "Dates with missing prices: skip them, forward-fill or interpolate (default from settings)"
+                }
+            },
+            "required": ["portfolio_ids", "dateStart", "dateEnd"]
+        }
+    },
+    responses={
+        200: {
+            "type": "object",
+            "additionalProperties": {
+                "oneOf": [
+                    {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "date": {"type": "string", "format": "date", "example": "2022-05-15"},
+                                "portfolio_value": {"type": "number", "example": 1000000000.00},
+                                "weights": {"type": "object", "additionalProperties": {"type": "number"}}
+                            }
+                        }
+                    },
+                    {"type": "object", "properties": {"error": {"type": "string"}}}
+                ]
+            },
+            "description": "Daily V_t and w_{i,t} keyed by portfolio id; portfolios that cannot be valued carry an error instead."
+        },
+        400: OpenApiTypes.OBJECT
+    },
+    description=(
+        "📦 Values many portfolios over one date range in a single request. "
+        "Prices for the union of their assets are read once."
+    )
+)
+class BatchPortfolioValueAPIView(AsyncAPIView):
+    renderer_classes = SERIES_RENDERER_CLASSES
+
+    async def post(self, request):
+        # Paso 1: Validar el cuerpo de la solicitud
+        data = request.data
+        try:
+            portfolio_ids = list(dict.fromkeys(int(pk) for pk in data["portfolio_ids"]))
+            date_start = datetime.strptime(data["dateStart"], "%Y-%m-%d").date()
+            date_end = datetime.strptime(data["dateEnd"], "%Y-%m-%d").date()
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {"error": "Debe enviar portfolio_ids (lista de IDs), dateStart y dateEnd (YYYY-MM-DD)"},
+                status=status.HTTP_400_BAD_REQUEST)
+        if not portfolio_ids or len(portfolio_ids) > MAX_BATCH_PORTFOLIOS:
+            return Response(
+                {"error": f"portfolio_ids debe tener entre 1 y {MAX_BATCH_PORTFOLIOS} IDs"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # Paso 2: Valorizar todos los portafolios con una sola lectura de precios
+        try:
+            result = await abatch_portfolio_values(portfolio_ids, date_start, date_end, data.get("gaps"))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(result, status=status.HTTP_200_OK)
+
 
 @extend_schema(
     tags=["Portfolio Trade"],
@@ -427,6 +468,17 @@ class PortfolioValueAPIView(APIView):
                     "type": "number",
                     "example": 200000000,
                     "description": "Amount in USD for the trade"
+                },
+                "dry_run": {
+                    "type": "boolean",
+                    "default": False,
+                    "description": "Simulate in memory and return the post-trade series without writing anything"
+                },
+                "date_end": {
+                    "type": "string",
+                    "format": "date",
+                    "example": "2023-02-15",
+                    "description": "Last date of the returned series in dry-run mode (default: today)"
                 }
             },
             "required": ["date", "sell_asset_symbol", "buy_asset_symbol", "amount"]
@@ -451,159 +503,148 @@ class PortfolioValueAPIView(APIView):
                     }
                 }
             },
-            "description": "Daily evolution after the trade including total value (V_t) and asset weights (w_{i,t})"
+            "description": "Dry run: daily evolution after the trade including total value (V_t) and asset weights (w_{i,t})"
         },
-        400: OpenApiTypes.OBJECT
+        200: OpenApiResponse(description="Trade recorded (dry_run false)"),
+        400: OpenApiTypes.OBJECT,
+        404: OpenApiTypes.OBJECT
     },
     description=(
         "💱 Simulates a trade by selling and buying assets in a portfolio on a specific date. "
-        "Returns the portfolio evolution over time (V_t and w_{i,t}) for the following days."
+        "With `dry_run` nothing is written: the trade is applied to the in-memory positions and "
+        "the portfolio evolution over time (V_t and w_{i,t}) for the following days is returned."
     )
 )
-class TradeSimulationAPIView(APIView):
-    def post(self, request, pk):
+class TradeSimulationAPIView(AsyncAPIView):
+    renderer_classes = SERIES_RENDERER_CLASSES
+
+    async def post(self, request, pk):
+        # Paso 1: Validar datos del request
+        data = request.data
         try:
-            # Paso 1: Obtener datos del request
-            data = request.data
-            transaction_date = datetime.strptime(
-                data["date"], "%Y-%m-%d").date()
+            transaction_date = datetime.strptime(data["date"], "%Y-%m-%d").date()
             sell_asset_symbol = data["sell_asset_symbol"]
             buy_asset_symbol = data["buy_asset_symbol"]
             amount = Decimal(str(data["amount"]))
+            dry_run = str(data.get("dry_run", "")).lower() in ("1", "true")
+            date_end = data.get("date_end")
+            date_end = datetime.strptime(date_end, "%Y-%m-%d").date() if date_end else None
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            return Response(
+                {"error": "Debe enviar date (YYYY-MM-DD), sell_asset_symbol, buy_asset_symbol y amount"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # Paso 2: Obtener entidades relacionadas
+        portfolio = await aget_object_or_404(Portfolio, pk=pk)
+        try:
+            sell_asset = await Asset.objects.aget(symbol=sell_asset_symbol)
+            buy_asset = await Asset.objects.aget(symbol=buy_asset_symbol)
+        except Asset.DoesNotExist:
+            return Response({"error": "Activo no encontrado"}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Paso 2: Validar y obtener entidades relacionadas
-            try:
-                sell_asset = Asset.objects.get(symbol=sell_asset_symbol)
-                buy_asset = Asset.objects.get(symbol=buy_asset_symbol)
-                portfolio = Portfolio.objects.get(pk=pk)
-
-                # Buscar el precio más reciente antes o en la fecha de la transacción
-                sell_price_record = Price.objects.filter(
-                    asset=sell_asset, date__lte=transaction_date
-                ).order_by("-date").first()
-
-                buy_price_record = Price.objects.filter(
-                    asset=buy_asset, date__lte=transaction_date
-                ).order_by("-date").first()
-
-                if not sell_price_record or not buy_price_record:
-                    return Response(
-                        {"error": "No se encontraron precios históricos para los activos"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                sell_price = sell_price_record.price  # Extraer el valor numérico
-                buy_price = buy_price_record.price    # Extraer el valor numérico
-
-            except (Portfolio.DoesNotExist, Asset.DoesNotExist) as e:
-                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Paso 3: Registrar la transacción
-            # Evento de venta
-            PortfolioEvent.objects.create(
-                portfolio=portfolio,
-                asset=sell_asset,
-                type=PortfolioEvent.EventType.SELL,
-                amount=amount,
-                price=sell_price,
-                date=transaction_date,
-                currency="USD"
-            )
+        try:
+            # Paso 3 (dry run): aplicar el trade en memoria y devolver la evolución
+            if dry_run:
+                result = await apreview_trade(
+                    portfolio, transaction_date, sell_asset, buy_asset, amount, date_end)
+                return Response(result, status=status.HTTP_201_CREATED)
 
-            # Evento de compra
-            PortfolioEvent.objects.create(
-                portfolio=portfolio,
-                asset=buy_asset,
-                type=PortfolioEvent.EventType.BUY,
-                amount=amount,
-                price=buy_price,
-                date=transaction_date,
-                currency="USD"
-            )
+            # Paso 3: Registrar la transacción y actualizar el historial
+            await asimulate_trade(portfolio, transaction_date, sell_asset, buy_asset, amount)
+        except TradeError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Paso 4: Actualizar las cantidades
-            # Calcular la cantidad adquirida del activo comprado
-            buy_quantity = amount / Decimal(buy_price)
+        # Respuesta exitosa
+        return Response({"message": "Transacción procesada correctamente"}, status=status.HTTP_200_OK)
 
-            # Obtener o crear la cantidad del activo comprado
-            quantity_record, created = Quantity.objects.get_or_create(
-                portfolio=portfolio,
-                asset=buy_asset,
-                date=transaction_date,
-                defaults={"quantity": buy_quantity}
-            )
-            if not created:
-                quantity_record.quantity = Decimal(
-                    quantity_record.quantity) + Decimal(buy_quantity)
-                quantity_record.save()
-
-            # Paso 5: Calcular el nuevo historial
-            # Obtener todas las cantidades y precios del portafolio
-            quantities = Quantity.objects.filter(
-                portfolio=portfolio, date__gte=transaction_date)
-            total_value = Decimal(0)
-
-            for q in quantities:
-                price_record = Price.objects.filter(
-                    asset=q.asset, date__lte=transaction_date
-                ).order_by("-date").first()
-
-                if not price_record:
-                    return Response(
-                        {"error": f"No se encontró un precio para el activo {q.asset.symbol}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                asset_price = price_record.price
-                monetary_value = Decimal(q.quantity) * Decimal(asset_price)
-                total_value += monetary_value
-
-                # Actualizar Amount
-                Amount.objects.update_or_create(
-                    portfolio=portfolio,
-                    asset=q.asset,
-                    date=transaction_date,
-                    defaults={"amount": monetary_value}
-                )
-
-            # Calcular pesos y actualizar Weight
-            for q in quantities:
-                price_record = Price.objects.filter(
-                    asset=q.asset, date__lte=transaction_date
-                ).order_by("-date").first()
-
-                if not price_record:
-                    return Response(
-                        {"error": f"No se encontró un precio para el activo {q.asset.symbol}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                asset_amount = Amount.objects.get(
-                    portfolio=portfolio, asset=q.asset, date=transaction_date).amount
-                weight = Decimal(asset_amount) / \
-                    total_value if total_value > 0 else Decimal(0)
-                Weight.objects.update_or_create(
-                    portfolio=portfolio,
-                    asset=q.asset,
-                    date=transaction_date,
-                    defaults={"weight": weight}
-                )
-
-            # Actualizar PortfolioValue
-            PortfolioValue.objects.update_or_create(
-                portfolio=portfolio,
-                date=transaction_date,
-                defaults={"value": total_value}
-            )
 
-            # Respuesta exitosa
-            return Response({"message": "Transacción procesada correctamente"}, status=status.HTTP_200_OK)
+MAX_SWEEP_SCENARIOS = 5000
 
-        except Portfolio.DoesNotExist:
-            return Response({"error": "Portafolio no encontrado"}, status=status.HTTP_400_BAD_REQUEST)
-        except Asset.DoesNotExist:
-            return Response({"error": "Activo no encontrado"}, status=status.HTTP_400_BAD_REQUEST)
-        except Price.DoesNotExist:
-            return Response({"error": "Precio no encontrado"}, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
-            return Response({"error": f"Error inesperado: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@extend_schema(
+    tags=["Portfolio Trade"],
+    request={
+        "application/json": {
+            "type": "object",
+            "properties": {
+                "dates": {
+                    "type": "array",
+                    "items": {"type": "string", "format": "date"},
+                    "example": ["2022-05-15", "2022-08-15"],
+                    "description": "Trade dates (YYYY-MM-DD)"
+                },
+                "amounts": {
+                    "type": "array",
+                    "items": {"type": "number"},
+                    "example": [100000000, 200000000],
+                    "description": "Trade amounts in USD"
+                },
+                "pairs": {
+                    "type": "array",
+                    "items": {"type": "array", "items": {"type": "string"}, "minItems": 2, "maxItems": 2},
+                    "example": [["EEUU", "Europa"], ["UK", "Japón"]],
+                    "description": "[sell_asset_symbol, buy_asset_symbol] pairs"
+                },
+                "date_end": {
+                    "type": "string",
+                    "format": "date",
+                    "example": "2023-02-15",
+                    "description": "Last valuation date (default: today)"
+                }
+            },
+            "required": ["dates", "amounts", "pairs"]
+        }
+    },
+    responses={
+        200: {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "date": {"type": "string", "format": "date"},
+                    "sell": {"type": "string"},
+                    "buy": {"type": "string"},
+                    "amount": {"type": "number"},
+                    "final_value": {"type": "number", "nullable": True},
+                    "weight_drift": {"type": "number", "nullable": True},
+                    "max_drawdown": {"type": "number", "nullable": True},
+                    "error": {"type": "string", "nullable": True}
+                }
+            },
+            "description": "One row per scenario of the dates × amounts × pairs grid"
+        },
+        400: OpenApiTypes.OBJECT
+    },
+    description=(
+        "🧪 Simulates every trade of a dates × amounts × asset pairs grid in memory (nothing is written) "
+        f"and returns final V_t, weight drift and max drawdown per scenario (max {MAX_SWEEP_SCENARIOS} scenarios)."
+    )
+)
+class TradeSweepAPIView(APIView):
+    def post(self, request, pk):
+        # Paso 1: Validar la grilla de escenarios
+        data = request.data
+        try:
+            dates = [datetime.strptime(d, "%Y-%m-%d").date() for d in data["dates"]]
+            amounts = [float(a) for a in data["amounts"]]
+            pairs = [(str(sell), str(buy)) for sell, buy in data["pairs"]]
+            date_end = data.get("date_end")
+            date_end = datetime.strptime(date_end, "%Y-%m-%d").date() if date_end else None
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {"error": "Debe enviar dates (YYYY-MM-DD), amounts y pairs ([venta, compra])"},
+                status=status.HTTP_400_BAD_REQUEST)
+        if len(dates) * len(amounts) * len(pairs) > MAX_SWEEP_SCENARIOS:
+            return Response(
+                {"error": f"La grilla no puede superar {MAX_SWEEP_SCENARIOS} escenarios"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        portfolio = get_object_or_404(Portfolio, pk=pk)
+
+        # Paso 2: Simular todos los escenarios sobre un mismo panel de precios
+        try:
+            result = sweep_trades(portfolio, dates, amounts, pairs, date_end)
+        except TradeError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(result, status=status.HTTP_200_OK)
@@ -1,6 +1,7 @@
 # investment_portfolio/config/base.py
 
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 from django.core.exceptions import ImproperlyConfigured
@@ -33,6 +34,7 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "apps.portfolios",
     "rest_framework",
+    "adrf",
     "drf_spectacular",
 ]
 
@@ -49,8 +51,10 @@ SPECTACULAR_SETTINGS = {
 
 # 6) Middleware (añadimos WhiteNoise para servir estáticos)
 MIDDLEWARE = [
+    "apps.common.profiling.SlowRequestMiddleware",       # perfil de solicitudes lentas (admin/diagnosticos)
+    "apps.common.metrics.MetricsMiddleware",             # latencia y SQL por vista (/metrics)
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",        # <–– sirve estáticos en prod
+    "apps.common.staticfiles.WhiteNoiseMiddleware",      # <–– sirve estáticos en prod (también async)
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -113,3 +117,49 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 # 11) Campo por defecto en modelos
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# 12) Panel de precios compartido entre workers (archivos mapeados en memoria)
+PRICE_PANEL_CACHE_ENABLED = os.getenv("PRICE_PANEL_CACHE_ENABLED", "True").lower() in ("1", "true", "yes")
+PRICE_PANEL_CACHE_DIR = os.getenv(
+    "PRICE_PANEL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "investment_portfolio_prices"))
+
+# 13) Archivos Excel subidos en espera del worker de cargas (process_excel_jobs); una carga
+# en ejecución sin latido por más de INGESTION_JOB_LEASE_SECONDS se vuelve a tomar, hasta
+# INGESTION_JOB_MAX_ATTEMPTS intentos
+INGESTION_UPLOAD_DIR = os.getenv("INGESTION_UPLOAD_DIR", str(BASE_DIR / "uploads"))
+INGESTION_JOB_LEASE_SECONDS = int(os.getenv("INGESTION_JOB_LEASE_SECONDS", 300))
+INGESTION_JOB_MAX_ATTEMPTS = int(os.getenv("INGESTION_JOB_MAX_ATTEMPTS", 3))
+
+# 14) Procesos para los barridos de escenarios de trades
+SCENARIO_SWEEP_PROCESSES = int(os.getenv("SCENARIO_SWEEP_PROCESSES", os.cpu_count() or 1))
+
+# 15) Antigüedad máxima (días) de un precio "as-of" para considerarlo vigente; vacío = sin límite
+PRICE_ASOF_MAX_STALENESS_DAYS = int(os.getenv("PRICE_ASOF_MAX_STALENESS_DAYS") or 0) or None
+
+# 16) Fechas con precios faltantes en la valorización: skip, ffill o interpolate
+# (al cambiarla, las valorizaciones ya materializadas deben recalcularse)
+VALUATION_GAP_POLICY = os.getenv("VALUATION_GAP_POLICY", "skip")
+
+# 17) Frecuencia de los checkpoints de posiciones (weekly, monthly o quarterly)
+HOLDING_CHECKPOINT_FREQUENCY = os.getenv("HOLDING_CHECKPOINT_FREQUENCY", "monthly")
+
+# 18) Filas de la serie materializada en caché por proceso (tramos mensuales, LRU); 0 = desactivada
+VALUATION_SEGMENT_CACHE_ROWS = int(os.getenv("VALUATION_SEGMENT_CACHE_ROWS", 100_000))
+
+# 19) Métricas Prometheus (/metrics) compartidas entre workers: cada proceso escribe
+# en este directorio, que debe vaciarse al arrancar el servidor (ver entrypoint.sh)
+PROMETHEUS_MULTIPROC_DIR = os.getenv(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "investment_portfolio_metrics"))
+os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+# prometheus_client lo lee de la variable de entorno al importarse
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = PROMETHEUS_MULTIPROC_DIR
+
+# 20) Captura de solicitudes lentas (perfil y planes de las consultas más lentas, ver
+# admin/diagnosticos/): presupuesto de latencia en ms (0 = solo con el header firmado),
+# directorio, capturas que se conservan, consultas por captura y vigencia del token (s)
+SLOW_REQUEST_BUDGET_MS = int(os.getenv("SLOW_REQUEST_BUDGET_MS", 2000))
+PROFILE_CAPTURE_DIR = os.getenv(
+    "PROFILE_CAPTURE_DIR", os.path.join(tempfile.gettempdir(), "investment_portfolio_profiles"))
+PROFILE_CAPTURE_KEEP = int(os.getenv("PROFILE_CAPTURE_KEEP", 50))
+PROFILE_SLOW_SQL = int(os.getenv("PROFILE_SLOW_SQL", 5))
+PROFILE_TOKEN_MAX_AGE = int(os.getenv("PROFILE_TOKEN_MAX_AGE", 3600))
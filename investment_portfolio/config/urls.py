@@ -1,9 +1,11 @@
 from django.urls import path, include
 from apps.admin_custom.admin import admin_site
+from apps.common.metrics import METRICS_VIEW, metrics_view
 
 
 urlpatterns = [
     path("admin/", admin_site.urls),
     path("portfolios/", include("apps.portfolios.urls")),
     path("api/", include("api.schemas.openapi")),
+    path("metrics", metrics_view, name=METRICS_VIEW),
 ]